@@ -0,0 +1,161 @@
+import inspect
+import logging
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Бэкенд — вызываемый объект с интерфейсом модели: тензор (N, 3, H, W) float RGB -> (N, 3, H*s, W*s)
+Backend = Callable[[torch.Tensor], torch.Tensor]
+
+# Размер входа при экспорте; оси N, H, W объявляются динамическими
+_EXPORT_SHAPE = (1, 3, 64, 64)
+# Новые версии torch по умолчанию экспортируют в ONNX через dynamo, а здесь нужен
+# классический экспорт с dynamic_axes; torch 2.0 параметра `dynamo` еще не знает
+_EXPORT_KWARGS = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+
+
+class TorchScriptBackend:
+    """
+    Граф, трассированный torch.jit и замороженный (`freeze` + `optimize_for_inference`):
+    веса становятся константами, conv и PReLU сливаются, исчезают накладные расходы
+    Python-модуля на каждый слой. Экспортированный файл переиспользуется между запусками.
+    """
+
+    def __init__(self, model: torch.nn.Module, path: Path):
+        if not path.exists():
+            with torch.no_grad():
+                traced = torch.jit.trace(model.eval(), torch.rand(_EXPORT_SHAPE))
+            torch.jit.save(traced, str(path))
+            logger.info(f"TorchScript-модель экспортирована: {path}")
+
+        module = torch.jit.load(str(path), map_location="cpu").eval()
+        self.module = torch.jit.optimize_for_inference(torch.jit.freeze(module))
+
+    @torch.no_grad()
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        return self.module(tensor.float())
+
+
+class OnnxBackend:
+    """
+    Инференс через ONNX Runtime (CPUExecutionProvider) с полными оптимизациями графа.
+    При `quantize` используется int8-вариант, полученный динамической квантизацией весов.
+    onnxruntime — необязательная зависимость, импортируется только при выборе бэкенда.
+    """
+
+    def __init__(self, model: torch.nn.Module, path: Path, quantize: bool = False):
+        import onnxruntime as ort
+
+        if not path.exists():
+            with torch.no_grad():
+                torch.onnx.export(
+                    model.eval(),
+                    torch.rand(_EXPORT_SHAPE),
+                    str(path),
+                    input_names=["input"],
+                    output_names=["output"],
+                    dynamic_axes={"input": {0: "n", 2: "h", 3: "w"}, "output": {0: "n", 2: "h", 3: "w"}},
+                    opset_version=17,
+                    **_EXPORT_KWARGS,
+                )
+            logger.info(f"ONNX-модель экспортирована: {path}")
+
+        if quantize:
+            path = self._quantized(path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Та же доля ядер, что выделена воркеру для torch (см. UPSCALE_TORCH_THREADS)
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+    @staticmethod
+    def _quantized(path: Path) -> Path:
+        """int8-вариант модели рядом с fp32 (квантизуется один раз)."""
+        quantized = path.with_name(f"{path.stem}.int8{path.suffix}")
+        if not quantized.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(str(path), str(quantized), weight_type=QuantType.QUInt8)
+            logger.info(f"int8-модель сохранена: {quantized}")
+        return quantized
+
+    def __call__(self, tensor: torch.Tensor) -> torch.Tensor:
+        (output,) = self.session.run(None, {"input": tensor.float().cpu().numpy()})
+        return torch.from_numpy(output)
+
+
+def create_backend(name: str, model: torch.nn.Module, model_path: Path, device: str) -> Backend:
+    """
+    Оборачивает загруженную torch-модель выбранным бэкендом:
+    "torch" — как есть, "torchscript", "onnx", "onnx-int8".
+    Экспортированные графы кладутся рядом с весами (`models/`).
+    На GPU используется только "torch".
+    """
+    if name == "torch" or device != "cpu":
+        return model
+    if name == "torchscript":
+        return TorchScriptBackend(model, model_path.with_suffix(".ts.pt"))
+    if name in ("onnx", "onnx-int8"):
+        return OnnxBackend(model, model_path.with_suffix(".onnx"), quantize=name == "onnx-int8")
+    raise ValueError(f"Неизвестный бэкенд апскейла: {name}")
+
+
+BACKENDS = ("torch", "torchscript", "onnx", "onnx-int8")
+
+
+def compare_backends(size: int = 256, runs: int = 3) -> Dict[str, Dict[str, float]]:
+    """
+    Сверяет каждый бэкенд с эталоном torch на одном и том же входе
+    и замеряет скорость: PSNR относительно torch (дБ), max отклонение в uint8
+    и мегапикселей входа в секунду.
+    """
+    from bot.ai.upscale import UpscaleService
+
+    service = UpscaleService(backend="torch")
+    model = service.upsampler.model
+    tensor = torch.rand(1, 3, size, size)
+    with torch.no_grad():
+        reference = model(tensor).clamp(0, 1).mul(255).round().numpy()
+
+    results = {}
+    for name in BACKENDS:
+        try:
+            backend = create_backend(name, model, service.model_path, "cpu")
+        except ImportError as e:
+            logger.warning(f"{name}: пропущен ({e})")
+            continue
+
+        with torch.no_grad():
+            output = backend(tensor).clamp(0, 1).mul(255).round().numpy()
+            started = time.perf_counter()
+            for _ in range(runs):
+                backend(tensor)
+            seconds = (time.perf_counter() - started) / runs
+
+        mse = float(np.mean((output - reference) ** 2))
+        results[name] = {
+            "psnr_db": 10 * np.log10(255.0 ** 2 / mse) if mse else float("inf"),
+            "max_diff": float(np.abs(output - reference).max()),
+            "mpix_per_sec": size * size / seconds / 1e6,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    # python -m bot.ai.backends [size] [runs]
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    tile_size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    for backend_name, metrics in compare_backends(tile_size, runs).items():
+        print(
+            f"{backend_name:>12}: PSNR {metrics['psnr_db']:.1f} дБ, "
+            f"max diff {metrics['max_diff']:.0f}, {metrics['mpix_per_sec']:.3f} Мпикс/с"
+        )
@@ -0,0 +1,109 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+_Item = Tuple[torch.Tensor, Future]
+
+
+class MicroBatcher:
+    """
+    Движок микро-батчинга для инференса.
+
+    Собирает тензоры (N=1) от разных запросов в пределах короткого окна,
+    склеивает тензоры одинаковой формы в один батч и делает один forward-проход.
+    Результаты раздаются обратно через `Future`.
+
+    `max_batch` и `window_ms` задают компромисс: больше батч и окно —
+    выше пропускная способность, но выше задержка одиночного запроса.
+    """
+
+    def __init__(
+        self,
+        model_fn: Callable[[torch.Tensor], torch.Tensor],
+        max_batch: int = 8,
+        window_ms: float = 15,
+    ):
+        self.max_batch = max(1, max_batch)
+        self._model_fn = model_fn
+        self._window = window_ms / 1000
+        self._queue: "queue.Queue[Optional[_Item]]" = queue.Queue()
+
+        # Счетчики для подбора параметров
+        self.batches = 0
+        self.items = 0
+
+        self._thread = threading.Thread(target=self._loop, name="upscale-batcher", daemon=True)
+        self._thread.start()
+
+    @property
+    def avg_batch(self) -> float:
+        """Средний фактический размер батча."""
+        return self.items / self.batches if self.batches else 0.0
+
+    def submit(self, tensor: torch.Tensor) -> Future:
+        """Ставит тензор формы (1, C, H, W) в очередь на инференс."""
+        future: Future = Future()
+        self._queue.put((tensor, future))
+        return future
+
+    def close(self) -> None:
+        """Останавливает фоновый поток после обработки уже поставленных тензоров."""
+        self._queue.put(None)
+        self._thread.join()
+
+    # -------------------------------------------------------------------------
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            batch: List[_Item] = [first]
+            deadline = time.monotonic() + self._window
+            stop = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._run(batch)
+            if stop:
+                return
+
+    def _run(self, batch: List[_Item]) -> None:
+        # Склеивать можно только тензоры одной формы
+        groups: Dict[torch.Size, List[_Item]] = defaultdict(list)
+        for tensor, future in batch:
+            groups[tensor.shape].append((tensor, future))
+
+        for items in groups.values():
+            try:
+                with torch.no_grad():
+                    output = self._model_fn(torch.cat([tensor for tensor, _ in items]))
+            except Exception as e:
+                logger.error(f"Ошибка батч-инференса ({len(items)} тайлов): {e}")
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            for index, (_, future) in enumerate(items):
+                future.set_result(output[index:index + 1])
@@ -0,0 +1,165 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from bot.config import (
+    TELEGRAM_UPLOAD_LIMIT_MB,
+    UPSCALE_JPEG_QUALITY,
+    UPSCALE_OUTPUT_FORMAT,
+    UPSCALE_PNG_COMPRESSION,
+    UPSCALE_WEBP_QUALITY,
+)
+from bot.metrics import ENCODE_SECONDS
+from bot.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Формат: (расширение, параметры cv2.imencode)
+Format = Tuple[str, List[int]]
+
+# Сторона центрального фрагмента, по которому оценивается размер файла
+_SAMPLE_SIDE = 512
+# Запас к оценке: сжимаемость фрагмента не равна сжимаемости всего кадра
+_ESTIMATE_MARGIN = 1.15
+# Нижняя граница качества JPEG в крайнем случае; дальше уменьшается разрешение
+_MIN_JPEG_QUALITY = 70
+# Предел стороны кадра в WebP: крупнее формат не кодирует
+_WEBP_MAX_SIDE = 16383
+
+_EXTENSIONS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg", "jpg": ".jpg"}
+
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    ext: str
+    seconds: float
+
+
+def detect_extension(data: bytes) -> str:
+    """Расширение по сигнатуре файла (результат кодировщика может быть любым из форматов)."""
+    if data.startswith(b"\x89PNG"):
+        return ".png"
+    if data.startswith(b"\xff\xd8"):
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return ".bin"
+
+
+class OutputEncoder:
+    """
+    Кодирует результат апскейла так, чтобы файл гарантированно влез в лимит Telegram.
+
+    Форматы перебираются от предпочтительного к более компактным
+    (PNG -> WebP -> JPEG). Размер каждого оценивается по центральному
+    фрагменту, поэтому заведомо неподходящий формат не кодируется целиком.
+    Если не влез даже JPEG минимального качества, кадр уменьшается.
+    Формат, который не смог закодировать кадр, тоже пропускается.
+    """
+
+    def __init__(
+        self,
+        preferred: str = UPSCALE_OUTPUT_FORMAT,
+        png_compression: int = UPSCALE_PNG_COMPRESSION,
+        webp_quality: int = UPSCALE_WEBP_QUALITY,
+        jpeg_quality: int = UPSCALE_JPEG_QUALITY,
+        max_bytes: int = TELEGRAM_UPLOAD_LIMIT_MB * 1024 * 1024,
+    ):
+        self.preferred = _EXTENSIONS[preferred.lower()]
+        self.max_bytes = max_bytes
+        self._formats = {
+            ".png": (".png", [cv2.IMWRITE_PNG_COMPRESSION, png_compression]),
+            ".webp": (".webp", [cv2.IMWRITE_WEBP_QUALITY, webp_quality]),
+            ".jpg": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]),
+        }
+
+    def _chain(self, preferred: str) -> List[Format]:
+        """Предпочтительный формат, затем более компактные."""
+        order = [".png", ".webp", ".jpg"]
+        return [self._formats[ext] for ext in order[order.index(preferred):]]
+
+    def encode(self, img: np.ndarray, ext: Optional[str] = None) -> EncodedImage:
+        started = time.perf_counter()
+        preferred = _EXTENSIONS[ext.lstrip(".").lower()] if ext else self.preferred
+        with span("encode", shape=img.shape[:2]):
+            data, fmt, attempts = self._encode_fitting(img, preferred)
+
+        result = EncodedImage(data=data, ext=fmt, seconds=time.perf_counter() - started)
+        ENCODE_SECONDS.observe(result.seconds, format=result.ext[1:])
+        h, w = img.shape[:2]
+        logger.info(
+            f"Кодирование {w}x{h} -> {result.ext[1:]}: {len(data) / 1024 / 1024:.2f} МБ "
+            f"за {result.seconds:.2f} с (попыток: {attempts})"
+        )
+        return result
+
+    def _encode_fitting(self, img: np.ndarray, preferred: str) -> Tuple[bytes, str, int]:
+        attempts = 0
+        for fmt in self._chain(preferred):
+            if fmt[0] == ".webp" and max(img.shape[:2]) > _WEBP_MAX_SIDE:
+                continue
+            try:
+                if self._estimate(img, fmt) > self.max_bytes:
+                    continue
+                attempts += 1
+                # Полный кадр приводится к формату только перед настоящим кодированием
+                data = _imencode(_prepare(img, fmt[0]), fmt)
+            except (ValueError, cv2.error) as e:
+                logger.warning(f"{fmt[0][1:]} не закодировался ({e}), пробую следующий формат")
+                continue
+            if len(data) <= self.max_bytes:
+                return data, fmt[0], attempts
+            logger.info(f"{fmt[0][1:]} не влез в лимит ({len(data)} байт), пробую следующий формат")
+
+        # Крайний случай: JPEG пониже качеством, затем уменьшение разрешения
+        prepared = _prepare(img, ".jpg")
+        quality = _MIN_JPEG_QUALITY
+        while True:
+            attempts += 1
+            data = _imencode(prepared, (".jpg", [cv2.IMWRITE_JPEG_QUALITY, quality]))
+            if len(data) <= self.max_bytes:
+                return data, ".jpg", attempts
+            factor = (self.max_bytes / len(data)) ** 0.5 * 0.95
+            h, w = prepared.shape[:2]
+            size = (max(1, int(w * factor)), max(1, int(h * factor)))
+            prepared = cv2.resize(prepared, size, interpolation=cv2.INTER_AREA)
+            logger.warning(f"Результат уменьшен до {size[0]}x{size[1]}, чтобы влезть в лимит")
+
+    def _estimate(self, img: np.ndarray, fmt: Format) -> float:
+        """
+        Оценка размера файла по центральному фрагменту; 0 — кадр мал, проще закодировать целиком.
+        Фрагмент — срез исходного кадра: к формату приводится только он, без копии всего кадра.
+        """
+        h, w = img.shape[:2]
+        if h * w <= _SAMPLE_SIDE * _SAMPLE_SIDE * 4:
+            return 0
+        y0, x0 = (h - _SAMPLE_SIDE) // 2, (w - _SAMPLE_SIDE) // 2
+        sample = _prepare(img[y0:y0 + _SAMPLE_SIDE, x0:x0 + _SAMPLE_SIDE], fmt[0])
+        return len(_imencode(sample, fmt)) * (h * w) / (_SAMPLE_SIDE * _SAMPLE_SIDE) * _ESTIMATE_MARGIN
+
+
+def _prepare(img: np.ndarray, ext: str) -> np.ndarray:
+    """Приводит кадр к тому, что умеет формат: WebP и JPEG — только 8 бит, JPEG — без альфы."""
+    if ext == ".png":
+        return img
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    if ext == ".jpg" and img.ndim == 3 and img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
+
+def _imencode(img: np.ndarray, fmt: Format) -> bytes:
+    ok, encoded = cv2.imencode(fmt[0], img, fmt[1])
+    if not ok:
+        raise ValueError(f"Не удалось закодировать результат в {fmt[0]}")
+    return encoded.tobytes()
+
+
+# Singleton instance
+output_encoder = OutputEncoder()
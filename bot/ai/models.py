@@ -0,0 +1,74 @@
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from bot.config import MODELS_DIR, UPSCALE_MAX_OUTPUT_MP, UPSCALE_MODELS
+
+# Модуль не импортирует torch: выбор модели нужен и в процессе бота
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Вариант Real-ESRGAN: файл весов, масштаб и параметры архитектуры."""
+    name: str
+    filename: str
+    scale: int
+    # "srvgg" — SRVGGNetCompact, "rrdb" — RRDBNet
+    arch: str
+    num_conv: int = 32
+    num_block: int = 23
+
+    @property
+    def path(self) -> Path:
+        return MODELS_DIR / self.filename
+
+    @property
+    def available(self) -> bool:
+        return self.path.exists()
+
+    @property
+    def memory_bytes(self) -> int:
+        """Оценка памяти загруженной модели: веса fp32 плюс копия в бэкенде (ONNX/TorchScript)."""
+        return self.path.stat().st_size * 2 if self.available else 0
+
+
+MODELS: Dict[str, ModelSpec] = {
+    spec.name: spec
+    for spec in (
+        ModelSpec("general-x4", "realesr-general-x4v3.pth", scale=4, arch="srvgg", num_conv=32),
+        ModelSpec("anime-video-x4", "realesr-animevideov3.pth", scale=4, arch="srvgg", num_conv=16),
+        ModelSpec("x2", "RealESRGAN_x2plus.pth", scale=2, arch="rrdb", num_block=23),
+    )
+}
+
+
+def enabled_models() -> List[ModelSpec]:
+    """Модели из UPSCALE_MODELS, веса которых лежат в models/, в порядке предпочтения."""
+    names = [name.strip() for name in UPSCALE_MODELS.split(",") if name.strip()]
+    return [MODELS[name] for name in names if MODELS[name].available]
+
+
+def select_model(
+    height: int, width: int, max_output_pixels: int = int(UPSCALE_MAX_OUTPUT_MP * 1_000_000)
+) -> Tuple[ModelSpec, float]:
+    """
+    Подбирает модель под размер входа: самый крупный масштаб, при котором
+    результат укладывается в `max_output_pixels`. При равном масштабе
+    побеждает модель, указанная в UPSCALE_MODELS раньше.
+
+    Возвращает модель и коэффициент предварительного уменьшения входа
+    (1.0 — без уменьшения): если даже наименьший масштаб не влезает в лимит,
+    вход уменьшается так, чтобы влез.
+    """
+    candidates = enabled_models()
+    if not candidates:
+        raise FileNotFoundError(f"В {MODELS_DIR} нет весов ни одной модели из UPSCALE_MODELS")
+
+    pixels = height * width
+    fitting = [spec for spec in candidates if pixels * spec.scale ** 2 <= max_output_pixels]
+    if fitting:
+        return max(fitting, key=lambda spec: spec.scale), 1.0
+
+    smallest = min(candidates, key=lambda spec: spec.scale)
+    return smallest, math.sqrt(max_output_pixels / (pixels * smallest.scale ** 2))
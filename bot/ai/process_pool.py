@@ -0,0 +1,164 @@
+import logging
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from bot.ai.models import MODELS
+from bot.config import UPSCALE_VIDEO_MODEL
+from bot.metrics import MODEL_LOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Экземпляр модели внутри дочернего процесса (по одному на процесс)
+_SERVICE: Optional[Any] = None
+# Загрузки моделей в дочернем процессе (модель, секунды): метрики отдает
+# процесс бота, поэтому они уходят туда вместе с результатом вызова
+_LOADS: List[Tuple[str, float]] = []
+
+
+# =============================================================================
+# Код, выполняющийся в дочернем процессе
+# =============================================================================
+
+def _init_worker(service_kwargs: dict) -> None:
+    """Инициализатор процесса: пул моделей живет весь срок жизни процесса."""
+    global _SERVICE
+    from bot.ai.upscale import ModelPool
+
+    _SERVICE = ModelPool(on_load=lambda name, seconds: _LOADS.append((name, seconds)), **service_kwargs)
+
+
+def _invoke(fn: Callable[..., Any], *args: Any) -> Tuple[Any, List[Tuple[str, float]]]:
+    """Результат вызова и загрузки моделей, накопленные с прошлого успешного вызова."""
+    result = fn(*args)
+    loads = _LOADS[:]
+    _LOADS.clear()
+    return result, loads
+
+
+def _ping() -> bool:
+    return _SERVICE is not None
+
+
+def _warm_up() -> None:
+    _SERVICE.warm_up()
+
+
+def _upscale_file(input_path: str, output_path: str) -> str:
+    # Чтение и кодирование файлов тоже происходят здесь, вне GIL бота
+    return str(_SERVICE.upscale(input_path, output_path))
+
+
+def _upscale_bytes(data: bytes, ext: Optional[str]) -> bytes:
+    return _SERVICE.upscale_bytes(data, ext)
+
+
+def _upscale_shared(
+    method: str, in_name: str, in_shape: tuple, dtype: str, out_name: str, out_shape: tuple
+) -> None:
+    """
+    Читает кадр (или пачку кадров) из shared memory и пишет результат
+    прямо в выходной сегмент методом сервиса `method` (`upscale_into` / `upscale_batch_into`).
+    """
+    in_shm = SharedMemory(name=in_name)
+    out_shm = SharedMemory(name=out_name)
+    try:
+        img = np.ndarray(in_shape, dtype=dtype, buffer=in_shm.buf)
+        output = np.ndarray(out_shape, dtype=dtype, buffer=out_shm.buf)
+        getattr(_SERVICE, method)(img, output)
+        # Представления должны умереть до close(), иначе BufferError
+        del img, output
+    finally:
+        in_shm.close()
+        out_shm.close()
+
+
+# =============================================================================
+# Прокси в процессе бота
+# =============================================================================
+
+class ProcessUpscaleService:
+    """
+    Прокси к `ModelPool`, живущему в отдельном процессе.
+
+    Интерфейс совпадает с `ModelPool` (`upscale`, `upscale_bytes`,
+    `upscale_array`, `upscale_batch`),
+    поэтому планировщик работает с ним так же, как с обычным сервисом.
+    Декодированные кадры передаются через `multiprocessing.shared_memory`
+    без pickle: через очередь процесса идут только имена сегментов и формы.
+    """
+
+    # Масштаб модели для массивов и видео; реестр моделей не тянет torch в процесс бота
+    SCALE = MODELS[UPSCALE_VIDEO_MODEL].scale
+
+    def __init__(self, **service_kwargs: Any):
+        self._service_kwargs = service_kwargs
+        self._executor = self._spawn()
+
+    def _spawn(self) -> ProcessPoolExecutor:
+        # spawn: одинаково ведет себя на Windows/Linux и не наследует состояние event loop
+        executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._service_kwargs,),
+        )
+        # Дожидаемся запуска процесса, чтобы ошибки импорта всплыли сразу
+        executor.submit(_ping).result()
+        return executor
+
+    def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        try:
+            result, loads = self._executor.submit(_invoke, fn, *args).result()
+        except BrokenProcessPool:
+            # Процесс убит (например, OOM) — поднимаем новый для следующих задач
+            logger.error("Процесс апскейла упал, перезапускаю")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._spawn()
+            raise
+        for name, seconds in loads:
+            MODEL_LOAD_SECONDS.observe(seconds, model=name)
+        return result
+
+    def warm_up(self) -> None:
+        self._call(_warm_up)
+
+    def upscale(self, input_path: str | Path, output_path: str | Path) -> Path:
+        return Path(self._call(_upscale_file, str(input_path), str(output_path)))
+
+    def upscale_bytes(self, data: bytes, ext: Optional[str] = None) -> bytes:
+        # Закодированный файл компактен, его дешевле передать как есть:
+        # декодирование и кодирование остаются в дочернем процессе
+        return self._call(_upscale_bytes, data, ext)
+
+    def upscale_array(self, img: np.ndarray) -> np.ndarray:
+        h, w = img.shape[:2]
+        out_shape = (h * self.SCALE, w * self.SCALE) + img.shape[2:]
+        return self._transfer("upscale_into", img, out_shape)
+
+    def upscale_batch(self, frames: np.ndarray) -> np.ndarray:
+        n, h, w = frames.shape[:3]
+        return self._transfer("upscale_batch_into", frames, (n, h * self.SCALE, w * self.SCALE, 3))
+
+    def _transfer(self, method: str, img: np.ndarray, out_shape: tuple) -> np.ndarray:
+        """Передает массив в дочерний процесс и забирает результат через shared memory."""
+        img = np.ascontiguousarray(img)
+        in_shm = SharedMemory(create=True, size=max(1, img.nbytes))
+        out_shm = SharedMemory(create=True, size=max(1, math.prod(out_shape) * img.itemsize))
+        try:
+            np.ndarray(img.shape, dtype=img.dtype, buffer=in_shm.buf)[...] = img
+            self._call(_upscale_shared, method, in_shm.name, img.shape, img.dtype.str, out_shm.name, out_shape)
+            return np.ndarray(out_shape, dtype=img.dtype, buffer=out_shm.buf).copy()
+        finally:
+            for shm in (in_shm, out_shm):
+                shm.close()
+                shm.unlink()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
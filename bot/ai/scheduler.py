@@ -0,0 +1,307 @@
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Колбэк уведомления о позиции в очереди: 0 — задача взята в работу
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class QueueFullError(Exception):
+    """Очередь переполнена — новая задача отклонена (backpressure)."""
+
+
+@dataclass
+class _Job:
+    user_id: int
+    task: Callable[[Any], Any]
+    future: asyncio.Future
+    on_position: Optional[PositionCallback] = None
+    last_position: int = 0
+    # Ключ порядка: задачи приоритетной полосы, затем по виртуальному времени окончания
+    priority: bool = False
+    start: float = 0.0
+    finish: float = 0.0
+    seq: int = 0
+
+    @property
+    def order(self) -> tuple:
+        return (not self.priority, self.finish, self.seq)
+
+
+class UpscaleScheduler:
+    """
+    Планировщик задач AI Upscale с ограниченной очередью и фиксированным числом воркеров.
+
+    Одновременно выполняется не больше `workers` инференсов: каждый воркер
+    владеет своим экземпляром сервиса (или все делят один, сериализуя вызовы),
+    а лишние задачи ждут в очереди длиной не более `max_queue`.
+
+    `serialize_shared=False` нужен для потокобезопасных сервисов (например,
+    с общим батчером): модель одна, но задачи воркеров идут параллельно.
+
+    После `start()` каждый воркер в фоне загружает модель и прогревает ее
+    (`service.warm_up()`, если метод есть). Задачи, пришедшие раньше, ждут в очереди.
+
+    Очередь справедливая (weighted fair queueing): задача получает виртуальное
+    время окончания `max(V, последнее у пользователя) + cost / weight`
+    (V — время начала последней взятой задачи), воркер
+    берет задачу с наименьшим. Пользователь, приславший десять задач, не
+    задерживает остальных больше чем на одну свою. У одного пользователя
+    выполняется не больше одной задачи за раз; задачи `priority_users`
+    (админа) идут вне очереди.
+    """
+
+    def __init__(
+        self,
+        service_factory: Callable[[], Any],
+        workers: int = 1,
+        max_queue: int = 20,
+        shared_model: bool = False,
+        serialize_shared: bool = True,
+        priority_users: Optional[Set[int]] = None,
+    ):
+        self._factory = service_factory
+        self._workers = max(1, workers)
+        self._max_queue = max_queue
+        self._shared = shared_model
+        self._serialize = serialize_shared
+
+        self._priority_users = priority_users or set()
+
+        self._pending: List[_Job] = []
+        # Виртуальное время очереди и последнее время окончания по пользователям
+        self._vtime = 0.0
+        self._user_finish: Dict[int, float] = {}
+        self._busy_users: Set[int] = set()
+        self._seq = 0
+        self._cond = asyncio.Condition()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="upscale"
+        )
+        self._worker_tasks: List[asyncio.Task] = []
+        self._notify_tasks: Set[asyncio.Task] = set()
+        self._running = 0
+        self._idle = 0
+        self._ready = 0
+
+        # Модели создаются лениво в потоках воркеров
+        self._services: List[Any] = [None] * self._workers
+        self._shared_service: Any = None
+        self._shared_lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # Публичный интерфейс
+    # -------------------------------------------------------------------------
+
+    @property
+    def queue_size(self) -> int:
+        """Количество задач, ожидающих свободного воркера."""
+        return len(self._pending)
+
+    @property
+    def in_flight(self) -> int:
+        """Количество задач, выполняющихся прямо сейчас."""
+        return self._running
+
+    @property
+    def ready(self) -> bool:
+        """Все воркеры загрузили и прогрели модели."""
+        return self._ready >= self._workers
+
+    @property
+    def is_full(self) -> bool:
+        return len(self._pending) >= self._max_queue
+
+    def user_busy(self, user_id: int) -> bool:
+        """У пользователя уже выполняется задача: новая подождет ее завершения."""
+        return user_id in self._busy_users
+
+    def start(self) -> None:
+        """
+        Запускает воркеры в текущем event loop (идемпотентно).
+        Не блокирует: загрузка моделей идет в потоках воркеров.
+        """
+        if self._worker_tasks:
+            return
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(index), name=f"upscale-worker-{index}")
+            for index in range(self._workers)
+        ]
+
+    async def stop(self) -> None:
+        """Останавливает воркеры и пул потоков."""
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._worker_tasks = []
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(
+        self,
+        user_id: int,
+        task: Callable[[Any], Any],
+        on_position: Optional[PositionCallback] = None,
+        cost: float = 1.0,
+        weight: float = 1.0,
+    ) -> Any:
+        """
+        Ставит задачу в очередь и ждет результат.
+
+        `task` получает экземпляр сервиса и выполняется в потоке воркера.
+        `cost` — относительная тяжесть задачи, `weight` — доля пользователя.
+        Если очередь заполнена, сразу бросает `QueueFullError`.
+        """
+        self.start()
+        if self.is_full:
+            raise QueueFullError(f"В очереди уже {len(self._pending)} задач")
+
+        start = max(self._vtime, self._user_finish.get(user_id, 0.0))
+        self._user_finish[user_id] = start + cost / weight
+        self._seq += 1
+        job = _Job(
+            user_id=user_id,
+            task=task,
+            future=asyncio.get_running_loop().create_future(),
+            on_position=on_position,
+            priority=user_id in self._priority_users,
+            start=start,
+            finish=self._user_finish[user_id],
+            seq=self._seq,
+        )
+        async with self._cond:
+            self._pending.append(job)
+            self._cond.notify()
+
+        # Свободные воркеры разберут первые задачи сразу, остальным сообщаем позицию
+        position = self._position(job) - self._idle
+        if position > 0 or job.user_id in self._busy_users:
+            self._report(job, max(position, 1))
+
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            with contextlib.suppress(ValueError):
+                self._pending.remove(job)
+            raise
+
+    # -------------------------------------------------------------------------
+    # Внутренняя кухня
+    # -------------------------------------------------------------------------
+
+    def _report(self, job: _Job, position: int) -> None:
+        """Асинхронно уведомляет владельца задачи о смене позиции."""
+        if job.on_position is None or position == job.last_position:
+            return
+        job.last_position = position
+        notify = asyncio.create_task(job.on_position(position))
+        self._notify_tasks.add(notify)
+        notify.add_done_callback(self._notify_tasks.discard)
+
+    def _position(self, job: _Job) -> int:
+        return sum(1 for other in self._pending if other.order <= job.order)
+
+    def _refresh_positions(self) -> None:
+        for index, job in enumerate(sorted(self._pending, key=lambda j: j.order), start=1):
+            if index < job.last_position:
+                self._report(job, index)
+
+    def _next_job(self) -> Optional[_Job]:
+        """Задача с наименьшим ключом среди пользователей без выполняющейся задачи."""
+        ready = [job for job in self._pending if job.user_id not in self._busy_users]
+        return min(ready, key=lambda j: j.order, default=None)
+
+    def _forget_idle_users(self) -> None:
+        """Время окончания в прошлом ничего не меняет — не копим его для всех пользователей."""
+        self._user_finish = {
+            user: finish for user, finish in self._user_finish.items() if finish > self._vtime
+        }
+
+    def _service(self, index: int) -> Any:
+        """Возвращает модель воркера, создавая ее при первом обращении."""
+        if self._shared:
+            with self._shared_lock:
+                if self._shared_service is None:
+                    self._shared_service = self._factory()
+                return self._shared_service
+
+        if self._services[index] is None:
+            self._services[index] = self._factory()
+        return self._services[index]
+
+    def _run(self, index: int, task: Callable[[Any], Any]) -> Any:
+        """Выполняется в потоке пула: создает модель при первом вызове и запускает задачу."""
+        service = self._service(index)
+        if self._shared and self._serialize:
+            with self._shared_lock:
+                return task(service)
+        return task(service)
+
+    def _prepare(self, index: int) -> None:
+        """Фоновая загрузка и прогрев модели воркера (в потоке пула)."""
+        try:
+            started = time.perf_counter()
+            service = self._service(index)
+            loaded = time.perf_counter()
+            warm_up = getattr(service, "warm_up", None)
+            if warm_up is not None:
+                self._run(index, lambda svc: svc.warm_up())
+            logger.info(
+                f"Воркер апскейла {index} готов: загрузка модели {loaded - started:.2f} с, "
+                f"прогрев {time.perf_counter() - loaded:.2f} с"
+            )
+        except Exception as e:
+            # Не роняем воркер: следующая задача повторит загрузку и получит ошибку
+            logger.error(f"Не удалось подготовить модель воркера {index}: {e}")
+
+    async def _worker(self, index: int) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._prepare, index)
+        self._ready += 1
+
+        while True:
+            async with self._cond:
+                self._idle += 1
+                try:
+                    await self._cond.wait_for(lambda: self._next_job() is not None)
+                finally:
+                    self._idle -= 1
+                job = self._next_job()
+                self._pending.remove(job)
+
+            if job.future.done():
+                # Владелец задачи уже отменил ожидание
+                continue
+
+            if not job.priority:
+                self._vtime = max(self._vtime, job.start)
+                if not self._pending:
+                    self._forget_idle_users()
+            self._busy_users.add(job.user_id)
+            self._running += 1
+            self._refresh_positions()
+            if job.last_position:
+                self._report(job, 0)
+
+            try:
+                result = await loop.run_in_executor(self._executor, self._run, index, job.task)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self._running -= 1
+                self._busy_users.discard(job.user_id)
+                # Следующая задача этого пользователя теперь может быть взята
+                async with self._cond:
+                    self._cond.notify_all()
@@ -1,55 +1,541 @@
+import contextlib
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
 import cv2
+import numpy as np
 import torch
+from torch.nn import functional as F
+from basicsr.archs.rrdbnet_arch import RRDBNet
 from realesrgan import RealESRGANer
 from realesrgan.archs.srvgg_arch import SRVGGNetCompact
 
+from bot.ai.backends import create_backend
+from bot.ai.batching import MicroBatcher
+from bot.ai.encoding import EncodedImage, output_encoder
+from bot.ai.models import MODELS, ModelSpec, select_model
+from bot.metrics import MODEL_LOAD_SECONDS
+from bot.tracing import span
 # Импортируем правильный путь из конфига
-from bot.config import BASE_DIR
+from bot.config import (
+    TEMP_DIR,
+    UPSCALE_BACKEND,
+    UPSCALE_BATCH_SIZE,
+    UPSCALE_BATCH_TILE,
+    UPSCALE_BATCH_WINDOW_MS,
+    UPSCALE_MEMORY_BUDGET_MB,
+    UPSCALE_MODEL_CACHE_MB,
+    UPSCALE_TILE_PAD,
+    UPSCALE_TILING,
+    UPSCALE_VIDEO_MODEL,
+)
+# Прямоугольник в координатах входа: (y0, x0, y1, x1)
+Box = Tuple[int, int, int, int]
+
+logger = logging.getLogger(__name__)
+
+
+def _decode(data: bytes) -> np.ndarray:
+    with span("decode", bytes=len(data)):
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError("Не удалось декодировать изображение")
+    return img
+
+
+def _build_network(spec: ModelSpec) -> torch.nn.Module:
+    if spec.arch == "rrdb":
+        return RRDBNet(
+            num_in_ch=3, num_out_ch=3, num_feat=64, num_block=spec.num_block, num_grow_ch=32, scale=spec.scale
+        )
+    return SRVGGNetCompact(
+        num_in_ch=3,
+        num_out_ch=3,
+        num_feat=64,
+        num_conv=spec.num_conv,
+        upscale=spec.scale,
+        act_type="prelu",
+    )
+
 
 class UpscaleService:
-    MODEL_NAME = "realesr-general-x4v3.pth"
-    SCALE = 4
+    """Одна модель Real-ESRGAN (по умолчанию realesr-general-x4v3) и пути инференса вокруг нее."""
+
+    # Оценка пиковой памяти инференса на один пиксель входного тайла
+    # (активации 64 каналов fp32 + выход pixel shuffle), с запасом
+    BYTES_PER_TILE_PIXEL = 1536
+    MIN_TILE = 64
 
-    def __init__(self):
+    def __init__(
+        self,
+        num_threads: int = 0,
+        tiling: str = UPSCALE_TILING,
+        memory_budget_mb: int = UPSCALE_MEMORY_BUDGET_MB,
+        tile_pad: int = UPSCALE_TILE_PAD,
+        batch_size: int = UPSCALE_BATCH_SIZE,
+        batch_window_ms: float = UPSCALE_BATCH_WINDOW_MS,
+        batch_tile: int = UPSCALE_BATCH_TILE,
+        backend: str = UPSCALE_BACKEND,
+        model_name: str = UPSCALE_VIDEO_MODEL,
+    ):
+        self.spec = MODELS[model_name]
+        self.SCALE = self.spec.scale
+        # RRDBNet x2 внутри делает pixel unshuffle: стороны входа должны быть четными
+        self.mod_scale = 2 if self.SCALE == 2 else 1
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.tiling = tiling
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.tile_pad = tile_pad
+        self.batch_tile = batch_tile
+        # RealESRGANer хранит промежуточные тензоры в себе, его enhance не потокобезопасен
+        self._legacy_lock = threading.Lock()
+
+        # Ограничиваем intra-op потоки, чтобы параллельные воркеры не делили ядра друг у друга
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
 
         # Ищем модель в папке models РЯДОМ с ботом
-        self.model_path = BASE_DIR / "models" / self.MODEL_NAME
+        self.model_path = self.spec.path
 
         if not self.model_path.exists():
             # Если не нашли, выводим четкую ошибку в лог
-            print(f"❌ ОШИБКА: Файл модели не найден здесь: {self.model_path}")
-            raise FileNotFoundError(f"Put the file '{self.MODEL_NAME}' in the 'models' folder next to exe!")
-
-        model = SRVGGNetCompact(
-            num_in_ch=3,
-            num_out_ch=3,
-            num_feat=64,
-            num_conv=32,
-            upscale=self.SCALE,
-            act_type="prelu",
-        )
+            logger.error(f"Файл модели не найден здесь: {self.model_path}")
+            raise FileNotFoundError(f"Put the file '{self.spec.filename}' in the 'models' folder next to exe!")
+
+        model = _build_network(self.spec)
 
         self.upsampler = RealESRGANer(
             scale=self.SCALE,
             model_path=str(self.model_path),
             model=model,
             tile=0,
-            tile_pad=10,
+            tile_pad=tile_pad,
             pre_pad=0,
             half=self.device == "cuda",
             device=self.device,
         )
+        # Подменяем модель бэкендом: все пути инференса (включая RealESRGANer.enhance
+        # и батчер) вызывают upsampler.model как функцию тензор -> тензор
+        self.backend = backend if self.device == "cpu" else "torch"
+        self.upsampler.model = create_backend(backend, self.upsampler.model, self.model_path, self.device)
+
+        # При batch_size > 1 инференс идет через общий батчер: сервис можно
+        # безопасно делить между воркерами, тайлы разных запросов склеиваются
+        self.batcher = (
+            MicroBatcher(self.upsampler.model, max_batch=batch_size, window_ms=batch_window_ms)
+            if batch_size > 1
+            else None
+        )
+
+        logger.info(f"AI-модель загружена: {self.model_path} (бэкенд: {self.backend})")
 
-        print(f"✅ AI Model loaded from: {self.model_path}")
+    def warm_up(self) -> None:
+        """Пробный инференс: первые вызовы torch медленные (аллокации, выбор ядер)."""
+        self.upscale_array(np.zeros((64, 64, 3), dtype=np.uint8))
+
+    def close(self) -> None:
+        """Останавливает батчер (если есть); вызывается при выгрузке модели."""
+        if self.batcher is not None:
+            self.batcher.close()
 
     def upscale(self, input_path: str | Path, output_path: str | Path) -> Path:
-        input_path = str(input_path)
-        output_path = str(output_path)
+        img = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
+        return self.write(img, output_path)
+
+    def write(self, img: np.ndarray, output_path: str | Path, ext: Optional[str] = None) -> Path:
+        """
+        Апскейлит декодированное изображение и сохраняет в файл.
+        Расширение файла заменяется на фактический формат (см. `encode`).
+        """
+        encoded = self._upscale_encoded(img, ext)
+        output_path = Path(output_path).with_suffix(encoded.ext)
+        output_path.write_bytes(encoded.data)
+        return output_path
+
+    def upscale_bytes(self, data: bytes, ext: Optional[str] = None) -> bytes:
+        """
+        Полностью in-memory путь: байты файла -> декодирование -> апскейл -> закодированные байты.
+        Большой выход по-прежнему собирается в memory-mapped буфере.
+        """
+        return self.encode(_decode(data), ext)
+
+    def encode(self, img: np.ndarray, ext: Optional[str] = None) -> bytes:
+        """
+        Апскейлит декодированное изображение и кодирует результат: в `ext`
+        (по умолчанию UPSCALE_OUTPUT_FORMAT) или в более компактный формат,
+        если иначе файл не влезет в лимит Telegram.
+        """
+        return self._upscale_encoded(img, ext).data
+
+    def _upscale_encoded(self, img: np.ndarray, ext: Optional[str]) -> EncodedImage:
+        if self._is_tiled(img):
+            with self._output_buffer(self.output_shape(img)) as output:
+                self._enhance_tiled(img, output)
+                return output_encoder.encode(output, ext)
+        return output_encoder.encode(self._enhance_legacy(img), ext)
+
+    def upscale_array(self, img: np.ndarray) -> np.ndarray:
+        """Апскейлит уже декодированное изображение, результат — в RAM."""
+        output = np.empty(self.output_shape(img), dtype=img.dtype)
+        self.upscale_into(img, output)
+        return output
+
+    def upscale_into(self, img: np.ndarray, output: np.ndarray) -> None:
+        """
+        Апскейлит изображение в заранее выделенный буфер формы `output_shape(img)`
+        (например, в shared memory или memory-mapped файл).
+        """
+        if self._is_tiled(img):
+            self._enhance_tiled(img, output)
+        else:
+            output[...] = self._enhance_legacy(img)
+
+    def upscale_batch(self, frames: np.ndarray) -> np.ndarray:
+        """Апскейлит пачку кадров одного размера (N, H, W, 3), результат — в RAM."""
+        n, h, w = frames.shape[:3]
+        output = np.empty((n, h * self.SCALE, w * self.SCALE, 3), dtype=np.uint8)
+        self.upscale_batch_into(frames, output)
+        return output
+
+    def frames_per_batch(self, height: int, width: int) -> int:
+        """Сколько целых кадров влезает в один forward-проход; 0 — кадр придется резать на тайлы."""
+        return self.memory_budget // (height * width * self.BYTES_PER_TILE_PIXEL)
+
+    @torch.no_grad()
+    def upscale_batch_into(self, frames: np.ndarray, output: np.ndarray) -> None:
+        """
+        Апскейлит кадры BGR uint8 (N, H, W, 3) в `output` (N, H*s, W*s, 3),
+        склеивая в один forward-проход столько кадров, сколько позволяет бюджет.
+        """
+        n, h, w = frames.shape[:3]
+        step = self.frames_per_batch(h, w)
+        if step == 0 or self.batcher is not None:
+            # Кадр крупнее бюджета (или включен общий батчер) — покадрово по тайлам
+            for index in range(n):
+                self.upscale_into(frames[index], output[index])
+            return
+
+        for start in range(0, n, step):
+            chunk = frames[start:start + step]
+            tensor = torch.from_numpy(np.ascontiguousarray(chunk[..., ::-1])).to(self.device)
+            tensor = tensor.permute(0, 3, 1, 2).float().div_(255.0)
+            if self.upsampler.half:
+                tensor = tensor.half()
+
+            result = self._forward(tensor)
+            result = result.float().clamp_(0, 1).mul_(255.0).round_().byte()
+            output[start:start + len(chunk)] = result.permute(0, 2, 3, 1).cpu().numpy()[..., ::-1]
+
+    def output_shape(self, img: np.ndarray) -> tuple:
+        h, w = img.shape[:2]
+        return (h * self.SCALE, w * self.SCALE) + img.shape[2:]
+
+    def _is_tiled(self, img: np.ndarray) -> bool:
+        return self.tiling == "adaptive" and img.dtype == np.uint8
+
+    def _enhance_legacy(self, img: np.ndarray) -> np.ndarray:
+        """Классический путь RealESRGANer (в т.ч. для 16-битных изображений)."""
+        with self._legacy_lock:
+            self.upsampler.tile_size = self.tile_size_for(*img.shape[:2]) if self.tiling == "adaptive" else 0
+            with span("enhance", legacy=True, shape=img.shape[:2], tile=self.upsampler.tile_size):
+                output, _ = self.upsampler.enhance(img, outscale=self.SCALE)
+        return output
+
+    # -------------------------------------------------------------------------
+    # Адаптивный тайлинг
+    # -------------------------------------------------------------------------
+
+    def tile_size_for(self, height: int, width: int) -> int:
+        """
+        Подбирает сторону тайла под бюджет памяти.
+        0 означает, что изображение целиком помещается в бюджет.
+        """
+        max_pixels = self.memory_budget // self.BYTES_PER_TILE_PIXEL
+        if height * width <= max_pixels:
+            return 0
+        side = math.isqrt(max_pixels) - 2 * self.tile_pad
+        return max(self.MIN_TILE, side)
+
+    @contextlib.contextmanager
+    def _output_buffer(self, shape: tuple) -> Iterator[np.ndarray]:
+        """
+        Выходной буфер: в RAM, если он мал относительно бюджета,
+        иначе — memory-mapped файл, страницы которого ОС может вытеснять на диск.
+        """
+        nbytes = math.prod(shape)
+        if nbytes <= self.memory_budget // 4:
+            yield np.empty(shape, dtype=np.uint8)
+            return
+
+        TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".upscale", dir=TEMP_DIR)
+        os.close(fd)
+        output = np.memmap(path, dtype=np.uint8, mode="w+", shape=shape)
+        try:
+            yield output
+        finally:
+            # Закрываем отображение до удаления файла (иначе Windows не даст удалить)
+            output._mmap.close()
+            del output
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+
+    def _batch_tile_size(self, height: int, width: int) -> int:
+        """
+        Сторона тайла в батч-режиме: фиксированная, чтобы тайлы разных
+        запросов совпадали по форме, и такая, чтобы батч влез в бюджет.
+        """
+        per_tile_pixels = self.memory_budget // self.batcher.max_batch // self.BYTES_PER_TILE_PIXEL
+        side = max(self.MIN_TILE, min(self.batch_tile, math.isqrt(per_tile_pixels) - 2 * self.tile_pad))
+        return min(side, max(height, width))
+
+    def _tiles(self, height: int, width: int, tile: int) -> Iterator[Tuple[Box, Box]]:
+        """Перебирает тайлы: (область тайла, область тайла с перекрытием)."""
+        pad = self.tile_pad
+        for y0 in range(0, height, tile):
+            for x0 in range(0, width, tile):
+                y1, x1 = min(y0 + tile, height), min(x0 + tile, width)
+                padded = (max(y0 - pad, 0), max(x0 - pad, 0), min(y1 + pad, height), min(x1 + pad, width))
+                yield (y0, x0, y1, x1), padded
+
+    def _paste(self, output: np.ndarray, area: Box, padded: Box, upscaled: np.ndarray) -> None:
+        """Вырезает из апскейленного тайла область без перекрытия и кладет в выход."""
+        y0, x0, y1, x1 = area
+        py0, px0 = padded[:2]
+        scale = self.SCALE
+        oy, ox = (y0 - py0) * scale, (x0 - px0) * scale
+        oh, ow = (y1 - y0) * scale, (x1 - x0) * scale
+        output[y0 * scale:y1 * scale, x0 * scale:x1 * scale] = upscaled[oy:oy + oh, ox:ox + ow]
+
+    @torch.no_grad()
+    def _enhance_tiled(self, img: np.ndarray, output: np.ndarray) -> None:
+        """
+        Прогоняет 8-битное изображение через сеть по тайлам и пишет
+        готовые тайлы сразу в `output`. В памяти одновременно живет
+        только один тайл (или один батч тайлов), поэтому пик не зависит
+        от размера картинки. Альфа-канал масштабируется через cv2 по тем же тайлам.
+        """
+        h, w = img.shape[:2]
+
+        if self.batcher is None:
+            tile = self.tile_size_for(h, w) or max(h, w)
+            for area, padded in self._tiles(h, w, tile):
+                py0, px0, py1, px1 = padded
+                patch = img[py0:py1, px0:px1]
+                result = self._forward(self._patch_tensor(patch))
+                self._paste(output, area, padded, self._patch_result(patch, result))
+            return
+
+        # Батч-режим: тайлы дополняются до одной формы и отправляются в батчер пачками
+        tile = self._batch_tile_size(h, w)
+        target = min(tile + 2 * self.tile_pad, max(h, w))
+        target += -target % self.mod_scale
+        tiles = list(self._tiles(h, w, tile))
+        for start in range(0, len(tiles), self.batcher.max_batch):
+            chunk = tiles[start:start + self.batcher.max_batch]
+            pending: List[tuple] = []
+            for area, padded in chunk:
+                py0, px0, py1, px1 = padded
+                patch = img[py0:py1, px0:px1]
+                tensor = self._patch_tensor(patch)
+                _, _, th, tw = tensor.shape
+                tensor = F.pad(tensor, (0, target - tw, 0, target - th), mode="replicate")
+                pending.append((area, padded, patch, th, tw, self.batcher.submit(tensor)))
+
+            for area, padded, patch, th, tw, future in pending:
+                result = future.result()[:, :, :th * self.SCALE, :tw * self.SCALE]
+                self._paste(output, area, padded, self._patch_result(patch, result))
+
+    def _forward(self, tensor: torch.Tensor) -> torch.Tensor:
+        """Прогон через сеть с дополнением сторон до кратности `mod_scale` (нужно x2-модели)."""
+        n, _, th, tw = tensor.shape
+        pad_h, pad_w = -th % self.mod_scale, -tw % self.mod_scale
+        # Спан на каждый тайл или пачку кадров: видно, какие проходы сети медленные
+        with span("enhance", batch=n, shape=(th, tw)):
+            if not pad_h and not pad_w:
+                return self.upsampler.model(tensor)
+            # reflect — как у RealESRGANer.pre_process, чтобы результат совпадал с классическим путем
+            result = self.upsampler.model(F.pad(tensor, (0, pad_w, 0, pad_h), mode="reflect"))
+            return result[:, :, :th * self.SCALE, :tw * self.SCALE]
+
+    def _patch_tensor(self, patch: np.ndarray) -> torch.Tensor:
+        """Тайл gray / BGR / BGRA (uint8, HWC) -> RGB float тензор (1, 3, H, W)."""
+        if patch.ndim == 2:
+            bgr = cv2.cvtColor(patch, cv2.COLOR_GRAY2BGR)
+        else:
+            bgr = patch[:, :, :3]
+
+        tensor = torch.from_numpy(np.ascontiguousarray(bgr[:, :, ::-1])).to(self.device)
+        tensor = tensor.permute(2, 0, 1).unsqueeze(0).float().div_(255.0)
+        if self.upsampler.half:
+            tensor = tensor.half()
+        return tensor
+
+    def _patch_result(self, patch: np.ndarray, result: torch.Tensor) -> np.ndarray:
+        """Выход сети для тайла -> uint8 в формате исходного тайла (gray / BGR / BGRA)."""
+        result = result.squeeze(0).float().clamp_(0, 1).mul_(255.0).round_().byte()
+        result = result.permute(1, 2, 0).cpu().numpy()[:, :, ::-1]
+
+        if patch.ndim == 2:
+            return cv2.cvtColor(np.ascontiguousarray(result), cv2.COLOR_BGR2GRAY)
+        if patch.shape[2] == 4:
+            ph, pw = patch.shape[:2]
+            up_alpha = cv2.resize(patch[:, :, 3], (pw * self.SCALE, ph * self.SCALE), interpolation=cv2.INTER_LINEAR)
+            return np.dstack((result, up_alpha))
+        return result
+
+
+class ModelPool:
+    """
+    Набор моделей Real-ESRGAN с адаптивным выбором масштаба.
+
+    Для фото (`upscale`, `upscale_bytes`) модель выбирается по числу пикселей
+    входа (`select_model`), чтобы результат не превышал UPSCALE_MAX_OUTPUT_MP.
+    Методы с заранее известной формой выхода (`upscale_array`, `upscale_into`,
+    `upscale_batch*`) и видео используют фиксированную модель `video_model`.
+
+    Загруженные модели живут в LRU с бюджетом памяти: при загрузке новой
+    выгружаются давно не использованные (кроме занятых прямо сейчас).
+    Модель загружается вне общего лока: холодная загрузка не мешает другим
+    воркерам брать уже загруженные модели, а параллельные запросы той же
+    модели ждут одну загрузку.
+    Интерфейс совпадает с `UpscaleService`, поэтому планировщик и
+    `ProcessUpscaleService` работают с пулом так же, как с одной моделью.
+    """
+
+    def __init__(
+        self,
+        memory_budget_mb: int = UPSCALE_MODEL_CACHE_MB,
+        video_model: str = UPSCALE_VIDEO_MODEL,
+        on_load: Optional[Callable[[str, float], None]] = None,
+        **service_kwargs,
+    ):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.video_model = video_model
+        # Куда сообщать время загрузки модели; по умолчанию — в метрики этого процесса
+        self._on_load = on_load or (lambda name, seconds: MODEL_LOAD_SECONDS.observe(seconds, model=name))
+        self._service_kwargs = service_kwargs
+        self._models: "OrderedDict[str, UpscaleService]" = OrderedDict()
+        self._in_use: Dict[str, int] = {}
+        # Модели, которые сейчас загружаются: имя -> future окончания загрузки
+        self._loading: Dict[str, "Future[None]"] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def SCALE(self) -> int:
+        return MODELS[self.video_model].scale
+
+    @property
+    def loaded(self) -> List[str]:
+        """Загруженные модели, от давно использованной к недавней."""
+        return list(self._models)
+
+    @contextlib.contextmanager
+    def acquire(self, name: str) -> Iterator[UpscaleService]:
+        """Выдает модель (загружая при необходимости); пока она занята, LRU ее не выгрузит."""
+        service = self._checkout(name)
+        try:
+            yield service
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+
+    def _checkout(self, name: str) -> UpscaleService:
+        """Берет модель из LRU или загружает ее; отмечает как занятую."""
+        while True:
+            with self._lock:
+                service = self._models.get(name)
+                if service is not None:
+                    self._models.move_to_end(name)
+                    self._in_use[name] = self._in_use.get(name, 0) + 1
+                    return service
+                loading = self._loading.get(name)
+                owner = loading is None
+                if owner:
+                    loading = self._loading[name] = Future()
+            if not owner:
+                # Модель уже грузит другой поток: ждем его (ошибка загрузки всплывет и здесь)
+                loading.result()
+                continue
+            break
+
+        try:
+            started = time.perf_counter()
+            service = UpscaleService(model_name=name, **self._service_kwargs)
+            self._on_load(name, time.perf_counter() - started)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[name]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[name]
+            self._models[name] = service
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+            self._evict(keep=name)
+        loading.set_result(None)
+        return service
+
+    def _evict(self, keep: str) -> None:
+        """Выгружает давно не использованные свободные модели, пока не уложимся в бюджет."""
+        used = sum(MODELS[name].memory_bytes for name in self._models)
+        for name in list(self._models):
+            if used <= self.memory_budget:
+                break
+            if name == keep or self._in_use.get(name):
+                continue
+            self._models.pop(name).close()
+            used -= MODELS[name].memory_bytes
+            logger.info(f"Модель {name} выгружена из памяти (LRU)")
+
+    def _select(self, img: np.ndarray) -> Tuple[str, np.ndarray]:
+        """Модель под размер изображения; слишком крупный вход предварительно уменьшается."""
+        h, w = img.shape[:2]
+        spec, factor = select_model(h, w)
+        if factor < 1.0:
+            size = (max(1, int(w * factor)), max(1, int(h * factor)))
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        return spec.name, img
+
+    def warm_up(self) -> None:
+        with self.acquire(self.video_model) as service:
+            service.warm_up()
+
+    def upscale(self, input_path: str | Path, output_path: str | Path) -> Path:
+        name, img = self._select(cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED))
+        with self.acquire(name) as service:
+            return service.write(img, output_path)
+
+    def upscale_bytes(self, data: bytes, ext: Optional[str] = None) -> bytes:
+        name, img = self._select(_decode(data))
+        with self.acquire(name) as service:
+            return service.encode(img, ext)
+
+    def upscale_array(self, img: np.ndarray) -> np.ndarray:
+        with self.acquire(self.video_model) as service:
+            return service.upscale_array(img)
+
+    def upscale_into(self, img: np.ndarray, output: np.ndarray) -> None:
+        with self.acquire(self.video_model) as service:
+            service.upscale_into(img, output)
+
+    def upscale_batch(self, frames: np.ndarray) -> np.ndarray:
+        with self.acquire(self.video_model) as service:
+            return service.upscale_batch(frames)
 
-        img = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
-        output, _ = self.upsampler.enhance(img, outscale=self.SCALE)
-        cv2.imwrite(output_path, output)
+    def upscale_batch_into(self, frames: np.ndarray, output: np.ndarray) -> None:
+        with self.acquire(self.video_model) as service:
+            service.upscale_batch_into(frames, output)
 
-        return Path(output_path)
\ No newline at end of file
+    def close(self) -> None:
+        with self._lock:
+            while self._models:
+                self._models.popitem()[1].close()
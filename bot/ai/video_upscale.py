@@ -0,0 +1,156 @@
+import logging
+import queue
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from bot.config import MAX_VIDEO_DURATION_SEC, UPSCALE_VIDEO_CHUNK, UPSCALE_VIDEO_MAX_SIDE
+from bot.video import OutputTooLargeError, VideoConversionError, ffmpeg_exe, probe
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VideoUpscaleStats:
+    frames: int
+    seconds: float
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.0
+
+
+def _even(value: float) -> int:
+    """yuv420p требует четных сторон."""
+    return max(2, int(value) // 2 * 2)
+
+
+def upscale_video(
+    service: Any,
+    input_path: str | Path,
+    output_path: str | Path,
+    chunk_frames: int = UPSCALE_VIDEO_CHUNK,
+    max_output_bytes: int = 0,
+) -> VideoUpscaleStats:
+    """
+    Потоковый апскейл видео: декодер ffmpeg -> пачки кадров -> `service.upscale_batch`
+    -> кодировщик ffmpeg. В памяти одновременно живут лишь несколько пачек кадров,
+    а не весь ролик. Длительность обрезается до MAX_VIDEO_DURATION_SEC,
+    исходник при необходимости уменьшается, чтобы выход влез в UPSCALE_VIDEO_MAX_SIDE.
+
+    `max_output_bytes` ограничивает выход (ffmpeg -fs): при достижении лимита
+    кодировщик закрывается, запись в него падает, и задача прерывается сразу,
+    не дописывая ролик в рабочий каталог.
+
+    Выполняется в потоке воркера планировщика; `service` — ModelPool, UpscaleService
+    или ProcessUpscaleService.
+    """
+    input_path, output_path = str(input_path), str(output_path)
+    info = probe(input_path)
+    if not info.width or not info.height:
+        raise VideoConversionError("Не удалось определить размер кадра")
+
+    scale = service.SCALE
+    factor = min(1.0, UPSCALE_VIDEO_MAX_SIDE / scale / max(info.width, info.height))
+    width, height = _even(info.width * factor), _even(info.height * factor)
+    fps = info.fps or 30.0
+    frame_bytes = width * height * 3
+
+    decoder = subprocess.Popen(
+        [
+            ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-t", str(MAX_VIDEO_DURATION_SEC), "-i", input_path,
+            "-map", "0:v:0",
+            "-vf", f"scale={width}:{height}",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    audio_codec = "copy" if info.audio_codec == "aac" else "aac"
+    encoder = subprocess.Popen(
+        [
+            ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-nostdin", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width * scale}x{height * scale}", "-r", f"{fps}",
+            "-i", "-",
+            "-t", str(MAX_VIDEO_DURATION_SEC), "-i", input_path,
+            "-map", "0:v:0",
+            "-map", "1:a:0?",
+            "-c:v", "libx264", "-preset", "fast", "-crf", "23", "-pix_fmt", "yuv420p",
+            "-c:a", audio_codec,
+            "-shortest",
+            "-movflags", "+faststart",
+            *(["-fs", str(max_output_bytes)] if max_output_bytes else []),
+            output_path,
+        ],
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    # Запись в кодировщик в отдельном потоке: инференс следующей пачки
+    # идет, пока ffmpeg сжимает предыдущую. Очередь ограничена — backpressure
+    chunks: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(maxsize=2)
+    write_error: list = []
+
+    def writer() -> None:
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                encoder.stdin.write(chunk)
+        except Exception as e:
+            write_error.append(e)
+            # Освобождаем производителя, если он ждет место в очереди
+            while chunks.get() is not None:
+                pass
+        finally:
+            encoder.stdin.close()
+
+    writer_thread = threading.Thread(target=writer, name="video-upscale-writer", daemon=True)
+    writer_thread.start()
+
+    frames = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            raw = decoder.stdout.read(frame_bytes * chunk_frames)
+            count = len(raw) // frame_bytes
+            if count == 0:
+                break
+            batch = np.frombuffer(raw, dtype=np.uint8, count=count * frame_bytes)
+            batch = batch.reshape(count, height, width, 3)
+            chunks.put(service.upscale_batch(batch))
+            frames += count
+            if write_error:
+                break
+    finally:
+        chunks.put(None)
+        writer_thread.join()
+        decoder.stdout.close()
+        if decoder.poll() is None:
+            decoder.kill()
+        decoder.wait()
+        encoder_stderr = encoder.stderr.read().decode(errors="replace").strip()
+        encoder.wait()
+
+    # -fs останавливает запись, только когда лимит уже превышен
+    if max_output_bytes and Path(output_path).exists() and Path(output_path).stat().st_size >= max_output_bytes:
+        raise OutputTooLargeError(f"Выход достиг лимита {max_output_bytes} байт на кадре {frames}")
+    if write_error or encoder.returncode != 0:
+        raise VideoConversionError(f"Кодировщик завершился с ошибкой: {encoder_stderr[-500:] or write_error}")
+    if frames == 0:
+        raise VideoConversionError("В видео не найдено ни одного кадра")
+
+    stats = VideoUpscaleStats(frames=frames, seconds=time.perf_counter() - started)
+    logger.info(
+        f"Видео-апскейл {width}x{height} -> {width * scale}x{height * scale}: "
+        f"{stats.frames} кадров за {stats.seconds:.1f} с ({stats.fps:.2f} кадр/с)"
+    )
+    return stats
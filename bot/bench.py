@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from . import database
+from .database import Database, get_period_stats, get_stats, init_db, log_action
+from .video import ENGINES, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# Офлайн-бенчмарки горячих путей: апскейл, Video2Round, статистика в БД.
+#
+#   python -m bot.bench                          — все наборы, результат в bench_results.json
+#   python -m bot.bench --suite db --quick       — быстрый прогон одного набора
+#   python -m bot.bench --baseline old.json      — сравнение с сохраненным прогоном
+#
+# Входные данные генерируются локально, сеть и токен не нужны (кроме TOKEN в окружении,
+# без которого не импортируется конфиг). Прогон с --baseline завершается с кодом 1,
+# если какая-то метрика ухудшилась больше порога.
+
+# Результат: имя -> {"value", "unit", "higher_is_better", ...подробности}
+Results = Dict[str, Dict[str, Any]]
+
+
+def _measure(fn: Callable[[], Any], runs: int) -> float:
+    """Медиана времени `runs` прогонов после одного прогревочного, в секундах."""
+    fn()
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def synthetic_image(height: int, width: int, seed: int = 0) -> np.ndarray:
+    """
+    Изображение BGR с градиентами, крупными фигурами и мелким шумом:
+    ближе к фото, чем чистый шум (от содержимого зависит время кодирования).
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.stack([
+        127 + 100 * np.sin(x / (width / 6)),
+        127 + 100 * np.cos(y / (height / 4)),
+        255 * (x + y) / (height + width),
+    ], axis=-1)
+    for _ in range(12):
+        cy, cx, r = rng.integers(0, height), rng.integers(0, width), rng.integers(8, max(9, min(height, width) // 4))
+        img[max(0, cy - r):cy + r, max(0, cx - r):cx + r] = rng.integers(0, 256, 3)
+    img += rng.normal(0, 6, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def synthetic_clip(path: Path, height: int, duration: int) -> Path:
+    """Клип H.264 с тестовой картинкой ffmpeg и тоном, 16:9, 30 кадр/с."""
+    width = height * 16 // 9 // 2 * 2
+    run_ffmpeg([
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", str(path),
+    ])
+    return path
+
+
+# =============================================================================
+# Наборы
+# =============================================================================
+
+def bench_upscale(quick: bool, runs: int) -> Results:
+    """Мегапиксели входа в секунду: бэкенды, размеры тайла и число потоков torch."""
+    import torch
+
+    from .ai.backends import BACKENDS
+    from .ai.upscale import UpscaleService
+
+    sizes = [(256, 256)] if quick else [(256, 256), (512, 512), (720, 1280)]
+    tiles = [128, 256] if quick else [128, 192, 256, 384]
+    cpus = os.cpu_count() or 1
+    thread_counts = sorted({1, max(1, cpus // 2), cpus})
+    results: Results = {}
+
+    def record(name: str, service: UpscaleService, img: np.ndarray, **details: Any) -> None:
+        seconds = _measure(lambda: service.upscale_array(img), runs)
+        h, w = img.shape[:2]
+        results[name] = {
+            "value": h * w / seconds / 1e6,
+            "unit": "Мпикс/с",
+            "higher_is_better": True,
+            "seconds": seconds,
+            "tile": service.tile_size_for(h, w),
+            **details,
+        }
+        logger.info(f"{name}: {results[name]['value']:.3f} Мпикс/с ({seconds:.2f} с)")
+
+    default_threads = torch.get_num_threads()
+
+    # Бэкенды — целым кадром (без тайлинга), чтобы сравнивать только инференс
+    for backend in BACKENDS:
+        try:
+            service = UpscaleService(backend=backend, tiling="adaptive", memory_budget_mb=4096, batch_size=1)
+        except ImportError as e:
+            logger.warning(f"Бэкенд {backend} пропущен: {e}")
+            continue
+        for h, w in sizes:
+            record(f"upscale.backend.{backend}.{w}x{h}", service, synthetic_image(h, w), backend=backend)
+
+    # Размер тайла задается бюджетом памяти: сервис сам выбирает тайл под бюджет
+    # Кадр заведомо больше самого крупного тайла, иначе тайлинг не включится
+    h, w = (384, 384) if quick else (720, 1280)
+    img = synthetic_image(h, w)
+    for tile in tiles:
+        budget_mb = max(1, (tile + 2 * 10) ** 2 * UpscaleService.BYTES_PER_TILE_PIXEL // (1024 * 1024))
+        service = UpscaleService(
+            backend="torch", tiling="adaptive", memory_budget_mb=budget_mb, tile_pad=10, batch_size=1,
+        )
+        record(f"upscale.tile.{tile}.{w}x{h}", service, img, budget_mb=budget_mb)
+
+    h, w = sizes[0]
+    img = synthetic_image(h, w)
+    for threads in thread_counts:
+        service = UpscaleService(
+            backend="torch", tiling="adaptive", num_threads=threads, memory_budget_mb=4096, batch_size=1,
+        )
+        record(f"upscale.threads.{threads}.{w}x{h}", service, img, threads=threads)
+    torch.set_num_threads(default_threads)
+    return results
+
+
+def bench_video(quick: bool, runs: int) -> Results:
+    """Секунды на клип Video2Round для каждого движка, разрешения и длительности."""
+    clips = [(360, 3)] if quick else [(480, 5), (720, 15), (1080, 15)]
+    engines = ["ffmpeg"] if quick else list(ENGINES)
+    results: Results = {}
+
+    with tempfile.TemporaryDirectory(prefix="bench_video_") as tmp:
+        workdir = Path(tmp)
+        for height, duration in clips:
+            clip = synthetic_clip(workdir / f"clip_{height}p_{duration}s.mp4", height, duration)
+            output = workdir / "output.mp4"
+            for engine in engines:
+                name = f"video.{engine}.{height}p.{duration}s"
+                try:
+                    seconds = _measure(lambda: ENGINES[engine](str(clip), str(output)), runs)
+                except ImportError as e:
+                    logger.warning(f"Движок {engine} пропущен: {e}")
+                    break
+                results[name] = {
+                    "value": seconds,
+                    "unit": "с/клип",
+                    "higher_is_better": False,
+                    "realtime_factor": duration / seconds,
+                }
+                logger.info(f"{name}: {seconds:.2f} с/клип ({duration / seconds:.1f}× реального времени)")
+    return results
+
+
+@contextlib.contextmanager
+def _scratch_db(path: Path) -> Iterator[Database]:
+    """Подменяет синглтон БД временной базой: функции модуля берут `db` при вызове."""
+    original = database.db
+    database.db = Database(path)
+    try:
+        init_db()
+        yield database.db
+    finally:
+        asyncio.run(database.db.close())
+        database.db = original
+
+
+def _seed_stats(db: Database, rows: int, users: int, days: int) -> None:
+    """Заполняет статистику так же, как бот: пачками через `_insert_actions` (с агрегатами)."""
+    rng = random.Random(rows)
+    actions = ["start", "conversion", "ai_upscale", "video_upscale"]
+    now = datetime.utcnow()
+    batch = []
+    for _ in range(rows):
+        moment = now - timedelta(seconds=rng.randrange(days * 86400))
+        batch.append((rng.randrange(users), rng.choice(actions), moment.strftime("%Y-%m-%d %H:%M:%S")))
+        if len(batch) == 10_000:
+            db.submit(database._insert_actions, batch).result()
+            batch = []
+    db.submit(database._insert_actions, batch).result()
+
+
+def bench_db(quick: bool, runs: int) -> Results:
+    """Операций в секунду для log_action (с записью пачек) и запросов /stats на таблицах разного размера."""
+    table_sizes = [10_000] if quick else [10_000, 100_000, 1_000_000]
+    calls = 2_000 if quick else 20_000
+    results: Results = {}
+
+    async def stats_queries(count: int) -> None:
+        for _ in range(count):
+            await get_stats()
+            await get_period_stats(hours=24)
+            await get_period_stats(days=7)
+
+    for rows in table_sizes:
+        with tempfile.TemporaryDirectory(prefix="bench_db_") as tmp, _scratch_db(Path(tmp) / "bench.db") as db:
+            _seed_stats(db, rows, users=max(100, rows // 20), days=30)
+
+            def log_and_flush() -> None:
+                for index in range(calls):
+                    log_action(index % 500, "ai_upscale")
+                db.flush().result()
+
+            seconds = _measure(log_and_flush, runs)
+            results[f"db.log_action.{rows}"] = {
+                "value": calls / seconds,
+                "unit": "оп/с",
+                "higher_is_better": True,
+                "rows": rows,
+            }
+
+            queries = 200 if quick else 1000
+            seconds = _measure(lambda: asyncio.run(stats_queries(queries)), runs)
+            results[f"db.stats.{rows}"] = {
+                # Один /stats — три запроса: итоги, сутки, неделя
+                "value": queries / seconds,
+                "unit": "/stats в с",
+                "higher_is_better": True,
+                "rows": rows,
+            }
+            for name in (f"db.log_action.{rows}", f"db.stats.{rows}"):
+                logger.info(f"{name}: {results[name]['value']:.0f} {results[name]['unit']}")
+    return results
+
+
+SUITES: Dict[str, Callable[[bool, int], Results]] = {
+    "upscale": bench_upscale,
+    "video": bench_video,
+    "db": bench_db,
+}
+
+
+# =============================================================================
+# Сравнение с базовым прогоном
+# =============================================================================
+
+def compare(current: Results, baseline: Results, threshold: float) -> List[str]:
+    """
+    Сравнивает метрики, общие для двух прогонов. Возвращает строки отчета;
+    строки регрессий начинаются с "REGRESSION".
+    """
+    report = []
+    for name in sorted(current.keys() & baseline.keys()):
+        new, old = current[name]["value"], baseline[name]["value"]
+        if not old:
+            continue
+        # Изменение со знаком «+ — лучше» независимо от направления метрики
+        change = (new - old) / old if current[name]["higher_is_better"] else (old - new) / old
+        status = "REGRESSION" if change < -threshold else "ok"
+        report.append(f"{status:>10}  {name}: {old:.4g} -> {new:.4g} {current[name]['unit']} ({change:+.1%})")
+    return report
+
+
+def _environment() -> Dict[str, Any]:
+    info: Dict[str, Any] = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    with contextlib.suppress(ImportError):
+        import torch
+
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    return info
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bot.bench", description="Офлайн-бенчмарки бота")
+    parser.add_argument("--suite", default=",".join(SUITES), help=f"наборы через запятую: {', '.join(SUITES)}")
+    parser.add_argument("--quick", action="store_true", help="малые входы, для быстрой проверки")
+    parser.add_argument("--runs", type=int, default=3, help="замеров на точку (берется медиана)")
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--baseline", type=Path, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.10, help="допустимое ухудшение (доля)")
+    args = parser.parse_args(argv)
+
+    results: Results = {}
+    for suite in args.suite.split(","):
+        logger.info(f"Набор {suite}...")
+        results.update(SUITES[suite.strip()](args.quick, args.runs))
+
+    args.output.write_text(
+        json.dumps({"environment": _environment(), "results": results}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    logger.info(f"Результаты: {args.output}")
+
+    if args.baseline is None:
+        return 0
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))["results"]
+    report = compare(results, baseline, args.threshold)
+    print("\n".join(report))
+    return 1 if any(line.lstrip().startswith("REGRESSION") for line in report) else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+from .config import CACHE_DIR, RESULT_CACHE_MAX_MB
+from .database import (
+    evict_cached_files,
+    forget_cached_file_id,
+    get_cached_result,
+    save_cached_result,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedResult:
+    file_id: Optional[str]
+    path: Optional[Path]
+
+
+class ResultCache:
+    """
+    Кэш результатов обработки медиа, адресуемый содержимым.
+
+    Ключ строится из `file_unique_id` Telegram (одинаков для одного и того же
+    файла у всех пользователей) и параметров обработки. Два уровня:
+      * file_id отправленного результата — повторная отправка без загрузки;
+      * сам файл результата на диске (LRU с лимитом размера) — на случай,
+        если Telegram перестанет принимать file_id.
+    Одинаковые задачи, пришедшие одновременно, выполняются один раз:
+    остальные ждут на `lock(key)` и получают уже готовый результат.
+    Лок живет в памяти процесса, поэтому coalescing работает только в режиме
+    inline; в режиме очереди воркеры его не берут (см. `tasks.run_job`).
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    @staticmethod
+    def make_key(file_unique_id: str, tool: str, **params) -> str:
+        payload = json.dumps([file_unique_id, tool, params], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[CachedResult]:
+        record = await get_cached_result(key)
+        if record is None:
+            return None
+
+        file_id, path = record
+        cached_path = Path(path) if path and Path(path).exists() else None
+        if not file_id and not cached_path:
+            return None
+        return CachedResult(file_id=file_id, path=cached_path)
+
+    async def store(
+        self,
+        key: str,
+        file_id: Optional[str],
+        result: Union[Path, bytes, None] = None,
+        suffix: str = "",
+    ) -> None:
+        """
+        Запоминает file_id и (опционально) сохраняет результат на диск:
+        файл переносится в кэш, байты записываются с расширением `suffix`.
+        """
+        path, size = None, 0
+        if result is not None and self.max_bytes > 0:
+            # Файловые операции — в пуле потоков, чтобы не блокировать event loop
+            path, size = await asyncio.to_thread(self._save_file, key, result, suffix)
+
+        await save_cached_result(key, file_id, path, size)
+        if path is not None:
+            evicted = await evict_cached_files(self.max_bytes)
+            if evicted:
+                await asyncio.to_thread(self._remove_files, evicted)
+
+    def _save_file(self, key: str, result: Union[Path, bytes], suffix: str) -> Tuple[str, int]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if isinstance(result, bytes):
+            target = self.directory / f"{key}{suffix}"
+            target.write_bytes(result)
+        else:
+            target = self.directory / f"{key}{Path(result).suffix}"
+            shutil.move(str(result), target)
+        return str(target), target.stat().st_size
+
+    @staticmethod
+    def _remove_files(paths: List[str]) -> None:
+        for path in paths:
+            with contextlib.suppress(OSError):
+                Path(path).unlink()
+
+    async def forget_file_id(self, key: str) -> None:
+        await forget_cached_file_id(key)
+
+    async def send(
+        self,
+        key: str,
+        send: Callable[[Union[str, FSInputFile]], Awaitable[Any]],
+        file_id_of: Callable[[Any], str],
+    ) -> bool:
+        """
+        Отправляет результат из кэша: по file_id (без загрузки), а если Telegram
+        его не принял — файлом с диска. Возвращает True, если результат отправлен.
+        """
+        cached = await self.get(key)
+        if cached is None:
+            return False
+
+        if cached.file_id:
+            try:
+                await send(cached.file_id)
+                return True
+            except TelegramBadRequest as e:
+                logger.warning(f"Кэшированный file_id отклонен Telegram: {e}")
+                await self.forget_file_id(key)
+
+        if cached.path:
+            sent = await send(FSInputFile(cached.path))
+            await self.store(key, file_id_of(sent))
+            return True
+        return False
+
+    def busy(self, key: str) -> bool:
+        """Такую же задачу уже кто-то выполняет (или ждет) в этом процессе."""
+        return key in self._locks
+
+    @contextlib.asynccontextmanager
+    async def lock(self, key: str) -> AsyncIterator[None]:
+        """Сериализует обработку одинаковых задач (coalescing in-flight запросов)."""
+        lock, waiters = self._locks.get(key, (asyncio.Lock(), 0))
+        self._locks[key] = (lock, waiters + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, waiters = self._locks[key]
+            if waiters <= 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, waiters - 1)
+
+
+# Singleton instance
+result_cache = ResultCache(CACHE_DIR, RESULT_CACHE_MAX_MB * 1024 * 1024)
@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -9,6 +10,12 @@ def _get_base_dir() -> Path:
         return Path(sys.executable).parent
     return Path(__file__).resolve().parent.parent
 
+def _default_scratch_dir() -> Path:
+    """Рабочая область задач: tmpfs, если он есть (Linux), иначе системный temp."""
+    shm = Path("/dev/shm")
+    root = shm if shm.is_dir() else Path(tempfile.gettempdir())
+    return root / "maximusbot"
+
 # =============================================================================
 # Paths
 # =============================================================================
@@ -18,6 +25,12 @@ load_dotenv(BASE_DIR / ".env")
 MODELS_DIR = BASE_DIR / "models"
 DB_PATH = BASE_DIR / "bot.db"
 LOG_PATH = BASE_DIR / "bot.log"
+# Рабочие файлы (memory-mapped буферы и т.п.); должны лежать на диске, не в RAM
+TEMP_DIR = BASE_DIR / "tmp"
+# Каталоги задач Video2Round (по умолчанию на tmpfs)
+SCRATCH_DIR = Path(os.getenv("SCRATCH_DIR") or _default_scratch_dir())
+# Дисковый уровень кэша готовых результатов
+CACHE_DIR = BASE_DIR / "cache"
 
 # =============================================================================
 # Secrets & Environment
@@ -35,4 +48,191 @@ ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
 MAX_VIDEO_SIZE_MB = 50
 MAX_VIDEO_DURATION_SEC = 60
 MAX_IMAGE_SIZE_MB = 10
-UPSCALE_FACTOR = 4
\ No newline at end of file
+# Лимит Bot API на загрузку файла ботом
+TELEGRAM_UPLOAD_LIMIT_MB = 50
+# Сторона кружка (video note) в пикселях
+VIDEO_NOTE_SIZE = 400
+# Общий лимит рабочей области задач; задачи сверх лимита отклоняются
+SCRATCH_QUOTA_MB = int(os.getenv("SCRATCH_QUOTA_MB", 1024))
+# Лимит дискового кэша результатов (LRU); 0 — хранить только file_id
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", 2048))
+# Token bucket на пользователя и тип задачи: до THROTTLE_BURST задач подряд,
+# затем одна новая раз в THROTTLE_REFILL_SEC. На ADMIN_ID не действует.
+# Корзины живут в памяти процесса бота: лимиты действуют на процесс, и при
+# нескольких экземплярах бота с одним токеном каждый считает их отдельно
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", 3))
+THROTTLE_REFILL_SEC = float(os.getenv("THROTTLE_REFILL_SEC", 120))
+
+# =============================================================================
+# Доставка обновлений
+# =============================================================================
+# "polling" — long polling, "webhook" — aiohttp-сервер принимает обновления от Telegram
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес (https://bot.example.com), на который reverse proxy пробрасывает
+# WEBHOOK_PATH; если пусто, вебхук регистрируется вручную, а бот только слушает порт
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Адрес, который слушает aiohttp (за прокси — обычно 127.0.0.1)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# Секрет в заголовке X-Telegram-Bot-Api-Secret-Token: за прокси IP отправителя
+# не проверить, поэтому подлинность запроса подтверждается им
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Сколько одновременных соединений Telegram открывает к вебхуку
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+
+# =============================================================================
+# Исходящие запросы к Bot API
+# =============================================================================
+# Лимиты Telegram: около 30 сообщений в секунду на бота, около одного в секунду
+# в личный чат и 20 в минуту в группу. Держимся чуть ниже, чтобы не ловить 429
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 25))
+OUTBOUND_CHAT_INTERVAL_SEC = float(os.getenv("OUTBOUND_CHAT_INTERVAL_SEC", 1.0))
+OUTBOUND_GROUP_INTERVAL_SEC = float(os.getenv("OUTBOUND_GROUP_INTERVAL_SEC", 3.0))
+# Сколько раз повторять запрос после 429 (retry_after), прежде чем вернуть ошибку
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 3))
+
+# =============================================================================
+# Логирование
+# =============================================================================
+# Записи уходят в очередь и пишутся фоновым потоком: event loop не ждет вывода
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Формат консоли: "text" — для человека, "json" — запись JSON на строку
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Файл LOG_PATH пишется всегда в JSON и ротируется по размеру; 0 — не писать
+LOG_FILE_MAX_MB = int(os.getenv("LOG_FILE_MAX_MB", 20))
+# При переполнении очереди записи отбрасываются (счетчик в метриках), а не ждут
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+# Доля сохраняемых записей по типу события, например "update=0.1,monitor=0.5".
+# Тип сверяется целиком ("update.Message"), затем по префиксу до точки ("update").
+# WARNING и выше не отбрасываются никогда
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# =============================================================================
+# Метрики
+# =============================================================================
+# /metrics бота в формате Prometheus; 0 — выключено. Каждому процессу (боту и
+# каждому воркеру очереди) нужен свой порт
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+# Порт воркера очереди: по умолчанию выключено, чтобы воркеры на одной машине
+# с ботом не спорили за METRICS_PORT. Несколько воркеров — свой порт каждому
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 0))
+
+# =============================================================================
+# Трассировка и профилирование
+# =============================================================================
+# Спаны задач (скачивание, декодирование, тайлы сети, кодирование, отправка):
+# JSON-строка на задачу, файл ротируется по размеру
+TRACE_PATH = Path(os.getenv("TRACE_PATH") or BASE_DIR / "traces.jsonl")
+TRACE_MAX_MB = int(os.getenv("TRACE_MAX_MB", 20))
+# Задача дольше порога включает профилирование следующих PROFILE_SLOW_JOBS задач; 0 — выкл.
+TRACE_SLOW_JOB_SEC = float(os.getenv("TRACE_SLOW_JOB_SEC", 60))
+PROFILE_SLOW_JOBS = int(os.getenv("PROFILE_SLOW_JOBS", 1))
+# "cprofile" (.prof для pstats/snakeviz) или "torch" (.json для chrome://tracing)
+PROFILE_KIND = os.getenv("PROFILE_KIND", "cprofile")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR") or BASE_DIR / "profiles")
+
+# =============================================================================
+# Очередь задач и воркеры
+# =============================================================================
+# "inline" — медиа обрабатывается в процессе бота, "queue" — бот только ставит
+# задачи в очередь, а обрабатывают их отдельные процессы `python -m bot.worker`
+PROCESSING_MODE = os.getenv("PROCESSING_MODE", "inline")
+# SQLite-файл очереди; у всех фронтендов и воркеров должен быть один и тот же
+JOBS_DB_PATH = Path(os.getenv("JOBS_DB_PATH") or BASE_DIR / "jobs.db")
+# Воркер продлевает аренду задачи, пока работает; просроченная задача
+# (воркер упал) снова выдается другому воркеру, но не больше JOB_MAX_ATTEMPTS раз
+JOB_LEASE_SEC = int(os.getenv("JOB_LEASE_SEC", 60))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_POLL_INTERVAL_SEC = float(os.getenv("JOB_POLL_INTERVAL_SEC", 0.5))
+# Сколько задач один процесс-воркер выполняет одновременно
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 1))
+# Хранилище FSM: "memory" — в процессе, "sqlite" — в bot.db (общее для фронтендов
+# на одной машине), "redis" — aiogram RedisStorage по FSM_REDIS_URL (нужен redis)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+
+# =============================================================================
+# Database
+# =============================================================================
+# Действия пользователей пишутся в БД пачками: раз в интервал или по набору пачки
+DB_FLUSH_INTERVAL_SEC = float(os.getenv("DB_FLUSH_INTERVAL_SEC", 2))
+DB_FLUSH_BATCH = int(os.getenv("DB_FLUSH_BATCH", 100))
+# Сырые строки статистики старше срока удаляются (они уже учтены в агрегатах)
+STATS_RAW_RETENTION_DAYS = int(os.getenv("STATS_RAW_RETENTION_DAYS", 30))
+# Почасовые корзины храним недолго, дневные — бессрочно
+STATS_HOURLY_RETENTION_DAYS = int(os.getenv("STATS_HOURLY_RETENTION_DAYS", 14))
+STATS_COMPACT_INTERVAL_SEC = int(os.getenv("STATS_COMPACT_INTERVAL_SEC", 3600))
+# Статус бота кэшируется в памяти процесса и перечитывается из БД не реже
+# раза в этот срок: /set_status в другом процессе виден с такой задержкой
+STATUS_CACHE_TTL_SEC = float(os.getenv("STATUS_CACHE_TTL_SEC", 30))
+
+# =============================================================================
+# Video2Round
+# =============================================================================
+# "ffmpeg" — один проход ffmpeg с фильтр-графом, "moviepy" — покадрово через MoviePy,
+# "segmented" — нарезка по ключевым кадрам и параллельное кодирование сегментов
+VIDEO_ENGINE = os.getenv("VIDEO_ENGINE", "ffmpeg")
+# Число сегментов для "segmented"; 0 — по числу ядер
+VIDEO_SEGMENTS = int(os.getenv("VIDEO_SEGMENTS", 0))
+# Сегменты короче этого не имеют смысла: накладные расходы съедят выигрыш
+VIDEO_SEGMENT_MIN_SEC = 5
+# Явный путь к ffmpeg; по умолчанию ищется в PATH или берется из imageio-ffmpeg
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY")
+
+# =============================================================================
+# AI Upscale Scheduler
+# =============================================================================
+# Где выполняется инференс: "thread" — в потоках процесса бота,
+# "process" — у каждого воркера отдельный процесс со своей моделью
+UPSCALE_EXECUTION = os.getenv("UPSCALE_EXECUTION", "thread")
+# Сколько инференсов выполняется одновременно (у каждого воркера своя модель)
+UPSCALE_WORKERS = max(1, int(os.getenv("UPSCALE_WORKERS", 1)))
+# Максимум задач, ожидающих в очереди; сверх лимита новые запросы отклоняются
+UPSCALE_QUEUE_SIZE = int(os.getenv("UPSCALE_QUEUE_SIZE", 20))
+# 1 — все воркеры делят одну модель и выполняют инференс по очереди
+UPSCALE_SHARED_MODEL = os.getenv("UPSCALE_SHARED_MODEL", "0") == "1"
+# Микро-батчинг: тайлы нескольких запросов склеиваются в один forward-проход.
+# 1 — выключено; при > 1 все воркеры делят одну модель с общим батчером.
+# Работает только в режиме "thread": процессы не делят модель между собой
+UPSCALE_BATCH_SIZE = max(1, int(os.getenv("UPSCALE_BATCH_SIZE", 1))) if UPSCALE_EXECUTION == "thread" else 1
+# Сколько батчер ждет попутные тайлы, прежде чем запустить неполный батч
+UPSCALE_BATCH_WINDOW_MS = float(os.getenv("UPSCALE_BATCH_WINDOW_MS", 15))
+# Сторона тайла в батч-режиме (одинаковая форма нужна для склейки)
+UPSCALE_BATCH_TILE = int(os.getenv("UPSCALE_BATCH_TILE", 256))
+# Потоки torch на процесс; по умолчанию ядра делятся поровну между воркерами,
+# а в батч-режиме все ядра отдаются единственному потоку инференса
+UPSCALE_TORCH_THREADS = int(os.getenv("UPSCALE_TORCH_THREADS", 0)) or max(
+    1, (os.cpu_count() or 1) // (1 if UPSCALE_BATCH_SIZE > 1 else UPSCALE_WORKERS)
+)
+# Видео-апскейл: кадров в одной пачке, читаемой из декодера
+UPSCALE_VIDEO_CHUNK = int(os.getenv("UPSCALE_VIDEO_CHUNK", 8))
+# Максимальная длинная сторона результата; исходник уменьшается, если ×4 не влезает
+UPSCALE_VIDEO_MAX_SIDE = int(os.getenv("UPSCALE_VIDEO_MAX_SIDE", 1280))
+# "adaptive" — тайлы под бюджет памяти и выход в memory-mapped буфер, "off" — целиком
+UPSCALE_TILING = os.getenv("UPSCALE_TILING", "adaptive")
+# Бюджет памяти на один инференс (активации сети + выходной буфер в RAM)
+UPSCALE_MEMORY_BUDGET_MB = int(os.getenv("UPSCALE_MEMORY_BUDGET_MB", 512))
+# Перекрытие тайлов в пикселях входа, убирает швы на стыках
+UPSCALE_TILE_PAD = 10
+# Бэкенд инференса на CPU: "torch" — PyTorch fp32, "torchscript" — замороженный граф,
+# "onnx" — ONNX Runtime, "onnx-int8" — ONNX Runtime с int8-весами (нужен onnxruntime).
+# Граф экспортируется в models/ при первом запуске; на GPU всегда "torch"
+UPSCALE_BACKEND = os.getenv("UPSCALE_BACKEND", "torch")
+# Модели для фото в порядке предпочтения (см. bot/ai/models.py); используются те,
+# чьи веса лежат в models/. Масштаб выбирается по размеру входа
+UPSCALE_MODELS = os.getenv("UPSCALE_MODELS", "general-x4,x2")
+# Лимит пикселей результата (мегапиксели): крупным фото достается меньший масштаб
+UPSCALE_MAX_OUTPUT_MP = float(os.getenv("UPSCALE_MAX_OUTPUT_MP", 16))
+# Модель для видео и для API с заранее выделенным буфером (масштаб фиксирован)
+UPSCALE_VIDEO_MODEL = os.getenv("UPSCALE_VIDEO_MODEL", "general-x4")
+# Бюджет памяти на загруженные модели в одном воркере; редкие выгружаются (LRU)
+UPSCALE_MODEL_CACHE_MB = int(os.getenv("UPSCALE_MODEL_CACHE_MB", 256))
+# Формат результата фото: "png", "webp" или "jpeg". Если файл не влезает в лимит
+# Telegram, кодировщик сам переходит к более компактному формату (PNG -> WebP -> JPEG)
+UPSCALE_OUTPUT_FORMAT = os.getenv("UPSCALE_OUTPUT_FORMAT", "png")
+# Сжатие PNG 0-9: выше — меньше файл, но дольше кодирование
+UPSCALE_PNG_COMPRESSION = int(os.getenv("UPSCALE_PNG_COMPRESSION", 1))
+UPSCALE_WEBP_QUALITY = int(os.getenv("UPSCALE_WEBP_QUALITY", 95))
+UPSCALE_JPEG_QUALITY = int(os.getenv("UPSCALE_JPEG_QUALITY", 95))
@@ -1,33 +1,185 @@
+import asyncio
 import sqlite3
 import logging
-from contextlib import contextmanager
-from typing import Generator, Tuple, Optional
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Optional, TypeVar
 
-from .config import DB_PATH
+from .config import (
+    DB_FLUSH_BATCH,
+    DB_FLUSH_INTERVAL_SEC,
+    DB_PATH,
+    STATS_COMPACT_INTERVAL_SEC,
+    STATS_HOURLY_RETENTION_DAYS,
+    STATS_RAW_RETENTION_DAYS,
+    STATUS_CACHE_TTL_SEC,
+)
 
 logger = logging.getLogger(__name__)
 
-@contextmanager
-def db_connection() -> Generator[sqlite3.Cursor, None, None]:
+T = TypeVar("T")
+
+DEFAULT_STATUS = "Работаю над проектами 🚀"
+
+
+class Database:
     """
-    Контекстный менеджер для безопасной работы с SQLite.
-    Автоматически делает commit при успехе и rollback при ошибке.
+    Одно долгоживущее соединение SQLite в режиме WAL и выделенный поток,
+    через который последовательно идут все запросы.
+
+    Event loop никогда не ждет диск: корутины получают результат через
+    `run()`, действия пользователей копятся в буфере и пишутся пачками
+    (write-behind), а статус бота отдается из памяти и перечитывается
+    после STATUS_CACHE_TTL_SEC.
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    try:
-        yield cursor
-        conn.commit()
-    except sqlite3.Error as e:
-        conn.rollback()
-        logger.error(f"Ошибка базы данных: {e}")
-        raise
-    finally:
-        conn.close()
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: List[Tuple[int, str, str]] = []
+        self._pending_lock = threading.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self.status: Optional[str] = None
+        self.status_loaded_at = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение создается в потоке БД при первом запросе и живет до close()."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # В WAL NORMAL не теряет целостность, но не делает fsync на каждый commit
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # Файл могут открывать и другие процессы (воркеры очереди задач)
+            self._conn.execute("PRAGMA busy_timeout=5000")
+        return self._conn
+
+    def _transaction(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Выполняется в потоке БД. Commit при успехе и rollback при ошибке.
+        """
+        conn = self._connection()
+        try:
+            with conn:
+                return fn(conn.cursor(), *args)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка базы данных: {e}")
+            raise
+
+    def submit(self, fn: Callable[..., T], *args: Any) -> "Future[T]":
+        """Ставит `fn(cursor, *args)` в очередь потока БД."""
+        return self._executor.submit(self._transaction, fn, *args)
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def run_sync(self, fn: Callable[..., T], *args: Any) -> T:
+        """Для вызова вне event loop (инициализация, потоки)."""
+        return self.submit(fn, *args).result()
+
+    # -------------------------------------------------------------------------
+    # Write-behind для статистики
+    # -------------------------------------------------------------------------
+
+    def buffer_action(self, user_id: int, action: str) -> None:
+        # Время фиксируется в момент действия, а не записи (формат CURRENT_TIMESTAMP, UTC)
+        row = (user_id, action, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
+        with self._pending_lock:
+            self._pending.append(row)
+            full = len(self._pending) >= DB_FLUSH_BATCH
+        if full:
+            self.flush()
+
+    def flush(self) -> "Future[None]":
+        """Отправляет накопленные действия одной транзакцией, не дожидаясь записи."""
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+        return self.submit(_insert_actions, rows)
+
+    def start(self) -> None:
+        """
+        Запускает фоновые задачи в текущем event loop (идемпотентно):
+        сброс буфера действий и сжатие старой статистики.
+        """
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(
+                self._every(DB_FLUSH_INTERVAL_SEC, lambda: asyncio.wrap_future(self.flush())),
+                name="db-flusher",
+            ),
+            asyncio.create_task(self._every(STATS_COMPACT_INTERVAL_SEC, compact_stats), name="db-compactor"),
+        ]
+
+    @staticmethod
+    async def _every(interval: float, job: Callable[[], Awaitable[Any]]) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await job()
+            except Exception:
+                # Фоновая задача не должна умирать от одной ошибки
+                logger.exception("Ошибка фоновой задачи БД")
+
+    async def close(self) -> None:
+        """Останавливает фоновые задачи, дописывает буфер и закрывает соединение."""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await asyncio.wrap_future(self.flush())
+        await asyncio.wrap_future(self._executor.submit(self._close_connection))
+        self._executor.shutdown(wait=True)
+
+    def _close_connection(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def _insert_actions(cursor: sqlite3.Cursor, rows: List[Tuple[int, str, str]]) -> None:
+    """Сырые строки и инкрементальное обновление агрегатов — одной транзакцией."""
+    if not rows:
+        return
+    cursor.executemany("INSERT INTO stats (user_id, action, timestamp) VALUES (?, ?, ?)", rows)
+
+    cursor.executemany(
+        "INSERT OR IGNORE INTO stat_users (user_id, first_seen) VALUES (?, ?)",
+        [(user_id, timestamp) for user_id, _, timestamp in rows],
+    )
+    # rowcount после executemany — сколько пользователей реально добавлено
+    counters = Counter({"users": max(cursor.rowcount, 0)})
+    buckets: Counter = Counter()
+    for _, action, timestamp in rows:
+        counters[f"action:{action}"] += 1
+        buckets["hour", timestamp[:13], action] += 1
+        buckets["day", timestamp[:10], action] += 1
+
+    cursor.executemany(
+        """
+        INSERT INTO stat_counters (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        """,
+        list(counters.items()),
+    )
+    cursor.executemany(
+        """
+        INSERT INTO stat_buckets (period, bucket, action, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT(period, bucket, action) DO UPDATE SET count = count + excluded.count
+        """,
+        [(*key, count) for key, count in buckets.items()],
+    )
+
+
+# Singleton instance
+db = Database(DB_PATH)
+
 
 def init_db() -> None:
-    """Инициализирует структуру БД и дефолтные значения."""
-    schema = """
+    """Инициализирует структуру БД и дефолтные значения, загружает статус в память."""
+    schema = f"""
         CREATE TABLE IF NOT EXISTS settings (
             key TEXT PRIMARY KEY,
             value TEXT
@@ -37,41 +189,209 @@ def init_db() -> None:
             action TEXT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         );
-        INSERT OR IGNORE INTO settings (key, value) VALUES ('status', 'Работаю над проектами 🚀');
+        CREATE INDEX IF NOT EXISTS idx_stats_timestamp ON stats (timestamp);
+        -- Агрегаты статистики, обновляются инкрементально при записи действий
+        CREATE TABLE IF NOT EXISTS stat_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS stat_users (
+            user_id INTEGER PRIMARY KEY,
+            first_seen DATETIME
+        );
+        -- period: 'hour' (bucket 'YYYY-MM-DD HH') или 'day' (bucket 'YYYY-MM-DD')
+        CREATE TABLE IF NOT EXISTS stat_buckets (
+            period TEXT,
+            bucket TEXT,
+            action TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, bucket, action)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS result_cache (
+            key TEXT PRIMARY KEY,
+            file_id TEXT,
+            path TEXT,
+            size INTEGER DEFAULT 0,
+            last_used REAL DEFAULT (julianday('now'))
+        );
+        INSERT OR IGNORE INTO settings (key, value) VALUES ('status', '{DEFAULT_STATUS}');
     """
-    with db_connection() as cursor:
-        cursor.executescript(schema)
+    db.run_sync(lambda cursor: cursor.executescript(schema))
+    db.run_sync(_backfill_rollups)
+    db.status = db.run_sync(_select_status)
+    db.status_loaded_at = time.monotonic()
+
+
+def _backfill_rollups(cursor: sqlite3.Cursor) -> None:
+    """Однократно строит агрегаты по сырым строкам, записанным до их появления."""
+    cursor.execute("SELECT 1 FROM settings WHERE key = 'stats_rollups'")
+    if cursor.fetchone():
+        return
+
+    cursor.executescript("""
+        INSERT OR IGNORE INTO stat_users (user_id, first_seen)
+            SELECT user_id, MIN(timestamp) FROM stats GROUP BY user_id;
+        INSERT OR REPLACE INTO stat_counters (name, value)
+            SELECT 'users', COUNT(*) FROM stat_users;
+        INSERT OR REPLACE INTO stat_counters (name, value)
+            SELECT 'action:' || action, COUNT(*) FROM stats GROUP BY action;
+        INSERT OR REPLACE INTO stat_buckets (period, bucket, action, count)
+            SELECT 'hour', substr(timestamp, 1, 13), action, COUNT(*) FROM stats GROUP BY 2, 3;
+        INSERT OR REPLACE INTO stat_buckets (period, bucket, action, count)
+            SELECT 'day', substr(timestamp, 1, 10), action, COUNT(*) FROM stats GROUP BY 2, 3;
+        INSERT INTO settings (key, value) VALUES ('stats_rollups', '1');
+    """)
+
 
-def get_status() -> str:
-    """Возвращает текущий статус бота."""
-    with db_connection() as cursor:
-        cursor.execute("SELECT value FROM settings WHERE key = 'status'")
-        result = cursor.fetchone()
-    return result[0] if result else "Работаю над проектами 🚀"
+def _select_status(cursor: sqlite3.Cursor) -> str:
+    cursor.execute("SELECT value FROM settings WHERE key = 'status'")
+    result = cursor.fetchone()
+    return result[0] if result else DEFAULT_STATUS
+
+
+async def get_status() -> str:
+    """
+    Возвращает текущий статус бота из памяти; из БД — при первом обращении
+    и по истечении STATUS_CACHE_TTL_SEC (статус мог сменить другой процесс).
+    """
+    if db.status is None or time.monotonic() - db.status_loaded_at > STATUS_CACHE_TTL_SEC:
+        db.status = await db.run(_select_status)
+        db.status_loaded_at = time.monotonic()
+    return db.status
+
+
+async def set_status(new_status: str) -> None:
+    """Обновляет статус бота в БД и в памяти."""
+    await db.run(
+        lambda cursor: cursor.execute("UPDATE settings SET value = ? WHERE key = 'status'", (new_status,))
+    )
+    db.status = new_status
+    db.status_loaded_at = time.monotonic()
 
-def set_status(new_status: str) -> None:
-    """Обновляет статус бота."""
-    with db_connection() as cursor:
-        cursor.execute("UPDATE settings SET value = ? WHERE key = 'status'", (new_status,))
 
 def log_action(user_id: int, action: str) -> None:
-    """Логирует действие пользователя в статистику."""
-    with db_connection() as cursor:
-        cursor.execute("INSERT INTO stats (user_id, action) VALUES (?, ?)", (user_id, action))
+    """Логирует действие пользователя в статистику (буферизуется, запись пачками)."""
+    db.buffer_action(user_id, action)
+
+
+def _select_stats(cursor: sqlite3.Cursor) -> Tuple[int, Dict[str, int]]:
+    cursor.execute("SELECT name, value FROM stat_counters")
+    counters = dict(cursor.fetchall())
+    users = counters.pop("users", 0)
+    return users, {name.removeprefix("action:"): value for name, value in counters.items()}
+
+
+async def get_stats() -> Tuple[int, Dict[str, int]]:
+    """
+    Возвращает статистику за все время из агрегатов (без сканирования stats):
+    (всего пользователей, {действие: количество})
+    """
+    # Буфер сбрасывается в ту же очередь раньше запроса — цифры актуальны
+    db.flush()
+    return await db.run(_select_stats)
+
+
+def _select_period_stats(cursor: sqlite3.Cursor, period: str, since: str) -> Dict[str, int]:
+    cursor.execute(
+        "SELECT action, SUM(count) FROM stat_buckets WHERE period = ? AND bucket >= ? GROUP BY action",
+        (period, since),
+    )
+    return dict(cursor.fetchall())
+
+
+async def get_period_stats(hours: int = 0, days: int = 0) -> Dict[str, int]:
+    """
+    Действия за последние `hours` часов (почасовые корзины) или `days` дней
+    (дневные, включая сегодня). Время — UTC.
+    """
+    db.flush()
+    if hours:
+        since = time.strftime("%Y-%m-%d %H", time.gmtime(time.time() - (hours - 1) * 3600))
+        return await db.run(_select_period_stats, "hour", since)
+    since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400))
+    return await db.run(_select_period_stats, "day", since)
+
+
+def _compact_stats(cursor: sqlite3.Cursor) -> Tuple[int, int]:
+    """
+    Удаляет сырые строки и почасовые корзины старше сроков хранения.
+    Все они уже учтены в агрегатах; дневные корзины хранятся бессрочно.
+    """
+    cursor.execute(
+        "DELETE FROM stats WHERE timestamp < datetime('now', ?)", (f"-{STATS_RAW_RETENTION_DAYS} days",)
+    )
+    raw = cursor.rowcount
+    cursor.execute(
+        "DELETE FROM stat_buckets WHERE period = 'hour' AND bucket < strftime('%Y-%m-%d %H', 'now', ?)",
+        (f"-{STATS_HOURLY_RETENTION_DAYS} days",),
+    )
+    return raw, cursor.rowcount
+
+
+async def compact_stats() -> None:
+    """Задача хранения: сжимает старую статистику до агрегатов."""
+    raw, hourly = await db.run(_compact_stats)
+    if raw or hourly:
+        logger.info(f"Статистика сжата: удалено сырых строк {raw}, почасовых корзин {hourly}")
+
+
+# =============================================================================
+# Кэш результатов обработки
+# =============================================================================
+
+def _select_cached_result(cursor: sqlite3.Cursor, key: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    cursor.execute("SELECT file_id, path FROM result_cache WHERE key = ?", (key,))
+    result = cursor.fetchone()
+    if result:
+        cursor.execute("UPDATE result_cache SET last_used = julianday('now') WHERE key = ?", (key,))
+    return result
+
+async def get_cached_result(key: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """Возвращает (file_id, путь к файлу) по ключу и отмечает запись как использованную."""
+    return await db.run(_select_cached_result, key)
+
+async def save_cached_result(key: str, file_id: Optional[str], path: Optional[str], size: int) -> None:
+    """Создает или обновляет запись кэша. Пустые поля не затирают уже сохраненные."""
+    await db.run(
+        lambda cursor: cursor.execute(
+            """
+            INSERT INTO result_cache (key, file_id, path, size) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                file_id = COALESCE(excluded.file_id, file_id),
+                path = COALESCE(excluded.path, path),
+                size = CASE WHEN excluded.path IS NULL THEN size ELSE excluded.size END,
+                last_used = julianday('now')
+            """,
+            (key, file_id, path, size),
+        )
+    )
+
+async def forget_cached_file_id(key: str) -> None:
+    """Сбрасывает file_id, который Telegram перестал принимать."""
+    await db.run(lambda cursor: cursor.execute("UPDATE result_cache SET file_id = NULL WHERE key = ?", (key,)))
+
+def _evict_cached_files(cursor: sqlite3.Cursor, max_bytes: int) -> List[str]:
+    cursor.execute(
+        "SELECT key, path, size FROM result_cache WHERE path IS NOT NULL ORDER BY last_used DESC"
+    )
+    evicted = []
+    total = 0
+    for key, path, size in cursor.fetchall():
+        total += size
+        if total > max_bytes:
+            evicted.append((key, path))
+
+    cursor.executemany(
+        "UPDATE result_cache SET path = NULL, size = 0 WHERE key = ?",
+        [(key,) for key, _ in evicted],
+    )
+    return [path for _, path in evicted]
 
-def get_stats() -> Tuple[int, int, int]:
+async def evict_cached_files(max_bytes: int) -> List[str]:
     """
-    Возвращает статистику:
-    (всего пользователей, кол-во конвертаций, кол-во апскейлов)
+    LRU-вытеснение дискового уровня кэша: оставляет самые свежие файлы
+    суммарным размером до `max_bytes`, у остальных обнуляет путь.
+    file_id при этом сохраняются — повторная отправка по ним бесплатна.
+    Возвращает пути файлов, которые нужно удалить с диска.
     """
-    with db_connection() as cursor:
-        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM stats")
-        users = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM stats WHERE action = 'conversion'")
-        conversions = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM stats WHERE action = 'ai_upscale'")
-        upscales = cursor.fetchone()[0]
-        
-    return users, conversions, upscales
\ No newline at end of file
+    return await db.run(_evict_cached_files, max_bytes)
@@ -0,0 +1,280 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Локальная замена Bot API для нагрузочных тестов (bot/loadtest.py): тот же
+# HTTP-протокол, что у api.telegram.org, поэтому бот работает с ней через обычную
+# сессию aiogram — достаточно TelegramAPIServer.from_base(api.base_url).
+# Отправленное ботом складывается в исходящие по чатам, откуда их ждет драйвер.
+
+BOT_ID = 100_000
+
+
+@dataclass
+class OutgoingCall:
+    """Запрос бота к API, адресованный чату (ответ пользователю)."""
+
+    method: str
+    params: Dict[str, Any]
+    result: Any
+    at: float = field(default_factory=time.perf_counter)
+
+
+class FakeBotAPI:
+    """
+    Bot API в памяти: getUpdates (long polling), getFile и скачивание файлов,
+    sendMessage, sendVideoNote, sendVideo, sendDocument, editMessageText,
+    deleteMessage и служебные методы, без которых не стартует поллинг.
+
+    `latency_ms` ± `jitter_ms` добавляются к каждому запросу (кроме getUpdates),
+    с вероятностью `error_rate` запрос отклоняется с 429 и `retry_after`.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 30,
+        jitter_ms: float = 10,
+        error_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._message_ids: Dict[int, itertools.count] = defaultdict(lambda: itertools.count(1))
+        self._file_ids = itertools.count(1)
+        # file_id -> (содержимое, file_unique_id)
+        self._files: Dict[str, Tuple[bytes, str]] = {}
+        self._outbox: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter()
+
+        self._methods: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]] = {
+            "getMe": self._get_me,
+            "deleteWebhook": self._true,
+            "getUpdates": self._get_updates,
+            "getFile": self._get_file,
+            "answerCallbackQuery": self._true,
+            "sendMessage": self._send_message,
+            "sendVideoNote": self._send_media("video_note"),
+            "sendVideo": self._send_media("video"),
+            "sendDocument": self._send_media("document"),
+            "editMessageText": self._edit_message_text,
+            "deleteMessage": self._delete_message,
+        }
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    # -------------------------------------------------------------------------
+    # Сервер
+    # -------------------------------------------------------------------------
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Поднимает сервер (port=0 — любой свободный) и возвращает его базовый URL."""
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._handle_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        logger.info(f"Фейковый Bot API: {self.base_url}")
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _delay(self) -> None:
+        delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        name = request.match_info["method"]
+        handler = self._methods.get(name)
+        if handler is None:
+            return self._error(404, f"Not Found: method {name} is not implemented")
+
+        params = await self._params(request)
+        self.calls[name] += 1
+        if name != "getUpdates":
+            await self._delay()
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.rejected[name] += 1
+                return self._error(
+                    429,
+                    f"Too Many Requests: retry after {self.retry_after}",
+                    parameters={"retry_after": self.retry_after},
+                )
+        try:
+            result = await handler(params)
+        except KeyError as e:
+            return self._error(400, f"Bad Request: {e}")
+        return web.json_response({"ok": True, "result": result})
+
+    async def _handle_file(self, request: web.Request) -> web.StreamResponse:
+        await self._delay()
+        entry = self._files.get(request.match_info["path"])
+        if entry is None:
+            return web.Response(status=404)
+        return web.Response(body=entry[0])
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        """
+        Параметры метода: aiogram шлет multipart/form-data, где вложенные объекты —
+        строки JSON, а файл — отдельная часть, на которую ссылается "attach://<имя>".
+        """
+        if request.content_type == "application/json":
+            return await request.json()
+        params: Dict[str, Any] = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, web.FileField):
+                params[key] = value.file.read()
+            elif value[:1] in ("{", "["):
+                params[key] = json.loads(value)
+            else:
+                params[key] = value
+        for key, value in list(params.items()):
+            if isinstance(value, str) and value.startswith("attach://"):
+                params[key] = params.pop(value.removeprefix("attach://"))
+        return params
+
+    @staticmethod
+    def _error(status: int, description: str, **extra: Any) -> web.Response:
+        return web.json_response(
+            {"ok": False, "error_code": status, "description": description, **extra}, status=status
+        )
+
+    # -------------------------------------------------------------------------
+    # Сторона пользователя (для драйвера)
+    # -------------------------------------------------------------------------
+
+    def next_message_id(self, chat_id: int) -> int:
+        return next(self._message_ids[chat_id])
+
+    def add_file(self, data: bytes, unique_id: Optional[str] = None) -> Tuple[str, str]:
+        """Регистрирует «загруженный пользователем» файл. Возвращает (file_id, file_unique_id)."""
+        file_id = f"file-{next(self._file_ids)}"
+        unique_id = unique_id or file_id
+        self._files[file_id] = (data, unique_id)
+        return file_id, unique_id
+
+    def push_update(self, **payload: Any) -> int:
+        """Кладет обновление (message=..., callback_query=...) в очередь getUpdates."""
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, **payload})
+        self._new_updates.set()
+        return update_id
+
+    async def next_call(self, chat_id: int, timeout: float) -> OutgoingCall:
+        """Следующий запрос бота в чат; asyncio.TimeoutError, если его нет за `timeout`."""
+        return await asyncio.wait_for(self._outbox[chat_id].get(), timeout)
+
+    def forget_chat(self, chat_id: int) -> None:
+        self._outbox.pop(chat_id, None)
+        self._message_ids.pop(chat_id, None)
+
+    # -------------------------------------------------------------------------
+    # Методы API
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    async def _true(_: Dict[str, Any]) -> bool:
+        return True
+
+    @staticmethod
+    async def _get_me(_: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": BOT_ID, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        # Подтвержденные обновления (id < offset) больше не нужны
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout", 0)))
+            except asyncio.TimeoutError:
+                return []
+        return self._updates[:limit]
+
+    async def _get_file(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        file_id = params["file_id"]
+        data, unique_id = self._files[file_id]
+        return {"file_id": file_id, "file_unique_id": unique_id, "file_size": len(data), "file_path": file_id}
+
+    def _message(self, chat_id: int, **content: Any) -> Dict[str, Any]:
+        return {
+            "message_id": self.next_message_id(chat_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "LoadTest"},
+            **content,
+        }
+
+    def _deliver(self, method: str, params: Dict[str, Any], result: Any) -> Any:
+        self._outbox[int(params["chat_id"])].put_nowait(OutgoingCall(method, params, result))
+        return result
+
+    async def _send_message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        message = self._message(int(params["chat_id"]), text=str(params["text"]))
+        return self._deliver("sendMessage", params, message)
+
+    def _send_media(self, kind: str) -> Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]:
+        async def send(params: Dict[str, Any]) -> Dict[str, Any]:
+            # Повторная отправка по file_id (из кэша результатов) — строка, загрузка — байты.
+            # Результаты бот не скачивает, содержимое не храним
+            data = params[kind]
+            if isinstance(data, bytes):
+                file_id, unique_id = self.add_file(b"")
+            else:
+                file_id, unique_id = str(data), self._files.get(str(data), (b"", str(data)))[1]
+            media: Dict[str, Any] = {"file_id": file_id, "file_unique_id": unique_id}
+            if kind == "video_note":
+                media.update(length=int(params.get("length", 0) or 0), duration=0)
+            elif kind == "video":
+                media.update(width=0, height=0, duration=0)
+            message = self._message(int(params["chat_id"]), **{kind: media})
+            if "caption" in params:
+                message["caption"] = params["caption"]
+            return self._deliver(f"send{kind.title().replace('_', '')}", params, message)
+
+        return send
+
+    async def _edit_message_text(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": int(params["message_id"]),
+            "date": int(time.time()),
+            "edit_date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "LoadTest"},
+            "text": str(params["text"]),
+        }
+        return self._deliver("editMessageText", params, message)
+
+    async def _delete_message(self, params: Dict[str, Any]) -> bool:
+        return self._deliver("deleteMessage", params, True)
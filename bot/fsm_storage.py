@@ -0,0 +1,91 @@
+import json
+import logging
+import sqlite3
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from .config import FSM_REDIS_URL, FSM_STORAGE
+from .database import Database, db
+
+logger = logging.getLogger(__name__)
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(
+        str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        )
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM в таблице `fsm` общей БД: состояние пользователя переживает
+    перезапуск бота и видно всем фронтендам, работающим с этим файлом.
+    Запросы идут через поток БД, как и остальные обращения к ней.
+    """
+
+    def __init__(self, database: Database = db):
+        self.database = database
+        database.run_sync(lambda cursor: cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}'
+            )
+        """))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self.database.run(
+            lambda cursor: cursor.execute(
+                """
+                INSERT INTO fsm (key, state) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET state = excluded.state
+                """,
+                (_key(key), value),
+            )
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self.database.run(_select_row, _key(key))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self.database.run(
+            lambda cursor: cursor.execute(
+                """
+                INSERT INTO fsm (key, data) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET data = excluded.data
+                """,
+                (_key(key), json.dumps(dict(data), ensure_ascii=False)),
+            )
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self.database.run(_select_row, _key(key))
+        return json.loads(row[1]) if row else {}
+
+    async def close(self) -> None:
+        # Соединением владеет Database, его закрывает main при остановке
+        pass
+
+
+def _select_row(cursor: sqlite3.Cursor, key: str) -> Optional[tuple]:
+    cursor.execute("SELECT state, data FROM fsm WHERE key = ?", (key,))
+    return cursor.fetchone()
+
+
+def create_storage() -> BaseStorage:
+    """Хранилище FSM по настройке FSM_STORAGE. Вызывать после init_db()."""
+    if FSM_STORAGE == "sqlite":
+        return SQLiteStorage()
+    if FSM_STORAGE == "redis":
+        # Импорт только в этом режиме: пакет redis необязателен
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(FSM_REDIS_URL)
+    return MemoryStorage()
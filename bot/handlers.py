@@ -1,45 +1,50 @@
 import asyncio
 import logging
-import contextlib
-from pathlib import Path
-from typing import Any, Awaitable, Callable, Dict, Union
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple, Union
 
 # Сторонние библиотеки
 from aiogram import Router, F, types, BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import FSInputFile, CallbackQuery, Message
-
-# Совместимость с MoviePy v2.0+
-from moviepy.video.io.VideoFileClip import VideoFileClip
-import moviepy.video.fx.all as vfx
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import CallbackQuery, Message
 
 # Локальные импорты
 from bot.monitor import monitor
-from bot.ai.upscale import UpscaleService
+from bot.jobs import MediaJob, enqueue, queued
+from bot.metrics import UPDATES_TOTAL
+from bot.outbound import flood_control
+from bot.tasks import run_job, send_cached_result
+from bot.tracing import profiler
 from .config import (
     ADMIN_ID,
+    BOT_MODE,
     MAX_VIDEO_SIZE_MB,
     MAX_VIDEO_DURATION_SEC,
     MAX_IMAGE_SIZE_MB,
-    UPSCALE_FACTOR,
+    PROCESSING_MODE,
+    PROFILE_DIR,
+    PROFILE_KIND,
+    THROTTLE_BURST,
+    THROTTLE_REFILL_SEC,
 )
-from .database import set_status, log_action, get_stats, get_status as db_get_status
+from .database import set_status, log_action, get_stats, get_period_stats, get_status as db_get_status
 from .keyboards import main_menu, projects_menu, back_button, converter_menu
 
 # Инициализация роутера (Best practice: использовать Router для модульности)
 router = Router()
 logger = logging.getLogger(__name__)
 
-# Синглтон сервиса
-UPSCALE_SERVICE = UpscaleService()
-
 
 class Form(StatesGroup):
     """Состояния FSM для сценариев обработки."""
     waiting_for_video = State()
     waiting_for_image = State()
+    waiting_for_upscale_video = State()
 
 
 class LoggingMiddleware(BaseMiddleware):
@@ -52,62 +57,112 @@ class LoggingMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         user = getattr(event, "from_user", None)
-        user_id = user.id if user else "unknown"
+        user_id = user.id if user else None
         event_type = event.__class__.__name__
-        logger.info(f"Входящее событие {event_type} от user={user_id}")
+        UPDATES_TOTAL.inc(type=event_type)
+        # Сообщение собирается в потоке записи логов; тип события — ключ для сэмплирования
+        logger.info(
+            "Входящее событие %s от user=%s", event_type, user_id,
+            extra={"event": f"update.{event_type}", "user_id": user_id},
+        )
         return await handler(event, data)
 
 
-# Применяем middleware к роутеру
-router.message.middleware(LoggingMiddleware())
-router.callback_query.middleware(LoggingMiddleware())
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Token bucket на пару (пользователь, тип задачи) для тяжелых хендлеров,
+    помеченных флагом `throttle`. Лишний запрос не доходит до хендлера:
+    пользователь сразу получает ответ, когда можно будет повторить.
+    Хендлер, отклонивший файл при проверке, возвращает False — токен
+    возвращается в корзину, неудачная попытка лимит не тратит.
+    """
 
+    # Сколько корзин держать, прежде чем выбросить полные (неактивных пользователей)
+    MAX_BUCKETS = 10_000
+
+    def __init__(self, burst: int = THROTTLE_BURST, refill_sec: float = THROTTLE_REFILL_SEC):
+        self.burst = burst
+        self.refill_sec = refill_sec
+        # (user_id, тип задачи) -> (токенов, момент последнего пересчета)
+        self._buckets: Dict[Tuple[int, str], Tuple[float, float]] = {}
+
+    def _take(self, key: Tuple[int, str]) -> float:
+        """Списывает токен. Возвращает 0 или сколько секунд ждать следующего."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) / self.refill_sec)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) * self.refill_sec
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > self.MAX_BUCKETS:
+            self._prune(now)
+        return 0
+
+    def _refund(self, key: Tuple[int, str]) -> None:
+        """Возвращает списанный токен (не выше burst)."""
+        tokens, updated = self._buckets.get(key, (self.burst, time.monotonic()))
+        self._buckets[key] = (min(self.burst, tokens + 1), updated)
+
+    def _prune(self, now: float) -> None:
+        self._buckets = {
+            key: (tokens, updated)
+            for key, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) / self.refill_sec < self.burst
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        kind = get_flag(data, "throttle")
+        user = getattr(event, "from_user", None)
+        if kind is None or user is None or user.id == ADMIN_ID:
+            return await handler(event, data)
+
+        key = (user.id, kind)
+        wait = self._take(key)
+        if wait:
+            logger.info(
+                "Троттлинг %s для user=%s: ждать %.0f с", kind, user.id, wait,
+                extra={"event": "throttle", "user_id": user.id, "kind": kind},
+            )
+            await event.answer(
+                f"⏳ Слишком много задач подряд. Следующую можно отправить через {math.ceil(wait)} с.",
+                reply_markup=main_menu(),
+            )
+            return None
+        result = await handler(event, data)
+        if result is False:
+            self._refund(key)
+        return result
 
-# =============================================================================
-# Вспомогательные функции и контекстные менеджеры
-# =============================================================================
 
-@contextlib.contextmanager
-def temp_files_manager(*paths: Union[str, Path]):
+class CallbackAnswerMiddleware(BaseMiddleware):
     """
-    Контекстный менеджер для автоматической очистки временных файлов.
-    Гарантирует удаление файлов даже в случае возникновения исключений.
+    Отмечает сообщение с нажатой кнопкой в слое исходящих запросов: его правки
+    в ответ на нажатие не ждут лимита на чат (лимит нужен для статусов задач).
     """
-    clean_paths = [Path(p) for p in paths]
-    try:
-        yield
-    finally:
-        for path in clean_paths:
-            with contextlib.suppress(OSError):
-                if path.exists():
-                    path.unlink()
 
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        message = getattr(event, "message", None)
+        if message is not None:
+            flood_control.answering(message.chat.id, message.message_id)
+        return await handler(event, data)
 
-def _process_video_sync(input_path: str, output_path: str) -> None:
-    """
-    CPU-зависимая логика обработки видео (MoviePy).
-    Должна запускаться в отдельном потоке/экзекьюторе, чтобы не блокировать event loop.
-    """
-    with VideoFileClip(input_path) as clip:
-        # Обрезаем длительность
-        if clip.duration > MAX_VIDEO_DURATION_SEC:
-            clip = clip.subclip(0, MAX_VIDEO_DURATION_SEC)
-
-        # Кропаем в квадрат и меняем размер
-        w, h = clip.size
-        side = min(w, h)
-        
-        # Синтаксис MoviePy 2.0+ (через vfx)
-        clip = vfx.crop(clip, x_center=w / 2, y_center=h / 2, width=side, height=side)
-        clip = vfx.resize(clip, height=400)
-
-        clip.write_videofile(
-            output_path,
-            codec="libx264",
-            audio_codec="aac",
-            logger=None,
-            preset="fast"  # Оптимизация скорости
-        )
+
+# Применяем middleware к роутеру
+router.message.middleware(LoggingMiddleware())
+router.message.middleware(ThrottlingMiddleware())
+router.callback_query.middleware(LoggingMiddleware())
+router.callback_query.middleware(CallbackAnswerMiddleware())
 
 
 # =============================================================================
@@ -124,43 +179,78 @@ async def set_status_command(message: Message) -> None:
         await message.answer("Использование: `/set_status <текст>`", parse_mode="Markdown")
         return
 
-    set_status(status)
+    await set_status(status)
     log_action(message.from_user.id, "set_status")
     await message.answer(f"✅ Статус обновлен:\n<b>{status}</b>", parse_mode="HTML")
 
 
+# Действия, которые показываются в /stats, и их подписи
+STATS_ACTIONS = {
+    "conversion": "Конвертаций видео",
+    "ai_upscale": "Upscale операций",
+    "video_upscale": "Upscale видео",
+}
+
+
+def _format_actions(counts: Dict[str, int]) -> str:
+    return "\n".join(f"{label}: {counts.get(action, 0)}" for action, label in STATS_ACTIONS.items())
+
+
 @router.message(Command("stats"))
 async def stats_command(message: Message) -> None:
     if message.from_user.id != ADMIN_ID:
         return
 
-    users, conversions, upscales = get_stats()
+    # Все цифры берутся из агрегатов, время ответа не зависит от объема истории
+    users, totals = await get_stats()
+    last_day = await get_period_stats(hours=24)
+    last_week = await get_period_stats(days=7)
     await message.answer(
         f"📊 <b>Статистика:</b>\n"
         f"Пользователей: {users}\n"
-        f"Конвертаций видео: {conversions}\n"
-        f"Upscale операций: {upscales}",
+        f"{_format_actions(totals)}\n\n"
+        f"<b>За 24 часа:</b>\n{_format_actions(last_day)}\n\n"
+        f"<b>За 7 дней:</b>\n{_format_actions(last_week)}",
         parse_mode="HTML"
     )
 
 
+@router.message(Command("profile"))
+async def profile_command(message: Message) -> None:
+    """/profile [N] [cprofile|torch] — профилировать следующие N задач обработки."""
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    args = message.text.split()[1:]
+    jobs = int(args[0]) if args and args[0].isdigit() else 1
+    kind = args[1] if len(args) > 1 else PROFILE_KIND
+    try:
+        profiler.arm(jobs, kind)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    await message.answer(f"🔬 Профилирую ({kind}) следующие задачи: {jobs}.\nФайлы: <code>{PROFILE_DIR}</code>")
+
+
 # =============================================================================
 # Меню и Навигация
 # =============================================================================
+# Быстрые хендлеры возвращают метод API вместо await: в режиме вебхука
+# он уходит прямо в ответе на запрос Telegram, при поллинге aiogram вызывает его сам
 
 @router.message(CommandStart())
-async def start_handler(message: Message) -> None:
+async def start_handler(message: Message) -> SendMessage:
     log_action(message.from_user.id, "start")
     monitor.log_event(message.from_user.full_name, "Бот запущен")
     
-    await message.answer(
+    return message.answer(
         f"Привет, {message.from_user.first_name}! 👋\nВыбери раздел:",
         reply_markup=main_menu(),
     )
 
 
 @router.callback_query(F.data == "about")
-async def about_handler(callback: CallbackQuery) -> None:
+async def about_handler(callback: CallbackQuery) -> EditMessageText:
     await callback.answer()
     info = (
         "👤 <b>Разработчик Telegram-ботов</b>\n"
@@ -168,7 +258,7 @@ async def about_handler(callback: CallbackQuery) -> None:
         "📛 Чистый код и стабильность.\n"
         "🌐 Меня зовут Максим."
     )
-    await callback.message.edit_text(
+    return callback.message.edit_text(
         text=info, 
         parse_mode="HTML", 
         reply_markup=back_button()
@@ -176,9 +266,9 @@ async def about_handler(callback: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data == "contacts")
-async def contacts_handler(callback: CallbackQuery) -> None:
+async def contacts_handler(callback: CallbackQuery) -> EditMessageText:
     await callback.answer()
-    await callback.message.edit_text(
+    return callback.message.edit_text(
         text=(
             "📬 <b>Связь с разработчиком:</b>\n\n"
             "@MagaManiero\n"
@@ -190,18 +280,18 @@ async def contacts_handler(callback: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data == "status")
-async def status_handler(callback: CallbackQuery) -> None:
+async def status_handler(callback: CallbackQuery) -> EditMessageText:
     await callback.answer()
     
     try:
-        current_status = db_get_status()
+        current_status = await db_get_status()
     except Exception:
         logger.exception("Не удалось получить статус из БД")
         current_status = None
         
     status_text = current_status or "🟢 Работаю над кодом..."
     
-    await callback.message.edit_text(
+    return callback.message.edit_text(
         text=f"ℹ️ <b>Текущий статус:</b>\n{status_text}", 
         parse_mode="HTML", 
         reply_markup=back_button()
@@ -209,9 +299,9 @@ async def status_handler(callback: CallbackQuery) -> None:
 
 
 @router.callback_query(F.data == "projects")
-async def projects_handler(callback: CallbackQuery) -> None:
+async def projects_handler(callback: CallbackQuery) -> EditMessageText:
     await callback.answer()
-    await callback.message.edit_text(
+    return callback.message.edit_text(
         text="🛠 Выбери инструмент:",
         reply_markup=projects_menu(),
     )
@@ -238,118 +328,140 @@ async def back_handler(callback: CallbackQuery, state: FSMContext) -> None:
 # =============================================================================
 
 @router.callback_query(F.data == "run_v2r")
-async def run_video_converter(callback: CallbackQuery, state: FSMContext) -> None:
+async def run_video_converter(callback: CallbackQuery, state: FSMContext) -> EditMessageText:
     await callback.answer()
     await state.set_state(Form.waiting_for_video)
-    await callback.message.edit_text(
+    return callback.message.edit_text(
         text="🎬 Пришли видео (до 50 МБ, до 60 сек)",
         reply_markup=converter_menu(),
     )
 
 
 @router.callback_query(F.data == "run_ai_upscale")
-async def run_ai_upscale(callback: CallbackQuery, state: FSMContext) -> None:
+async def run_ai_upscale(callback: CallbackQuery, state: FSMContext) -> EditMessageText:
     await callback.answer()
     await state.set_state(Form.waiting_for_image)
-    await callback.message.edit_text(
+    return callback.message.edit_text(
         text="🖼 Пришли изображение КАК ФАЙЛ 📎\nФото Telegram сжимает.",
         reply_markup=back_button(),
     )
 
 
+@router.callback_query(F.data == "run_video_upscale")
+async def run_video_upscale(callback: CallbackQuery, state: FSMContext) -> EditMessageText:
+    await callback.answer()
+    await state.set_state(Form.waiting_for_upscale_video)
+    return callback.message.edit_text(
+        text=(
+            f"🎞 Пришли видео (до {MAX_VIDEO_SIZE_MB} МБ)\n"
+            f"Обработаю первые {MAX_VIDEO_DURATION_SEC} сек."
+        ),
+        reply_markup=converter_menu(),
+    )
+
+
 # =============================================================================
 # Логика обработки медиа
 # =============================================================================
+# Хендлеры только проверяют файл и создают задачу. В режиме очереди задача
+# сохраняется в БД и выполняется процессом-воркером (python -m bot.worker),
+# иначе — здесь же, в процессе бота
+
+def _make_job(message: Message, kind: str, media: Union[types.Video, types.Document]) -> MediaJob:
+    return MediaJob(
+        kind=kind,
+        chat_id=message.chat.id,
+        user_id=message.from_user.id,
+        user_name=message.from_user.full_name,
+        file_id=media.file_id,
+        file_unique_id=media.file_unique_id,
+        file_size=media.file_size or 0,
+        file_name=getattr(media, "file_name", None),
+    )
 
-@router.message(Form.waiting_for_video, F.video)
-async def process_video(message: Message, state: FSMContext) -> None:
-    """Обрабатывает получение видео, валидацию и конвертацию."""
-    user_id = message.from_user.id
-    monitor.log_event(message.from_user.full_name, "Старт Video2Round")
 
-    # Валидация
-    if message.video.file_size > MAX_VIDEO_SIZE_MB * 1024 * 1024:
-        await message.answer("❌ Видео слишком большое.", reply_markup=main_menu())
+async def _reject(message: Message, text: str) -> bool:
+    """Отклоняет файл при проверке; False возвращает токен троттлинга."""
+    await message.answer(text, reply_markup=main_menu())
+    return False
+
+
+# Задачи, запущенные в фоне в режиме вебхука (ссылки держим, чтобы их не собрал GC)
+_background: Set[asyncio.Task] = set()
+
+
+async def _dispatch(message: Message, job: MediaJob) -> None:
+    if PROCESSING_MODE != "queue":
+        if BOT_MODE != "webhook":
+            await run_job(message.bot, job)
+            return
+        # Вебхук обрабатывается внутри HTTP-запроса Telegram: долгая задача держала бы
+        # его соединение (их не больше WEBHOOK_MAX_CONNECTIONS) и тормозила меню у всех
+        task = asyncio.create_task(run_job(message.bot, job), name=f"job-{job.kind}-{job.user_id}")
+        _background.add(task)
+        task.add_done_callback(_background.discard)
         return
 
-    status_msg = await message.answer("⏳ Скачиваю и обрабатываю...")
-    
-    input_path = Path(f"temp_in_{user_id}.mp4")
-    output_path = Path(f"temp_out_{user_id}.mp4")
-
-    # Используем контекстный менеджер для авто-очистки
-    with temp_files_manager(input_path, output_path):
-        try:
-            await message.bot.download(message.video, destination=input_path)
-
-            # Запускаем тяжелую задачу в пуле потоков, чтобы не блокировать asyncio
-            await asyncio.to_thread(
-                _process_video_sync, 
-                str(input_path), 
-                str(output_path)
-            )
+    # Готовый результат отдаем сразу, не занимая воркер
+    if await send_cached_result(message.bot, job):
+        return
+
+    # Позицию считаем заранее, чтобы статус ушел одним сообщением, без правки
+    position = await queued() + 1
+    status_msg = await message.answer(
+        f"⏳ Вы в очереди: {position}. Подождите немного..."
+        if position > 1
+        else "⏳ Задача принята, жду свободного обработчика..."
+    )
+    job.status_message_id = status_msg.message_id
+    await enqueue(job)
 
-            await message.answer_video_note(FSInputFile(output_path))
-            await message.answer("✅ Готово!", reply_markup=main_menu())
-            
-            log_action(user_id, "conversion")
 
-        except Exception as e:
-            logger.error(f"Ошибка обработки видео для user {user_id}: {e}", exc_info=True)
-            await message.answer("❌ Ошибка при обработке видео.")
-        finally:
-            with contextlib.suppress(Exception):
-                await status_msg.delete()
-            await state.clear()
+@router.message(Form.waiting_for_video, F.video, flags={"throttle": "video_note"})
+async def process_video(message: Message, state: FSMContext) -> Optional[bool]:
+    """Проверяет видео и ставит задачу конвертации в кружок."""
+    monitor.log_event(message.from_user.full_name, "Старт Video2Round")
 
+    # Валидация
+    if message.video.file_size > MAX_VIDEO_SIZE_MB * 1024 * 1024:
+        return await _reject(message, "❌ Видео слишком большое.")
 
-@router.message(Form.waiting_for_image, F.document)
-async def process_image(message: Message, state: FSMContext) -> None:
-    """Обрабатывает получение изображения и AI upscale."""
-    user_id = message.from_user.id
+    try:
+        await _dispatch(message, _make_job(message, "video_note", message.video))
+    finally:
+        await state.clear()
+
+
+@router.message(Form.waiting_for_image, F.document, flags={"throttle": "ai_upscale"})
+async def process_image(message: Message, state: FSMContext) -> Optional[bool]:
+    """Проверяет изображение и ставит задачу AI upscale."""
     monitor.log_event(message.from_user.full_name, "Старт AI Upscale")
 
     document = message.document
     if not document.mime_type or not document.mime_type.startswith("image/"):
-        await message.answer("❌ Это не изображение.", reply_markup=main_menu())
-        return
+        return await _reject(message, "❌ Это не изображение.")
 
     if document.file_size > MAX_IMAGE_SIZE_MB * 1024 * 1024:
-        await message.answer("❌ Изображение слишком большое.", reply_markup=main_menu())
-        return
+        return await _reject(message, "❌ Изображение слишком большое.")
 
-    status_msg = await message.answer("⏳ Улучшаю изображение...")
-    
-    input_path = Path(f"temp_up_in_{user_id}.png")
-    output_path = Path(f"temp_up_out_{user_id}.png")
-
-    with temp_files_manager(input_path, output_path):
-        try:
-            file_info = await message.bot.get_file(document.file_id)
-            await message.bot.download_file(file_info.file_path, input_path)
-
-            # Предполагаем, что upscale блокирующий, запускаем в потоке
-            await asyncio.to_thread(
-                UPSCALE_SERVICE.upscale, 
-                input_path, 
-                output_path
-            )
+    try:
+        await _dispatch(message, _make_job(message, "ai_upscale", document))
+    finally:
+        await state.clear()
 
-            await message.answer_document(
-                FSInputFile(output_path),
-                caption=f"✅ Качество улучшено ×{UPSCALE_FACTOR}",
-            )
-            await message.answer("Готово! Что делаем дальше?", reply_markup=main_menu())
-            
-            log_action(user_id, "ai_upscale")
-
-        except Exception as e:
-            logger.error(f"Ошибка Upscale для user {user_id}: {e}", exc_info=True)
-            await status_msg.edit_text("❌ Ошибка при обработке изображения.")
-        finally:
-            with contextlib.suppress(Exception):
-                await status_msg.delete()
-            await state.clear()
+
+@router.message(Form.waiting_for_upscale_video, F.video, flags={"throttle": "video_upscale"})
+async def process_video_upscale(message: Message, state: FSMContext) -> Optional[bool]:
+    """Проверяет видео и ставит задачу AI upscale видео."""
+    monitor.log_event(message.from_user.full_name, "Старт AI Upscale видео")
+
+    if message.video.file_size > MAX_VIDEO_SIZE_MB * 1024 * 1024:
+        return await _reject(message, "❌ Видео слишком большое.")
+
+    try:
+        await _dispatch(message, _make_job(message, "video_upscale", message.video))
+    finally:
+        await state.clear()
 
 
 @router.message(Form.waiting_for_image)
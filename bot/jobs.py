@@ -0,0 +1,177 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from .config import ADMIN_ID, JOB_LEASE_SEC, JOB_MAX_ATTEMPTS, JOBS_DB_PATH
+from .database import Database
+from .metrics import Gauge, registry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MediaJob:
+    """
+    Задача обработки медиа. Содержит все, что нужно исполнителю,
+    чтобы работать без исходного Message (в том числе в другом процессе).
+    """
+    # "video_note" | "ai_upscale" | "video_upscale"
+    kind: str
+    chat_id: int
+    user_id: int
+    user_name: str
+    file_id: str
+    file_unique_id: str
+    file_size: int
+    file_name: Optional[str] = None
+    status_message_id: Optional[int] = None
+
+
+# Отдельный файл: очередь делят фронтенды и воркеры, не трогая bot.db
+jobs_db = Database(JOBS_DB_PATH)
+
+
+def init_jobs_db() -> None:
+    jobs_db.run_sync(lambda cursor: cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            -- queued -> running -> (удаляется) | failed
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_until REAL,
+            error TEXT,
+            created REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+    """))
+
+
+def _insert_job(cursor: sqlite3.Cursor, job: MediaJob) -> int:
+    cursor.execute(
+        "INSERT INTO jobs (kind, payload, created) VALUES (?, ?, ?)",
+        (job.kind, json.dumps(dataclasses.asdict(job)), time.time()),
+    )
+    job_id = cursor.lastrowid
+    cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id <= ?", (job_id,))
+    return cursor.fetchone()[0]
+
+
+async def enqueue(job: MediaJob) -> int:
+    """Сохраняет задачу в очередь и возвращает ее позицию (1 — следующая)."""
+    return await jobs_db.run(_insert_job, job)
+
+
+async def queued() -> int:
+    """Сколько задач ждет в очереди."""
+    return await jobs_db.run(
+        lambda cursor: cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    )
+
+
+# Как часто обновлять метрику длины очереди, секунды
+_QUEUE_GAUGE_INTERVAL_SEC = 5.0
+
+
+async def watch_queue() -> None:
+    """
+    Публикует длину очереди jobs.db (bot_jobs_queued) для режима очереди: там
+    планировщик апскейла в процессе бота пуст, а задачи ждут в этой таблице.
+    Метрика регистрируется при запуске, в режиме inline ее нет.
+    """
+    depth = registry.register(Gauge("bot_jobs_queued", "Задачи, ожидающие воркер в jobs.db"))
+    while True:
+        try:
+            depth.set(await queued())
+        except Exception:
+            logger.exception("Не удалось обновить длину очереди задач")
+        await asyncio.sleep(_QUEUE_GAUGE_INTERVAL_SEC)
+
+
+def _expire_jobs(cursor: sqlite3.Cursor) -> List[Tuple[int, MediaJob]]:
+    # Задачи упавших воркеров (аренда истекла) исчерпали попытки — больше не выдаем
+    cursor.execute(
+        """
+        UPDATE jobs SET status = 'failed', error = 'lease expired'
+        WHERE status = 'running' AND lease_until < ? AND attempts >= ?
+        RETURNING id, payload
+        """,
+        (time.time(), JOB_MAX_ATTEMPTS),
+    )
+    return [(job_id, MediaJob(**json.loads(payload))) for job_id, payload in cursor.fetchall()]
+
+
+async def expire() -> List[Tuple[int, MediaJob]]:
+    """
+    Помечает failed задачи, исчерпавшие попытки на упавших воркерах, и возвращает их:
+    пользователю нужно сообщить, иначе статус «в очереди» так и останется висеть.
+    Каждая задача возвращается ровно одному вызывающему.
+    """
+    return await jobs_db.run(_expire_jobs)
+
+
+def _claim_job(cursor: sqlite3.Cursor, worker: str) -> Optional[Tuple[int, MediaJob]]:
+    now = time.time()
+    # Один UPDATE атомарен: два воркера не получат одну и ту же задачу.
+    # Как и в планировщике: у пользователя одна задача в работе, задачи админа — первыми
+    cursor.execute(
+        """
+        UPDATE jobs SET status = 'running', worker = :worker, lease_until = :lease, attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM jobs AS j
+            WHERE (status = 'queued' OR (status = 'running' AND lease_until < :now AND attempts < :max_attempts))
+              AND NOT EXISTS (
+                SELECT 1 FROM jobs AS r
+                WHERE r.status = 'running' AND r.lease_until >= :now
+                  AND json_extract(r.payload, '$.user_id') = json_extract(j.payload, '$.user_id')
+              )
+            ORDER BY json_extract(payload, '$.user_id') = :admin DESC, id
+            LIMIT 1
+        )
+        RETURNING id, payload
+        """,
+        {
+            "worker": worker,
+            "lease": now + JOB_LEASE_SEC,
+            "now": now,
+            "max_attempts": JOB_MAX_ATTEMPTS,
+            "admin": ADMIN_ID,
+        },
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0], MediaJob(**json.loads(row[1]))
+
+
+async def claim(worker: str) -> Optional[Tuple[int, MediaJob]]:
+    """Берет следующую задачу в работу с арендой на JOB_LEASE_SEC."""
+    return await jobs_db.run(_claim_job, worker)
+
+
+async def extend_lease(job_id: int) -> None:
+    await jobs_db.run(
+        lambda cursor: cursor.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() + JOB_LEASE_SEC, job_id)
+        )
+    )
+
+
+async def complete(job_id: int) -> None:
+    """Готовые задачи не храним: результат уже доставлен пользователю."""
+    await jobs_db.run(lambda cursor: cursor.execute("DELETE FROM jobs WHERE id = ?", (job_id,)))
+
+
+async def fail(job_id: int, error: str) -> None:
+    await jobs_db.run(
+        lambda cursor: cursor.execute(
+            "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (error[-1000:], job_id)
+        )
+    )
@@ -35,6 +35,7 @@ def projects_menu() -> InlineKeyboardMarkup:
     tools = [
         ("🎬 Запустить Video2Round", "run_v2r"),
         ("🖼️ Запустить AI Upscale", "run_ai_upscale"),
+        ("🎞️ AI Upscale для видео", "run_video_upscale"),
         ("📚 FAQ по Video2Round", "faq_v2r"),
         ("⬅️ Назад в меню", "back"),
     ]
@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+
+from . import database
+from .cache import result_cache
+from .config import FSM_STORAGE, PROCESSING_MODE
+from .database import Database, init_db
+from .fake_api import BOT_ID, FakeBotAPI, OutgoingCall
+from .fsm_storage import SQLiteStorage, create_storage
+from .outbound import flood_control
+
+logger = logging.getLogger(__name__)
+
+# Нагрузочный тест диспетчера без Telegram: фейковый Bot API (bot/fake_api.py)
+# и тысячи синтетических пользователей, которые проходят сценарии через
+# настоящий `router`, FSM, middleware и лимитер исходящих запросов.
+#
+#   python -m bot.loadtest --users 2000 --rate 200                 — меню и навигация
+#   python -m bot.loadtest --flows menu,video_note --users 200     — с обработкой видео
+#   python -m bot.loadtest --error-rate 0.02 --latency-ms 80       — медленный API с 429
+#
+# Лимиты берутся из конфига как в проде (OUTBOUND_GLOBAL_RATE, THROTTLE_*), их можно
+# переопределить переменными окружения. Статистика и кэш пишутся во временную папку.
+# Медиа обрабатываются в процессе бота, поэтому медиасценарии требуют PROCESSING_MODE=inline.
+
+TOKEN = f"{BOT_ID}:LOADTEST"
+FIRST_USER_ID = 10_000_000
+
+
+class FlowError(Exception):
+    """Бот ответил не тем, что ожидал сценарий."""
+
+
+@dataclass
+class FlowStats:
+    started: int = 0
+    ok: int = 0
+    failed: int = 0
+    timeouts: int = 0
+    # Задержка шага: от отправки обновления до запроса бота с ответом
+    steps: List[float] = field(default_factory=list)
+    # Весь сценарий от первого шага до последнего ответа
+    durations: List[float] = field(default_factory=list)
+    errors: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу; 0 для пустого списка."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+# =============================================================================
+# Синтетический пользователь
+# =============================================================================
+
+class SyntheticUser:
+    """Личный чат одного пользователя: шлет обновления и ждет ответов бота."""
+
+    def __init__(self, api: FakeBotAPI, user_id: int, stats: FlowStats, timeout: float):
+        self.api = api
+        self.user_id = user_id
+        self.stats = stats
+        self.timeout = timeout
+        self._user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        self._callbacks = itertools.count(1)
+
+    def _message(self, **content: Any) -> Dict[str, Any]:
+        return {
+            "message_id": self.api.next_message_id(self.user_id),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private", "first_name": self._user["first_name"]},
+            "from": self._user,
+            **content,
+        }
+
+    async def _reply(self, started: float, expect: str) -> OutgoingCall:
+        """
+        Ждет ответ бота: первый запрос в чат с клавиатурой. Статусы («в очереди»,
+        «обрабатываю») идут без клавиатуры и пропускаются.
+        """
+        deadline = started + self.timeout
+        while True:
+            call = await self.api.next_call(self.user_id, max(0.0, deadline - time.perf_counter()))
+            if "reply_markup" in call.params:
+                break
+        self.stats.steps.append(call.at - started)
+        if call.method != expect:
+            raise FlowError(f"{expect} -> {call.method}: {str(call.params.get('text', ''))[:60]}")
+        return call
+
+    async def command(self, text: str, expect: str = "sendMessage") -> OutgoingCall:
+        started = time.perf_counter()
+        self.api.push_update(message=self._message(
+            text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        ))
+        return await self._reply(started, expect)
+
+    async def press(self, menu: OutgoingCall, data: str, expect: str = "editMessageText") -> OutgoingCall:
+        """Нажимает кнопку под сообщением бота `menu`."""
+        started = time.perf_counter()
+        self.api.push_update(callback_query={
+            "id": f"{self.user_id}-{next(self._callbacks)}",
+            "from": self._user,
+            "chat_instance": str(self.user_id),
+            "message": menu.result,
+            "data": data,
+        })
+        return await self._reply(started, expect)
+
+    async def upload(self, expect: str, **media: Any) -> OutgoingCall:
+        """Отправляет медиа (video=... или document=...) и ждет результат обработки."""
+        started = time.perf_counter()
+        self.api.push_update(message=self._message(**media))
+        return await self._reply(started, expect)
+
+
+# =============================================================================
+# Сценарии
+# =============================================================================
+
+@dataclass
+class Media:
+    """Синтетический файл, общий для всех пользователей сценария."""
+
+    data: bytes
+    attrs: Dict[str, Any]
+    # Свой file_unique_id на каждую загрузку: иначе кэш результатов отдаст готовое
+    unique: bool = True
+
+    def attach(self, api: FakeBotAPI, user_id: int) -> Dict[str, Any]:
+        file_id, unique_id = api.add_file(self.data, None if self.unique else "loadtest-shared")
+        return {"file_id": file_id, "file_unique_id": unique_id, "file_size": len(self.data), **self.attrs}
+
+
+Flow = Callable[[SyntheticUser], Awaitable[None]]
+
+
+async def flow_menu(user: SyntheticUser) -> None:
+    """/start и навигация по меню: только быстрые хендлеры."""
+    menu = await user.command("/start")
+    projects = await user.press(menu, "projects")
+    main = await user.press(projects, "back")
+    await user.press(main, "status")
+
+
+def media_flow(button: str, kind: str, media: Media, expect: str) -> Flow:
+    """/start, выбор инструмента (состояние FSM) и загрузка файла до получения результата."""
+
+    async def flow(user: SyntheticUser) -> None:
+        menu = await user.command("/start")
+        projects = await user.press(menu, "projects")
+        await user.press(projects, button)
+        await user.upload(expect, **{kind: media.attach(user.api, user.user_id)})
+
+    return flow
+
+
+def _video(workdir: Path, unique: bool) -> Media:
+    from .bench import synthetic_clip
+
+    clip = synthetic_clip(workdir / "loadtest.mp4", height=240, duration=2)
+    return Media(clip.read_bytes(), {"width": 426, "height": 240, "duration": 2, "mime_type": "video/mp4"}, unique)
+
+
+def _image(unique: bool) -> Media:
+    import cv2
+
+    from .bench import synthetic_image
+
+    _, png = cv2.imencode(".png", synthetic_image(128, 128))
+    return Media(png.tobytes(), {"file_name": "loadtest.png", "mime_type": "image/png"}, unique)
+
+
+def build_flows(names: List[str], workdir: Path, unique_media: bool) -> Dict[str, Flow]:
+    flows: Dict[str, Flow] = {}
+    for name in names:
+        if name == "menu":
+            flows[name] = flow_menu
+        elif name == "video_note":
+            flows[name] = media_flow("run_v2r", "video", _video(workdir, unique_media), "sendVideoNote")
+        elif name == "ai_upscale":
+            flows[name] = media_flow("run_ai_upscale", "document", _image(unique_media), "sendDocument")
+        elif name == "video_upscale":
+            flows[name] = media_flow("run_video_upscale", "video", _video(workdir, unique_media), "sendVideo")
+        else:
+            raise ValueError(f"Неизвестный сценарий: {name}")
+    return flows
+
+
+# =============================================================================
+# Прогон
+# =============================================================================
+
+@contextlib.asynccontextmanager
+async def _isolated(workdir: Path) -> AsyncIterator[None]:
+    """Подменяет БД и папку кэша временными, чтобы прогон не трогал данные бота."""
+    original_db, original_cache = database.db, result_cache.directory
+    database.db = Database(workdir / "bot.db")
+    result_cache.directory = workdir / "cache"
+    try:
+        init_db()
+        database.db.start()
+        yield
+    finally:
+        await database.db.close()
+        database.db, result_cache.directory = original_db, original_cache
+
+
+async def _run_user(user: SyntheticUser, flow: Flow) -> None:
+    stats = user.stats
+    stats.started += 1
+    started = time.perf_counter()
+    try:
+        await flow(user)
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+    except FlowError as e:
+        stats.failed += 1
+        stats.errors[str(e)] += 1
+    else:
+        stats.ok += 1
+        stats.durations.append(time.perf_counter() - started)
+    finally:
+        user.api.forget_chat(user.user_id)
+
+
+async def run_load(
+    api: FakeBotAPI,
+    flows: Dict[str, Flow],
+    users: int,
+    rate: float,
+    timeout: float,
+) -> Dict[str, Any]:
+    """Запускает бота на фейковом API и прогоняет `users` пользователей по сценариям по кругу."""
+    from .handlers import router
+    from .tasks import UPSCALE_SCHEDULER
+
+    storage = SQLiteStorage(database.db) if FSM_STORAGE == "sqlite" else create_storage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+
+    bot = Bot(
+        token=TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(api.base_url)),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    bot.session.middleware(flood_control)
+
+    upscale = bool(flows.keys() & {"ai_upscale", "video_upscale"})
+    if upscale:
+        UPSCALE_SCHEDULER.start()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+
+    stats = {name: FlowStats() for name in flows}
+    order = list(flows.items())
+    started = time.perf_counter()
+    try:
+        tasks = []
+        for index in range(users):
+            name, flow = order[index % len(order)]
+            user = SyntheticUser(api, FIRST_USER_ID + index, stats[name], timeout)
+            tasks.append(asyncio.create_task(_run_user(user, flow)))
+            if rate:
+                await asyncio.sleep(1 / rate)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    finally:
+        with contextlib.suppress(RuntimeError):
+            await dp.stop_polling()
+        await polling
+        if upscale:
+            await UPSCALE_SCHEDULER.stop()
+        await storage.close()
+        await bot.session.close()
+
+    return {
+        "elapsed_sec": elapsed,
+        "api_calls": dict(api.calls),
+        "api_429": dict(api.rejected),
+        "flows": {name: _summary(flow_stats, elapsed) for name, flow_stats in stats.items()},
+    }
+
+
+def _summary(stats: FlowStats, elapsed: float) -> Dict[str, Any]:
+    return {
+        "started": stats.started,
+        "ok": stats.ok,
+        "failed": stats.failed,
+        "timeouts": stats.timeouts,
+        "flows_per_sec": stats.ok / elapsed if elapsed else 0.0,
+        "steps_per_sec": len(stats.steps) / elapsed if elapsed else 0.0,
+        "step_ms": {f"p{q}": _percentile(stats.steps, q) * 1000 for q in (50, 95, 99)},
+        "flow_ms": {f"p{q}": _percentile(stats.durations, q) * 1000 for q in (50, 95, 99)},
+        "errors": dict(stats.errors),
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"\nПрогон: {report['elapsed_sec']:.1f} с")
+    print(f"{'сценарий':<14}{'ok':>7}{'ошиб':>7}{'тайм':>7}{'сц/с':>9}{'шаг/с':>9}"
+          f"{'шаг p50':>10}{'p95':>9}{'p99':>9}{'сцен p50':>11}{'p99':>9}")
+    for name, flow in report["flows"].items():
+        step, total = flow["step_ms"], flow["flow_ms"]
+        print(
+            f"{name:<14}{flow['ok']:>7}{flow['failed']:>7}{flow['timeouts']:>7}"
+            f"{flow['flows_per_sec']:>9.1f}{flow['steps_per_sec']:>9.1f}"
+            f"{step['p50']:>8.0f}мс{step['p95']:>7.0f}мс{step['p99']:>7.0f}мс"
+            f"{total['p50']:>9.0f}мс{total['p99']:>7.0f}мс"
+        )
+        for error, count in flow["errors"].items():
+            print(f"    {count} × {error}")
+    calls = ", ".join(f"{method} {count}" for method, count in sorted(report["api_calls"].items()))
+    print(f"Запросы к API: {calls}")
+    if report["api_429"]:
+        print(f"Отклонено с 429: {sum(report['api_429'].values())}")
+
+
+async def _main(args: argparse.Namespace) -> Dict[str, Any]:
+    api = FakeBotAPI(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    await api.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="loadtest_") as tmp:
+            workdir = Path(tmp)
+            flows = build_flows(args.flows.split(","), workdir, unique_media=not args.shared_media)
+            async with _isolated(workdir):
+                return await run_load(api, flows, args.users, args.rate, args.step_timeout)
+    finally:
+        await api.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bot.loadtest", description="Нагрузочный тест на фейковом Bot API")
+    parser.add_argument("--flows", default="menu", help="menu, video_note, ai_upscale, video_upscale через запятую")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100, help="новых пользователей в секунду (0 — все сразу)")
+    parser.add_argument("--step-timeout", type=float, default=120, help="ожидание ответа бота, с")
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов, отклоняемых с 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--shared-media", action="store_true", help="один файл на всех: проверка кэша результатов")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", type=Path, help="сохранить отчет в JSON")
+    args = parser.parse_args(argv)
+
+    if PROCESSING_MODE == "queue" and args.flows != "menu":
+        parser.error("медиасценарии выполняются только при PROCESSING_MODE=inline")
+
+    report = asyncio.run(_main(args))
+    _print_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    flows = report["flows"].values()
+    return 1 if any(flow["failed"] or flow["timeouts"] for flow in flows) else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Optional, TextIO
+
+from .config import (
+    LOG_FILE_MAX_MB,
+    LOG_FORMAT,
+    LOG_LEVEL,
+    LOG_PATH,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLE_RATES,
+)
+
+# Логирование без ввода-вывода на горячем пути: хендлер только кладет запись
+# в очередь, а форматирование и запись в консоль/файл делает поток QueueListener.
+# Структурные поля передаются через extra={...} и попадают в JSON как есть:
+#   logger.info("Входящее событие %s", kind, extra={"event": "update.Message", "user_id": 1})
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Атрибуты, которые есть у любой LogRecord; все остальное — поля из extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """"update=0.1,monitor=0.5" -> {"update": 0.1, "monitor": 0.5}."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю `rate` записей своего типа события (поле `event`).
+    Записи без типа и уровня WARNING и выше проходят всегда. У сохраненной
+    выборочной записи есть поле `sample_rate` — для пересчета в полные объемы.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def _rate(self, event: str) -> float:
+        rate = self._resolved.get(event)
+        if rate is None:
+            rate = self.rates.get(event, self.rates.get(event.split(".", 1)[0], 1.0))
+            self._resolved[event] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(event)
+        if rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись как одна строка JSON: время, уровень, логгер, сообщение и поля из extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    QueueHandler, который никогда не блокирует и не форматирует.
+
+    Стандартный `prepare` склеивает сообщение с аргументами в потоке вызова;
+    здесь запись уходит как есть, и `getMessage` вызывается уже в потоке
+    писателя. Поэтому в аргументы логов передаются значения, а не объекты,
+    которые меняются после вызова. Переполненная очередь не ждет: запись
+    отбрасывается и учитывается в `dropped`.
+    """
+
+    def __init__(self, records: "queue.Queue[logging.LogRecord]"):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def queued_handler(handler: logging.Handler) -> AsyncQueueHandler:
+    """
+    Переводит отдельный хендлер (например, файл трасс) на ту же схему: вызывающий
+    поток только кладет запись в очередь, а `handler` пишет в своем фоновом потоке.
+    """
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(LOG_QUEUE_SIZE)
+    listener = QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return AsyncQueueHandler(records)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(stream: Optional[TextIO] = None) -> None:
+    """
+    Настраивает корневой логгер (идемпотентно): очередь -> фоновый поток ->
+    консоль (LOG_FORMAT) и файл LOG_PATH в JSON. Очередь дописывается при выходе.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    console = logging.StreamHandler(stream or sys.stderr)
+    console.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    handlers: list = [console]
+    if LOG_FILE_MAX_MB:
+        file_handler = RotatingFileHandler(
+            LOG_PATH, maxBytes=LOG_FILE_MAX_MB * 1024 * 1024, backupCount=3, encoding="utf-8", delay=True
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(LOG_QUEUE_SIZE)
+    handler = AsyncQueueHandler(records)
+    handler.addFilter(SamplingFilter(parse_rates(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    from .metrics import gauge
+
+    gauge("bot_log_dropped_records", "Записи лога, отброшенные из-за переполнения очереди", lambda: handler.dropped)
@@ -1,21 +1,22 @@
 import asyncio
-import io
+import contextlib
 import logging
 import sys
+import time
+from typing import Dict, Iterator
 
-from aiogram import Bot
+from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
-from bot.config import TOKEN
-from bot.database import init_db
-from bot.handlers import dp
+from bot.config import BOT_MODE, PROCESSING_MODE, TOKEN
+from bot.database import db, init_db
+from bot.jobs import init_jobs_db, jobs_db, watch_queue
+from bot.logs import setup_logging
+from bot.outbound import flood_control
 
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -28,29 +29,87 @@ def _configure_io_encoding() -> None:
         stream = getattr(sys, stream_name)
         if stream is not None:
             try:
-                # Переоборачиваем поток с явным указанием кодировки
-                new_stream = io.TextIOWrapper(
-                    stream.detach(), 
-                    encoding='utf-8', 
-                    errors='replace'
-                )
-                setattr(sys, stream_name, new_stream)
+                # Меняем кодировку на месте: detach() сломал бы StreamHandler логгера,
+                # который уже держит ссылку на этот поток
+                stream.reconfigure(encoding='utf-8', errors='replace')
             except AttributeError:
                 # Игнорируем, если поток уже настроен или недоступен
                 pass
 
 
+@contextlib.contextmanager
+def _phase(phases: Dict[str, float], name: str) -> Iterator[None]:
+    """Замеряет длительность этапа запуска."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = time.perf_counter() - started
+
+
+def _create_dispatcher() -> Dispatcher:
+    """Собирает диспетчер: роутер с хендлерами и хуки жизненного цикла."""
+    from bot.fsm_storage import create_storage
+    from bot.handlers import router
+    from bot.metrics import start_metrics_server
+    from bot.tasks import UPSCALE_SCHEDULER
+
+    dp = Dispatcher(storage=create_storage())
+    dp.include_router(router)
+
+    # В режиме очереди медиа обрабатывают воркеры, модели боту не нужны
+    inline = PROCESSING_MODE != "queue"
+
+    metrics_runner = None
+    queue_watcher = None
+
+    async def on_startup() -> None:
+        nonlocal metrics_runner, queue_watcher
+        # Модели грузятся и прогреваются в фоне; запросы до готовности ждут в очереди
+        if inline:
+            UPSCALE_SCHEDULER.start()
+        else:
+            queue_watcher = asyncio.create_task(watch_queue(), name="jobs-queue-gauge")
+        db.start()
+        metrics_runner = await start_metrics_server()
+
+    async def on_shutdown() -> None:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if queue_watcher is not None:
+            queue_watcher.cancel()
+        if inline:
+            await UPSCALE_SCHEDULER.stop()
+        # Дописываем буфер статистики до выхода
+        await db.close()
+        if not inline:
+            await jobs_db.close()
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
 async def main() -> None:
     """Точка входа в приложение."""
     _configure_io_encoding()
-    
+    started = time.perf_counter()
+    phases: Dict[str, float] = {}
+
     logger.info("🚀 Инициализация базы данных...")
     try:
-        init_db()
+        with _phase(phases, "БД"):
+            init_db()
+            if PROCESSING_MODE == "queue":
+                init_jobs_db()
     except Exception as e:
         logger.critical(f"❌ Ошибка инициализации БД: {e}")
         return
 
+    # Хендлеры импортируются здесь, чтобы замерить этап; torch и MoviePy в него не входят
+    with _phase(phases, "импорт хендлеров"):
+        dp = _create_dispatcher()
+
     logger.info("🚀 Запуск бота...")
     
     # Инициализируем бота с дефолтными настройками (HTML-парсинг везде)
@@ -58,16 +117,34 @@ async def main() -> None:
         token=TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
+    # Все исходящие запросы идут через общий лимитер частоты и обработку 429
+    bot.session.middleware(flood_control)
+
+    async def report_startup() -> None:
+        phases["до приема обновлений"] = time.perf_counter() - started
+        logger.info("⏱ Запуск: " + ", ".join(f"{name} {sec:.2f} с" for name, sec in phases.items()))
+
+    # Регистрируем последним: отчет пишется после остальных startup-хуков
+    dp.startup.register(report_startup)
 
     try:
-        # Удаляем вебхук и сбрасываем обновления, накопившиеся пока бот спал
-        await bot.delete_webhook(drop_pending_updates=True)
-        
-        # Запускаем поллинг (long-polling)
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            # aiohttp-сервер; импортируем только в этом режиме
+            from bot.webhook import run_webhook
+
+            await run_webhook(dp, bot)
+        else:
+            # Удаляем вебхук и сбрасываем обновления, накопившиеся пока бот спал
+            with _phase(phases, "delete_webhook"):
+                await bot.delete_webhook(drop_pending_updates=True)
+
+            # Запускаем поллинг (long-polling)
+            await dp.start_polling(bot)
         
     except Exception as e:
-        logger.error(f"Критическая ошибка в работе бота: {e}")
+        logger.critical(f"Критическая ошибка в работе бота: {e}")
+        # Ненулевой код выхода: лаунчер перезапускает упавший процесс
+        raise
     finally:
         # Гарантированно закрываем сессию при выходе
         await bot.session.close()
@@ -0,0 +1,257 @@
+import bisect
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from aiohttp import web
+
+from .config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Минимальная реализация метрик в текстовом формате Prometheus без сторонних
+# зависимостей. Запись — словарь и счетчик под локом (единицы микросекунд),
+# поэтому метрики можно писать из хендлеров и потоков воркеров
+
+LabelValues = Tuple[str, ...]
+M = TypeVar("M", bound="_Metric")
+
+# Границы корзин по умолчанию (секунды): от быстрых запросов к API до минут видео
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Растущее значение: увеличивается `inc` или читается функцией (`read`) в момент запроса."""
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        read: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._read = read
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        if self._read is not None:
+            return [f"{self.name} {self._read()}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Значение задается явно (`set`) или читается функцией в момент запроса метрик."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        read: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._read = read
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        if self._read is not None:
+            return [f"{self.name} {self._read()}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (счетчики по корзинам без накопления, сумма, количество)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Замеряет блок кода (в том числе с await внутри)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labels, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: M) -> M:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _rss_bytes() -> float:
+    """Текущий RSS процесса: /proc на Linux, иначе пиковый RSS из getrusage (0 на Windows)."""
+    with contextlib.suppress(OSError, ValueError):
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS отдает байты, Linux — килобайты
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Singleton instance
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "bot_stage_seconds", "Длительность этапа задачи", ("tool", "stage"),
+))
+JOBS_TOTAL = registry.register(Counter(
+    "bot_jobs_total", "Завершенные задачи по результату", ("tool", "result"),
+))
+ERRORS_TOTAL = registry.register(Counter(
+    "bot_errors_total", "Ошибки обработки по типу исключения", ("tool", "error"),
+))
+MODEL_LOAD_SECONDS = registry.register(Histogram(
+    "bot_model_load_seconds", "Загрузка модели апскейла", ("model",), buckets=(0.5, 1, 2, 5, 10, 30, 60),
+))
+ENCODE_SECONDS = registry.register(Histogram(
+    "bot_encode_seconds", "Кодирование результата апскейла", ("format",),
+))
+UPDATES_TOTAL = registry.register(Counter(
+    "bot_updates_total", "Входящие обновления по типу", ("type",),
+))
+JOBS_IN_FLIGHT = registry.register(Gauge(
+    "bot_jobs_in_flight", "Задачи в работе (от кэша до отправки результата)", ("tool",),
+))
+registry.register(Gauge("process_resident_memory_bytes", "RSS процесса", read=_rss_bytes))
+registry.register(Counter("process_cpu_seconds_total", "Процессорное время процесса (user + system)", read=time.process_time))
+
+
+def gauge(name: str, documentation: str, read: Callable[[], float]) -> None:
+    """Регистрирует метрику, значение которой читается в момент запроса (глубина очереди и т.п.)."""
+    registry.register(Gauge(name, documentation, read=read))
+
+
+async def start_metrics_server(port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """
+    Отдает /metrics на METRICS_HOST:port; при port=0 выключено. Занятый порт
+    не роняет процесс: без метрик бот и воркер работают дальше.
+    """
+    if not port:
+        return None
+
+    async def handle(_: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        logger.warning(f"Метрики не запущены: {METRICS_HOST}:{port} недоступен ({e})")
+        await runner.cleanup()
+        return None
+    logger.info(f"Метрики: http://{METRICS_HOST}:{port}/metrics")
+    return runner
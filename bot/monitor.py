@@ -1,10 +1,13 @@
+import logging
 import time
-from datetime import datetime, timedelta
-from colorama import Fore, Style, init
+from datetime import timedelta
+from colorama import Fore, init
 
 # Инициализация colorama с автосбросом цвета
 init(autoreset=True)
 
+logger = logging.getLogger(__name__)
+
 class ConsoleMonitor:
     """
     Класс для отображения статуса бота в консоли (Dashboard).
@@ -22,12 +25,13 @@ class ConsoleMonitor:
         return str(timedelta(seconds=int(elapsed)))
 
     def log_event(self, user_name: str, action: str) -> None:
-        """Обновляет состояние и выводит лог в консоль."""
+        """
+        Обновляет состояние и пишет событие в лог. Вызывается из хендлеров,
+        поэтому без print: запись уходит в очередь логов (bot/logs.py).
+        """
         self.last_user = user_name
         self.current_task = action
-        
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        print(f"[{timestamp}] {Fore.GREEN}OK{Style.RESET_ALL} | {user_name} -> {action}")
+        logger.info("%s -> %s", user_name, action, extra={"event": "monitor", "user": user_name, "action": action})
 
     def refresh_header(self) -> None:
         """
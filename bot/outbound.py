@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from typing import Dict, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import DeleteMessage, EditMessageText, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from .config import (
+    OUTBOUND_CHAT_INTERVAL_SEC,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_GROUP_INTERVAL_SEC,
+    OUTBOUND_MAX_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+ChatId = Union[int, str]
+
+# Методы, которые Telegram считает отправкой сообщений и ограничивает
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    """
+    Слой исходящих запросов к Bot API (middleware сессии aiogram).
+
+    - Ограничивает частоту отправки: общую на бота и отдельно на каждый чат.
+      Слоты выдаются резервированием времени, поэтому запросы выстраиваются
+      в очередь без блокировок и без лишних пробуждений.
+    - 429 обрабатывается здесь: все запросы бота ставятся на паузу
+      на `retry_after`, сам запрос повторяется. Хендлер ошибку не видит.
+    - Устаревшие правки схлопываются: если к сообщению, ожидающему слот,
+      пришла более новая правка (или удаление), старая не отправляется.
+    - Правки сообщения, на кнопку которого только что нажали (см. `answering`),
+      идут мимо лимита на чат: это навигация по меню в темпе пользователя.
+      Общий лимит бота и пауза по 429 действуют и на них.
+
+    Ответы, возвращенные хендлером в теле вебхука, идут мимо сессии и не учитываются.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = OUTBOUND_GLOBAL_RATE,
+        chat_interval: float = OUTBOUND_CHAT_INTERVAL_SEC,
+        group_interval: float = OUTBOUND_GROUP_INTERVAL_SEC,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+    ):
+        self.global_interval = 1 / global_rate
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+
+        self._global_next = 0.0
+        self._chat_next: Dict[ChatId, float] = {}
+        self._paused_until = 0.0
+        # (chat_id, message_id) -> номер последней поставленной правки
+        self._edits: Dict[Tuple[ChatId, int], int] = {}
+        # (chat_id, message_id) -> до какого момента правки считаются ответом на кнопку
+        self._answering: Dict[Tuple[ChatId, int], float] = {}
+
+    # Сколько секунд после нажатия кнопки правки ее сообщения считаются ответом
+    ANSWER_WINDOW_SEC = 10.0
+
+    def answering(self, chat_id: ChatId, message_id: int) -> None:
+        """Помечает сообщение, на кнопку которого нажали (вызывается из хендлеров callback)."""
+        now = asyncio.get_running_loop().time()
+        self._answering[(chat_id, message_id)] = now + self.ANSWER_WINDOW_SEC
+        if len(self._answering) > 10_000:
+            self._answering = {key: t for key, t in self._answering.items() if t > now}
+
+    def _is_answer(self, chat_id: ChatId, method: TelegramMethod) -> bool:
+        message_id = getattr(method, "message_id", None)
+        if message_id is None or not method.__api_method__.startswith("edit"):
+            return False
+        until = self._answering.get((chat_id, message_id))
+        return until is not None and until > asyncio.get_running_loop().time()
+
+    def _reserve_chat(self, chat_id: ChatId) -> float:
+        """Резервирует ближайший слот отправки в чат и возвращает, сколько до него ждать."""
+        now = asyncio.get_running_loop().time()
+        # Отрицательные id — группы и каналы, у них лимит строже
+        interval = self.group_interval if isinstance(chat_id, str) or chat_id < 0 else self.chat_interval
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + interval
+        if len(self._chat_next) > 10_000:
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        return slot - now
+
+    def _reserve_global(self) -> float:
+        """
+        Общий слот бота. Берется после слота чата: иначе запрос, ждущий
+        своей очереди в одном чате, задерживал бы отправку во все остальные.
+        """
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._paused_until, self._global_next)
+        self._global_next = slot + self.global_interval
+        return slot - now
+
+    async def _wait_pause(self) -> None:
+        loop = asyncio.get_running_loop()
+        while (delay := self._paused_until - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await self._request(make_request, bot, method)
+
+        edit_key = None
+        if isinstance(method, (EditMessageText, DeleteMessage)) and method.message_id is not None:
+            edit_key = (chat_id, method.message_id)
+            generation = self._edits[edit_key] = self._edits.get(edit_key, 0) + 1
+
+        try:
+            if method.__api_method__.startswith(_LIMITED_PREFIXES):
+                if not self._is_answer(chat_id, method):
+                    await asyncio.sleep(self._reserve_chat(chat_id))
+                await asyncio.sleep(self._reserve_global())
+                if edit_key is not None and self._edits.get(edit_key) != generation:
+                    # Пока ждали слот, сообщение снова правили или удалили
+                    return Response(ok=True, result=True)
+            return await self._request(make_request, bot, method)
+        finally:
+            if edit_key is not None and self._edits.get(edit_key) == generation:
+                del self._edits[edit_key]
+
+    async def _request(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        attempt = 0
+        while True:
+            await self._wait_pause()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                loop = asyncio.get_running_loop()
+                self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+                logger.warning(
+                    f"Flood control: {method.__api_method__} — пауза {e.retry_after} с "
+                    f"(попытка {attempt}/{self.max_retries})"
+                )
+
+
+# Singleton instance: один лимитер на процесс, общий для всех запросов бота
+flood_control = FloodControlMiddleware()
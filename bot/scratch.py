@@ -0,0 +1,98 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Iterator
+
+from .config import SCRATCH_DIR, SCRATCH_QUOTA_MB
+
+
+class ScratchQuotaError(Exception):
+    """Нет места в рабочей области: лимит уже занят другими задачами."""
+
+
+class ScratchOverrunError(Exception):
+    """Задача заняла в своем каталоге больше места, чем зарезервировала."""
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(FileNotFoundError):
+                total += os.stat(os.path.join(root, name)).st_size
+    return total
+
+
+class ScratchSpace:
+    """
+    Рабочие каталоги для задач (по одному на задачу) с общей квотой.
+
+    По умолчанию корень лежит на tmpfs (`/dev/shm`), поэтому промежуточные
+    файлы не трогают диск. Квота резервируется при входе в задачу по оценке
+    ее размера, так что параллельные задачи не могут переполнить tmpfs.
+    Резерв соблюдается при записи: этапы получают остаток (`remaining`) как
+    лимит размера выхода, а `check` между этапами страхует остальное.
+    """
+
+    def __init__(self, root: Path, quota_bytes: int):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self._reserved = 0
+        # Каталог задачи -> ее резерв
+        self._jobs: Dict[Path, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def reserved(self) -> int:
+        return self._reserved
+
+    @contextlib.contextmanager
+    def job(self, reserve_bytes: int) -> Iterator[Path]:
+        """
+        Выделяет уникальный каталог под задачу и резервирует под него место.
+        Каталог удаляется целиком при выходе, даже если задача упала.
+        """
+        with self._lock:
+            if self._reserved + reserve_bytes > self.quota_bytes:
+                raise ScratchQuotaError(
+                    f"Нужно {reserve_bytes} байт, свободно {self.quota_bytes - self._reserved}"
+                )
+            self._reserved += reserve_bytes
+
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            job_dir = Path(tempfile.mkdtemp(prefix="job_", dir=self.root))
+            self._jobs[job_dir] = reserve_bytes
+            try:
+                yield job_dir
+            finally:
+                del self._jobs[job_dir]
+                shutil.rmtree(job_dir, ignore_errors=True)
+        finally:
+            with self._lock:
+                self._reserved -= reserve_bytes
+
+    def check(self, job_dir: Path) -> int:
+        """
+        Фактический размер каталога задачи; ScratchOverrunError, если он больше резерва.
+        Обходит каталог на диске — из event loop вызывается через asyncio.to_thread.
+        """
+        used = _dir_size(job_dir)
+        reserved = self._jobs[job_dir]
+        if used > reserved:
+            raise ScratchOverrunError(f"Задача заняла {used} байт при резерве {reserved}")
+        return used
+
+    def remaining(self, job_dir: Path) -> int:
+        """Сколько еще можно записать в каталог задачи: лимит для ffmpeg -fs следующего этапа."""
+        left = self._jobs[job_dir] - self.check(job_dir)
+        if left <= 0:
+            raise ScratchOverrunError(f"Резерв задачи исчерпан ({self._jobs[job_dir]} байт)")
+        return left
+
+
+# Singleton instance
+scratch = ScratchSpace(SCRATCH_DIR, SCRATCH_QUOTA_MB * 1024 * 1024)
@@ -0,0 +1,434 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import time
+from pathlib import Path
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, FSInputFile, Message
+
+from bot.ai.encoding import detect_extension
+from bot.ai.models import MODELS
+from bot.ai.process_pool import ProcessUpscaleService
+from bot.ai.scheduler import QueueFullError, UpscaleScheduler
+from bot.ai.video_upscale import upscale_video
+from bot.cache import ResultCache, result_cache
+from bot.scratch import ScratchOverrunError, ScratchQuotaError, scratch
+from bot.video import OutputTooLargeError, convert_video
+from .config import (
+    ADMIN_ID,
+    MAX_VIDEO_DURATION_SEC,
+    PROCESSING_MODE,
+    TELEGRAM_UPLOAD_LIMIT_MB,
+    UPSCALE_BACKEND,
+    UPSCALE_BATCH_SIZE,
+    UPSCALE_EXECUTION,
+    UPSCALE_JPEG_QUALITY,
+    UPSCALE_MAX_OUTPUT_MP,
+    UPSCALE_MODELS,
+    UPSCALE_OUTPUT_FORMAT,
+    UPSCALE_PNG_COMPRESSION,
+    UPSCALE_QUEUE_SIZE,
+    UPSCALE_SHARED_MODEL,
+    UPSCALE_TORCH_THREADS,
+    UPSCALE_VIDEO_MAX_SIDE,
+    UPSCALE_VIDEO_MODEL,
+    UPSCALE_WEBP_QUALITY,
+    UPSCALE_WORKERS,
+    VIDEO_ENGINE,
+    VIDEO_NOTE_SIZE,
+)
+from .database import log_action
+from .jobs import MediaJob
+from .keyboards import main_menu
+from .metrics import ERRORS_TOTAL, JOBS_IN_FLIGHT, JOBS_TOTAL, STAGE_SECONDS, gauge
+from .tracing import profiler, record, span, tracer
+
+logger = logging.getLogger(__name__)
+
+# Исполнители задач обработки медиа. Работают только с `Bot` и `MediaJob`,
+# поэтому одинаково запускаются в процессе бота (PROCESSING_MODE=inline)
+# и в отдельном процессе-воркере (bot/worker.py)
+
+
+def _create_upscale_service() -> Any:
+    """Фабрика модели для воркера планировщика (в потоке или в отдельном процессе)."""
+    if UPSCALE_EXECUTION == "process":
+        return ProcessUpscaleService(num_threads=UPSCALE_TORCH_THREADS, batch_size=1)
+    # torch импортируется здесь, в фоновом потоке воркера, а не при старте бота
+    from bot.ai.upscale import ModelPool
+
+    return ModelPool(num_threads=UPSCALE_TORCH_THREADS)
+
+
+# Синглтон планировщика: модели загружаются воркерами в фоне после start().
+# В батч-режиме модель одна, и воркеры параллельно кормят ее общий батчер
+UPSCALE_SCHEDULER = UpscaleScheduler(
+    _create_upscale_service,
+    workers=UPSCALE_WORKERS,
+    max_queue=UPSCALE_QUEUE_SIZE,
+    shared_model=UPSCALE_SHARED_MODEL or UPSCALE_BATCH_SIZE > 1,
+    serialize_shared=UPSCALE_BATCH_SIZE == 1,
+    # Задачи админа — вне очереди
+    priority_users={ADMIN_ID},
+)
+gauge("bot_upscale_queue_depth", "Задачи, ожидающие воркер апскейла", lambda: UPSCALE_SCHEDULER.queue_size)
+gauge("bot_upscale_in_flight", "Задачи апскейла в работе", lambda: UPSCALE_SCHEDULER.in_flight)
+
+BUSY_TEXT = "⚠️ Сейчас слишком много запросов. Попробуй через пару минут."
+
+
+# =============================================================================
+# Общие шаги: статус, кэш
+# =============================================================================
+
+async def _show_status(bot: Bot, job: MediaJob, text: str) -> None:
+    """Показывает статус задачи: правит сообщение-статус или создает его."""
+    if job.status_message_id is None:
+        status_msg = await bot.send_message(job.chat_id, text)
+        job.status_message_id = status_msg.message_id
+        return
+    with contextlib.suppress(Exception):
+        await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.status_message_id)
+
+
+async def _clear_status(bot: Bot, job: MediaJob) -> None:
+    if job.status_message_id is not None:
+        with contextlib.suppress(Exception):
+            await bot.delete_message(job.chat_id, job.status_message_id)
+
+
+async def _reply(bot: Bot, job: MediaJob, text: str) -> None:
+    """
+    Итоговый текст с меню. Статус превращается в ответ правкой:
+    один запрос к API вместо удаления статуса и нового сообщения.
+    """
+    if job.status_message_id is not None:
+        try:
+            await bot.edit_message_text(
+                text, chat_id=job.chat_id, message_id=job.status_message_id, reply_markup=main_menu()
+            )
+            job.status_message_id = None
+            return
+        except Exception:
+            pass
+    await bot.send_message(job.chat_id, text, reply_markup=main_menu())
+
+
+async def _show_queue_position(bot: Bot, job: MediaJob, working_text: str, position: int) -> None:
+    """Показывает пользователю его место в очереди апскейла."""
+    if position <= 0:
+        text = working_text
+    elif UPSCALE_SCHEDULER.user_busy(job.user_id):
+        # Справедливая очередь: вторая задача ждет, пока не закончится первая
+        text = f"⏳ Сначала закончу вашу предыдущую задачу. В очереди: {position}."
+    else:
+        text = f"⏳ Вы в очереди: {position}. Подождите немного..."
+    await _show_status(bot, job, text)
+
+
+def cache_key(job: MediaJob) -> str:
+    """Ключ кэша результата: файл + все параметры, влияющие на результат."""
+    if job.kind == "video_note":
+        params = {"max_duration": MAX_VIDEO_DURATION_SEC, "size": VIDEO_NOTE_SIZE}
+    elif job.kind == "ai_upscale":
+        params = {
+            "models": UPSCALE_MODELS,
+            "backend": UPSCALE_BACKEND,
+            "max_output_mp": UPSCALE_MAX_OUTPUT_MP,
+            "format": UPSCALE_OUTPUT_FORMAT,
+            "png_compression": UPSCALE_PNG_COMPRESSION,
+            "webp_quality": UPSCALE_WEBP_QUALITY,
+            "jpeg_quality": UPSCALE_JPEG_QUALITY,
+        }
+    else:
+        params = {
+            "model": UPSCALE_VIDEO_MODEL,
+            "backend": UPSCALE_BACKEND,
+            "max_side": UPSCALE_VIDEO_MAX_SIDE,
+            "max_duration": MAX_VIDEO_DURATION_SEC,
+        }
+    return ResultCache.make_key(job.file_unique_id, job.kind, **params)
+
+
+def _sender(bot: Bot, job: MediaJob) -> Callable[..., Awaitable[Message]]:
+    # Меню прикрепляется к самому результату, отдельное «Готово» не отправляется
+    if job.kind == "video_note":
+        return functools.partial(bot.send_video_note, job.chat_id, reply_markup=main_menu())
+    if job.kind == "ai_upscale":
+        # Масштаб (×4 или ×2) подбирается по размеру изображения
+        return functools.partial(
+            bot.send_document, job.chat_id, caption="✅ Качество улучшено", reply_markup=main_menu()
+        )
+    return functools.partial(bot.send_video, job.chat_id, supports_streaming=True, reply_markup=main_menu())
+
+
+def _sent_file_id(sent: Message) -> str:
+    return (sent.video_note or sent.document or sent.video).file_id
+
+
+_ACTIONS = {"video_note": "conversion", "ai_upscale": "ai_upscale", "video_upscale": "video_upscale"}
+
+
+def _finish(job: MediaJob, result: str = "ok") -> None:
+    log_action(job.user_id, _ACTIONS[job.kind])
+    JOBS_TOTAL.inc(tool=job.kind, result=result)
+
+
+def _failed(job: MediaJob, error: BaseException) -> None:
+    ERRORS_TOTAL.inc(tool=job.kind, error=type(error).__name__)
+    JOBS_TOTAL.inc(tool=job.kind, result="error")
+
+
+async def report_failure(bot: Bot, job: MediaJob) -> None:
+    """Сообщает о задаче, которую не удалось выполнить вне исполнителя (упал воркер, исчерпаны попытки)."""
+    JOBS_TOTAL.inc(tool=job.kind, result="error")
+    try:
+        await _reply(bot, job, "❌ Не удалось обработать файл. Попробуй отправить его еще раз.")
+    except Exception as e:
+        logger.warning(f"Не удалось сообщить user {job.user_id} об ошибке задачи: {e}")
+
+
+async def _busy(bot: Bot, job: MediaJob) -> None:
+    JOBS_TOTAL.inc(tool=job.kind, result="busy")
+    await _reply(bot, job, BUSY_TEXT)
+
+
+async def send_cached_result(bot: Bot, job: MediaJob) -> bool:
+    """Отправляет готовый результат из кэша, если он есть. True — задача уже выполнена."""
+    started = time.perf_counter()
+    if not await result_cache.send(cache_key(job), _sender(bot, job), _sent_file_id):
+        return False
+    elapsed = time.perf_counter() - started
+    STAGE_SECONDS.observe(elapsed, tool=job.kind, stage="cached")
+    record("cached", started, elapsed)
+    _finish(job, result="cached")
+    return True
+
+
+@contextlib.asynccontextmanager
+async def _stage(job: MediaJob, stage: str, job_dir: Optional[Path] = None) -> AsyncIterator[None]:
+    """
+    Этап задачи: гистограмма метрик и спан трассы. С `job_dir` после этапа
+    фактический размер каталога сверяется с резервом задачи (обход диска — в потоке).
+    """
+    with STAGE_SECONDS.time(tool=job.kind, stage=stage), span(stage):
+        yield
+    if job_dir is not None:
+        await asyncio.to_thread(scratch.check, job_dir)
+
+
+async def _overrun(bot: Bot, job: MediaJob, error: Exception) -> None:
+    """Задача вышла за свой резерв в рабочей области и отклонена."""
+    logger.warning(f"Задача user {job.user_id} ({job.kind}) отклонена: {error}")
+    JOBS_TOTAL.inc(tool=job.kind, result="too_large")
+    await _reply(bot, job, "❌ Файл получился слишком большим для обработки.")
+
+
+def _profiled(fn: Callable[..., Any], *args: Any) -> Any:
+    """Выполняется в рабочем потоке: там же включается профилировщик, если задача выбрана."""
+    with profiler.capture():
+        return fn(*args)
+
+
+async def _submit(job: MediaJob, task: Callable[[Any], Any], working_text: str, bot: Bot) -> Any:
+    """Задача в планировщик апскейла; ожидание в очереди и работа замеряются отдельно."""
+    started = time.perf_counter()
+    worked: List[float] = []
+    # Пул планировщика не копирует contextvars сам — переносим трассу в поток явно
+    context = contextvars.copy_context()
+
+    def timed(service: Any) -> Any:
+        begin = time.perf_counter()
+        try:
+            return context.run(_traced_process, task, service, started, begin)
+        finally:
+            worked.append(time.perf_counter() - begin)
+
+    try:
+        return await UPSCALE_SCHEDULER.submit(
+            job.user_id,
+            timed,
+            on_position=functools.partial(_show_queue_position, bot, job, working_text),
+        )
+    finally:
+        if worked:
+            STAGE_SECONDS.observe(time.perf_counter() - started - worked[0], tool=job.kind, stage="queue")
+            STAGE_SECONDS.observe(worked[0], tool=job.kind, stage="process")
+
+
+def _traced_process(task: Callable[[Any], Any], service: Any, queued: float, begin: float) -> Any:
+    record("queue", queued, begin - queued)
+    with span("process"):
+        return _profiled(task, service)
+
+
+# =============================================================================
+# Исполнители
+# =============================================================================
+
+async def run_video_note(bot: Bot, job: MediaJob) -> None:
+    """Video2Round: скачивание, конвертация в кружок, отправка."""
+    await _show_status(bot, job, "⏳ Скачиваю и обрабатываю...")
+    try:
+        # Отдельный каталог на tmpfs под задачу: имена файлов не пересекаются,
+        # место резервируется заранее (вход + выход с запасом). Сегментный
+        # движок держит рядом еще нарезку и закодированные части — до размера входа
+        factor = 3 if VIDEO_ENGINE == "segmented" else 2
+        with scratch.job(reserve_bytes=job.file_size * factor) as job_dir:
+            input_path = job_dir / "input.mp4"
+            output_path = job_dir / "output.mp4"
+
+            async with _stage(job, "download", job_dir):
+                await bot.download(job.file_id, destination=input_path)
+
+            # Запускаем тяжелую задачу в пуле потоков, чтобы не блокировать asyncio.
+            # Выход ограничен остатком резерва прямо при записи (ffmpeg -fs); сегментному
+            # движку — половиной: закодированные части лежат рядом с результатом
+            async with _stage(job, "process", job_dir):
+                limit = await asyncio.to_thread(scratch.remaining, job_dir)
+                if VIDEO_ENGINE == "segmented":
+                    limit //= 2
+                await asyncio.to_thread(_profiled, convert_video, str(input_path), str(output_path), limit)
+
+            async with _stage(job, "upload"):
+                sent = await _sender(bot, job)(FSInputFile(output_path))
+            await result_cache.store(cache_key(job), sent.video_note.file_id, output_path)
+            _finish(job)
+
+    except ScratchQuotaError:
+        JOBS_TOTAL.inc(tool=job.kind, result="busy")
+        await _reply(bot, job, "⚠️ Сейчас обрабатывается слишком много видео. Попробуй через пару минут.")
+    except (ScratchOverrunError, OutputTooLargeError) as e:
+        await _overrun(bot, job, e)
+    except Exception as e:
+        logger.error(f"Ошибка обработки видео для user {job.user_id}: {e}", exc_info=True)
+        _failed(job, e)
+        await _reply(bot, job, "❌ Ошибка при обработке видео.")
+    finally:
+        await _clear_status(bot, job)
+
+
+async def run_ai_upscale(bot: Bot, job: MediaJob) -> None:
+    """AI Upscale изображения целиком в памяти."""
+    # Backpressure: не скачиваем файл, если очередь все равно его не примет
+    if UPSCALE_SCHEDULER.is_full:
+        await _busy(bot, job)
+        return
+
+    working_text = "⏳ Улучшаю изображение..."
+    await _show_status(bot, job, working_text)
+    try:
+        # Весь путь в памяти: скачивание в буфер, декодирование, кодирование, отправка
+        async with _stage(job, "download"):
+            buffer = await bot.download(job.file_id)
+        data = buffer.getvalue()
+
+        # Инференс и кодирование выполняются воркером планировщика, а не в общем пуле потоков
+        result = await _submit(job, lambda service: service.upscale_bytes(data), working_text, bot)
+
+        # Формат выбирает кодировщик (PNG, а для крупных результатов WebP/JPEG)
+        ext = detect_extension(result)
+        filename = f"{Path(job.file_name or 'image').stem}_upscaled{ext}"
+        async with _stage(job, "upload"):
+            sent = await _sender(bot, job)(BufferedInputFile(result, filename=filename))
+        await result_cache.store(cache_key(job), sent.document.file_id, result, suffix=ext)
+        _finish(job)
+
+    except QueueFullError:
+        await _busy(bot, job)
+    except Exception as e:
+        logger.error(f"Ошибка Upscale для user {job.user_id}: {e}", exc_info=True)
+        _failed(job, e)
+        await _reply(bot, job, "❌ Ошибка при обработке изображения.")
+    finally:
+        await _clear_status(bot, job)
+
+
+async def run_video_upscale(bot: Bot, job: MediaJob) -> None:
+    """Потоковый AI upscale видео: кадры идут пачками через модель прямо в кодировщик."""
+    if UPSCALE_SCHEDULER.is_full:
+        await _busy(bot, job)
+        return
+
+    working_text = "⏳ Улучшаю видео, это может занять несколько минут..."
+    await _show_status(bot, job, working_text)
+    try:
+        # Вход и выход (до лимита загрузки Telegram) живут в рабочем каталоге задачи
+        reserve = job.file_size + TELEGRAM_UPLOAD_LIMIT_MB * 1024 * 1024
+        with scratch.job(reserve_bytes=reserve) as job_dir:
+            input_path = job_dir / "input.mp4"
+            output_path = job_dir / "output.mp4"
+
+            async with _stage(job, "download", job_dir):
+                await bot.download(job.file_id, destination=input_path)
+
+            # Кодировщик не пишет больше лимита загрузки: резерв выше не превышается
+            stats = await _submit(
+                job,
+                lambda service: upscale_video(
+                    service, input_path, output_path, max_output_bytes=TELEGRAM_UPLOAD_LIMIT_MB * 1024 * 1024
+                ),
+                working_text,
+                bot,
+            )
+            await asyncio.to_thread(scratch.check, job_dir)
+
+            async with _stage(job, "upload"):
+                sent = await _sender(bot, job)(
+                    FSInputFile(output_path),
+                    caption=f"✅ Видео улучшено ×{MODELS[UPSCALE_VIDEO_MODEL].scale} ({stats.fps:.1f} кадр/с)",
+                )
+            await result_cache.store(cache_key(job), sent.video.file_id, output_path)
+            _finish(job)
+
+    except (QueueFullError, ScratchQuotaError):
+        await _busy(bot, job)
+    except OutputTooLargeError:
+        JOBS_TOTAL.inc(tool=job.kind, result="too_large")
+        await _reply(bot, job, "❌ Результат больше лимита Telegram. Попробуй видео покороче.")
+    except ScratchOverrunError as e:
+        await _overrun(bot, job, e)
+    except Exception as e:
+        logger.error(f"Ошибка видео-апскейла для user {job.user_id}: {e}", exc_info=True)
+        _failed(job, e)
+        await _reply(bot, job, "❌ Ошибка при обработке видео.")
+    finally:
+        await _clear_status(bot, job)
+
+
+TASKS: Dict[str, Callable[[Bot, MediaJob], Awaitable[None]]] = {
+    "video_note": run_video_note,
+    "ai_upscale": run_ai_upscale,
+    "video_upscale": run_video_upscale,
+}
+
+
+async def run_job(bot: Bot, job: MediaJob) -> None:
+    """
+    Выполняет задачу. В режиме inline одинаковые файлы обрабатываются один раз:
+    остальные ждут на блокировке ключа и получают результат из кэша. Блокировка
+    в памяти процесса, воркерам очереди она не помогает — там ее не берем.
+    """
+    key = cache_key(job)
+    JOBS_IN_FLIGHT.inc(tool=job.kind)
+    try:
+        with tracer.trace(job.kind, user_id=job.user_id, file_size=job.file_size) as trace:
+            if PROCESSING_MODE == "queue":
+                coalesce: AsyncContextManager[None] = contextlib.nullcontext()
+            else:
+                coalesce = result_cache.lock(key)
+                if result_cache.busy(key):
+                    await _show_status(bot, job, "⏳ Такой же файл уже обрабатывается, жду результат...")
+            async with coalesce:
+                if await send_cached_result(bot, job):
+                    await _clear_status(bot, job)
+                    return
+                # Профиль достается только задаче, которая действительно выполняется
+                trace.profile = profiler.take()
+                await TASKS[job.kind](bot, job)
+    finally:
+        JOBS_IN_FLIGHT.dec(tool=job.kind)
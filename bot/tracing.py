@@ -0,0 +1,227 @@
+import contextlib
+import contextvars
+import cProfile
+import itertools
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from .config import (
+    PROFILE_DIR,
+    PROFILE_KIND,
+    PROFILE_SLOW_JOBS,
+    TRACE_MAX_MB,
+    TRACE_PATH,
+    TRACE_SLOW_JOB_SEC,
+)
+from .logs import queued_handler
+
+logger = logging.getLogger(__name__)
+
+# Не даем одной длинной задаче (видео из сотен пачек) раздуть трассу
+MAX_SPANS = 2000
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    name: str
+    attrs: Dict[str, Any]
+    started: float = field(default_factory=time.perf_counter)
+    spans: List[Dict[str, Any]] = field(default_factory=list)
+    dropped: int = 0
+    # "cprofile" / "torch", если для задачи включено профилирование
+    profile: Optional[str] = None
+
+    def add(self, name: str, start: float, duration: float, attrs: Dict[str, Any]) -> None:
+        # list.append атомарен: спаны пишут и event loop, и потоки воркеров
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        span = {
+            "name": name,
+            "start_ms": round((start - self.started) * 1000, 3),
+            "ms": round(duration * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        if attrs:
+            span.update(attrs)
+        self.spans.append(span)
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs: Any) -> Iterator[None]:
+    """
+    Спан внутри текущей трассы. Вне трассы (прогрев, бенчмарки) почти
+    ничего не стоит. В потоки контекст переходит сам через asyncio.to_thread,
+    а в свой пул — через `contextvars.copy_context().run(...)`.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter() - started, attrs)
+
+
+def record(name: str, started: float, duration: float, **attrs: Any) -> None:
+    """Спан, замеренный снаружи (например, ожидание в очереди)."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, started, duration, attrs)
+
+
+class Profiler:
+    """
+    Профилирование следующих N задач: cProfile или torch.profiler.
+    Включается командой админа или автоматически после медленной задачи.
+    Профиль пишется в PROFILE_DIR и открывается офлайн
+    (snakeviz / pstats для .prof, chrome://tracing или Perfetto для .json).
+    """
+
+    def __init__(self, directory: Path = PROFILE_DIR):
+        self.directory = directory
+        self._remaining = 0
+        self._kind = PROFILE_KIND
+        self._lock = threading.Lock()
+
+    @property
+    def armed(self) -> int:
+        return self._remaining
+
+    def arm(self, jobs: int, kind: str = PROFILE_KIND) -> None:
+        if kind not in ("cprofile", "torch"):
+            raise ValueError(f"Неизвестный профилировщик: {kind}")
+        with self._lock:
+            self._remaining = jobs
+            self._kind = kind
+        logger.info(f"Профилирование ({kind}) включено для следующих задач: {jobs}")
+
+    def take(self) -> Optional[str]:
+        """Забирает одну «профилируемую» задачу, если профилирование включено."""
+        with self._lock:
+            if self._remaining <= 0:
+                return None
+            self._remaining -= 1
+            return self._kind
+
+    @contextlib.contextmanager
+    def capture(self) -> Iterator[None]:
+        """
+        Профилирует блок, если его задача выбрана для профилирования.
+        Вызывается в потоке, где идет работа: cProfile видит только свой поток.
+        """
+        trace = _current.get()
+        if trace is None or trace.profile is None:
+            yield
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{time.strftime('%Y%m%d-%H%M%S')}_{trace.name}_{trace.trace_id}"
+        if trace.profile == "torch":
+            import torch.profiler
+
+            with torch.profiler.profile(record_shapes=True) as prof:
+                yield
+            path = path.with_suffix(".json")
+            prof.export_chrome_trace(str(path))
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                path = path.with_suffix(".prof")
+                profile.dump_stats(path)
+        logger.info(f"Профиль задачи {trace.trace_id} сохранен: {path}")
+
+
+class Tracer:
+    """
+    Трассы задач обработки: по одной JSON-строке на задачу в ротируемом файле
+    TRACE_PATH. Запись и ротацию файла выполняет фоновый поток (как у логов),
+    event loop только ставит запись в очередь. Задача дольше TRACE_SLOW_JOB_SEC
+    включает профилирование следующих PROFILE_SLOW_JOBS задач (профиль забирает
+    исполнитель, когда задача действительно выполняется, а не отдается из кэша).
+    """
+
+    def __init__(self, path: Path = TRACE_PATH, max_mb: int = TRACE_MAX_MB):
+        self._ids = itertools.count(1)
+        self._prefix = f"{int(time.time()):x}"
+        self._log = logging.getLogger("bot.trace.file")
+        self._log.propagate = False
+        self._log.setLevel(logging.INFO)
+        self._path = path
+        self._max_bytes = max_mb * 1024 * 1024
+
+    def _ensure_handler(self) -> None:
+        # Файл открывается при первой трассе, а не при импорте
+        if not self._log.handlers:
+            handler = RotatingFileHandler(
+                self._path, maxBytes=self._max_bytes, backupCount=3, encoding="utf-8", delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._log.addHandler(queued_handler(handler))
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **attrs: Any) -> Iterator[Trace]:
+        trace = Trace(trace_id=f"{self._prefix}-{next(self._ids)}", name=name, attrs=attrs)
+        token = _current.set(trace)
+        error: Optional[str] = None
+        try:
+            yield trace
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(trace, time.perf_counter() - trace.started, error)
+
+    def _finish(self, trace: Trace, duration: float, error: Optional[str]) -> None:
+        record = {
+            "trace_id": trace.trace_id,
+            "name": trace.name,
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "ms": round(duration * 1000, 3),
+            **trace.attrs,
+            "spans": trace.spans,
+        }
+        if trace.dropped:
+            record["dropped_spans"] = trace.dropped
+        if trace.profile:
+            record["profiled"] = trace.profile
+        if error:
+            record["error"] = error
+        try:
+            self._ensure_handler()
+            self._log.info(json.dumps(record, ensure_ascii=False, default=str))
+        except OSError as e:
+            logger.warning(f"Не удалось записать трассу: {e}")
+
+        if TRACE_SLOW_JOB_SEC and duration > TRACE_SLOW_JOB_SEC and not trace.profile and not profiler.armed:
+            logger.warning(
+                f"Медленная задача {trace.name} ({trace.trace_id}): {duration:.1f} с, "
+                f"профилирую следующие {PROFILE_SLOW_JOBS}"
+            )
+            profiler.arm(PROFILE_SLOW_JOBS)
+
+
+# Singleton instances
+profiler = Profiler()
+tracer = Tracer()
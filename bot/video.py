@@ -0,0 +1,307 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .config import (
+    FFMPEG_BINARY,
+    MAX_VIDEO_DURATION_SEC,
+    VIDEO_ENGINE,
+    VIDEO_NOTE_SIZE,
+    VIDEO_SEGMENT_MIN_SEC,
+    VIDEO_SEGMENTS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class VideoConversionError(Exception):
+    """ffmpeg завершился с ошибкой."""
+
+
+class OutputTooLargeError(VideoConversionError):
+    """Результат достиг лимита размера; кодирование прервано."""
+
+
+def _size_limit(max_output_bytes: int) -> List[str]:
+    """Аргументы ffmpeg, ограничивающие размер выходного файла (0 — без лимита)."""
+    return ["-fs", str(max_output_bytes)] if max_output_bytes else []
+
+
+def _check_size(path: str, max_output_bytes: int) -> None:
+    # -fs останавливает запись, только когда лимит уже достигнут: файл обрезан
+    if max_output_bytes and os.path.exists(path) and os.path.getsize(path) >= max_output_bytes:
+        raise OutputTooLargeError(f"{Path(path).name} достиг лимита {max_output_bytes} байт")
+
+
+# =============================================================================
+# Движок MoviePy (кадры проходят через Python/NumPy)
+# =============================================================================
+
+def convert_moviepy(input_path: str, output_path: str, max_output_bytes: int = 0) -> None:
+    """
+    CPU-зависимая логика обработки видео (MoviePy).
+    Должна запускаться в отдельном потоке/экзекьюторе, чтобы не блокировать event loop.
+    `max_output_bytes` у всех движков ограничивает выход во время записи (ffmpeg -fs);
+    достигнутый лимит — OutputTooLargeError.
+    """
+    # MoviePy тянет imageio/numpy-плагины — импортируем только если движок реально выбран.
+    # Совместимость с MoviePy v2.0+
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    import moviepy.video.fx.all as vfx
+
+    with VideoFileClip(input_path) as clip:
+        # Обрезаем длительность
+        if clip.duration > MAX_VIDEO_DURATION_SEC:
+            clip = clip.subclip(0, MAX_VIDEO_DURATION_SEC)
+
+        # Кропаем в квадрат и меняем размер
+        w, h = clip.size
+        side = min(w, h)
+
+        # Синтаксис MoviePy 2.0+ (через vfx)
+        clip = vfx.crop(clip, x_center=w / 2, y_center=h / 2, width=side, height=side)
+        clip = vfx.resize(clip, height=VIDEO_NOTE_SIZE)
+
+        clip.write_videofile(
+            output_path,
+            codec="libx264",
+            audio_codec="aac",
+            # По умолчанию MoviePy кладет временный звук в текущую папку
+            temp_audiofile=str(Path(output_path).with_suffix(".m4a")),
+            logger=None,
+            preset="fast",  # Оптимизация скорости
+            ffmpeg_params=_size_limit(max_output_bytes),
+        )
+    _check_size(output_path, max_output_bytes)
+
+
+# =============================================================================
+# Движок ffmpeg (один проход, кадры не покидают ffmpeg)
+# =============================================================================
+
+def ffmpeg_exe() -> str:
+    """Путь к ffmpeg: из конфига, из PATH или бинарник imageio-ffmpeg (ставится с MoviePy)."""
+    if FFMPEG_BINARY:
+        return FFMPEG_BINARY
+    system_ffmpeg = shutil.which("ffmpeg")
+    if system_ffmpeg:
+        return system_ffmpeg
+    import imageio_ffmpeg
+
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def run_ffmpeg(args: List[str]) -> None:
+    """Запускает ffmpeg с переданными аргументами и поднимает ошибку с хвостом stderr."""
+    cmd = [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-nostdin", "-y", *args]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        stderr = result.stderr.decode(errors="replace").strip()
+        raise VideoConversionError(f"ffmpeg вернул {result.returncode}: {stderr[-500:]}")
+
+
+@dataclass
+class MediaInfo:
+    duration: float
+    audio_codec: Optional[str]
+    # Размер кадра с учетом поворота (как его отдаст декодер ffmpeg) и частота кадров
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+
+
+def probe(input_path: str) -> MediaInfo:
+    """
+    Длительность и аудиокодек по выводу `ffmpeg -i` (ffprobe в imageio-ffmpeg нет).
+    audio_codec = None, если звука нет.
+    """
+    result = subprocess.run(
+        [ffmpeg_exe(), "-hide_banner", "-nostdin", "-i", input_path],
+        capture_output=True,
+    )
+    output = result.stderr.decode(errors="replace")
+
+    duration = 0.0
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", output)
+    if match:
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    audio = re.search(r"Audio: (\w+)", output)
+    info = MediaInfo(duration=duration, audio_codec=audio.group(1) if audio else None)
+
+    video = re.search(r"Video: .*?, (\d{2,5})x(\d{2,5})", output)
+    if video:
+        info.width, info.height = int(video.group(1)), int(video.group(2))
+        # Телефонные видео часто сняты "боком" и повернуты метаданными
+        rotation = re.search(r"rotat\w*\s*(?::|of)\s*(-?\d+)", output)
+        if rotation and abs(int(rotation.group(1))) % 180 == 90:
+            info.width, info.height = info.height, info.width
+    fps = re.search(r"(\d+(?:\.\d+)?) fps", output)
+    if fps:
+        info.fps = float(fps.group(1))
+    return info
+
+
+def square_filter(size: int = VIDEO_NOTE_SIZE) -> str:
+    """Фильтр-граф: центральный квадратный кроп и масштаб до размера кружка."""
+    return f"crop=w='min(iw,ih)':h='min(iw,ih)',scale={size}:{size},setsar=1"
+
+
+def convert_ffmpeg(input_path: str, output_path: str, max_output_bytes: int = 0) -> None:
+    """
+    Обрезка до MAX_VIDEO_DURATION_SEC, кроп, масштаб и кодирование одним
+    процессом ffmpeg. Звук AAC копируется без перекодирования, остальное — в AAC.
+    """
+    audio_codec = "copy" if probe(input_path).audio_codec == "aac" else "aac"
+    run_ffmpeg([
+        "-t", str(MAX_VIDEO_DURATION_SEC),
+        "-i", input_path,
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        "-vf", square_filter(),
+        "-c:v", "libx264",
+        "-preset", "fast",
+        "-pix_fmt", "yuv420p",
+        "-c:a", audio_codec,
+        "-movflags", "+faststart",
+        *_size_limit(max_output_bytes),
+        output_path,
+    ])
+    _check_size(output_path, max_output_bytes)
+
+
+# =============================================================================
+# Движок ffmpeg с параллельным кодированием сегментов
+# =============================================================================
+
+def _segment_count() -> int:
+    return VIDEO_SEGMENTS or (os.cpu_count() or 1)
+
+
+def convert_segmented(input_path: str, output_path: str, max_output_bytes: int = 0) -> None:
+    """
+    Параллельное кодирование: обрезанный вход режется по ключевым кадрам
+    (без перекодирования) на N сегментов, каждый кодируется своим процессом
+    ffmpeg с тем же фильтр-графом, затем части склеиваются без потерь
+    (concat demuxer, stream copy), а звук подмешивается одной дорожкой.
+    Короткие клипы и одно ядро — обычный однопроходный движок.
+    С `max_output_bytes` каждая часть ограничена своей долей лимита,
+    так что закодированные части вместе тоже в него укладываются.
+    """
+    info = probe(input_path)
+    duration = min(info.duration, MAX_VIDEO_DURATION_SEC)
+    segments = min(_segment_count(), int(duration // VIDEO_SEGMENT_MIN_SEC))
+    if segments < 2:
+        convert_ffmpeg(input_path, output_path, max_output_bytes)
+        return
+
+    work_dir = Path(tempfile.mkdtemp(prefix="segments_", dir=Path(output_path).parent))
+    try:
+        # 1. Нарезка по ключевым кадрам: границы совпадают с GOP, кадры не теряются
+        run_ffmpeg([
+            "-t", str(MAX_VIDEO_DURATION_SEC),
+            "-i", input_path,
+            "-map", "0:v:0",
+            "-c", "copy",
+            "-f", "segment",
+            "-segment_time", f"{duration / segments:.3f}",
+            "-reset_timestamps", "1",
+            str(work_dir / "part_%03d.mp4"),
+        ])
+        parts = sorted(work_dir.glob("part_*.mp4"))
+
+        # 2. Параллельное кодирование: каждому процессу ffmpeg своя доля ядер
+        threads = max(1, (os.cpu_count() or 1) // len(parts))
+        part_limit = max_output_bytes // len(parts)
+
+        # Исходная часть удаляется сразу после кодирования, чтобы нарезка
+        # и закодированные части вместе не занимали больше размера входа
+        def encode(part: Path) -> Path:
+            encoded = part.with_name(f"enc_{part.name}")
+            run_ffmpeg([
+                "-i", str(part),
+                "-vf", square_filter(),
+                "-c:v", "libx264",
+                "-preset", "fast",
+                "-pix_fmt", "yuv420p",
+                "-threads", str(threads),
+                *_size_limit(part_limit),
+                str(encoded),
+            ])
+            part.unlink()
+            _check_size(str(encoded), part_limit)
+            return encoded
+
+        with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+            encoded_parts = list(pool.map(encode, parts))
+
+        # 3. Склейка без перекодирования и звук из исходника одной дорожкой
+        concat_list = work_dir / "parts.txt"
+        concat_list.write_text(
+            "".join(f"file '{part.as_posix()}'\n" for part in encoded_parts),
+            encoding="utf-8",
+        )
+        audio_codec = "copy" if info.audio_codec == "aac" else "aac"
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", str(concat_list),
+            "-t", str(MAX_VIDEO_DURATION_SEC), "-i", input_path,
+            "-map", "0:v:0",
+            "-map", "1:a:0?",
+            "-c:v", "copy",
+            "-c:a", audio_codec,
+            "-shortest",
+            "-movflags", "+faststart",
+            *_size_limit(max_output_bytes),
+            output_path,
+        ])
+        _check_size(output_path, max_output_bytes)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# =============================================================================
+# Выбор движка
+# =============================================================================
+
+ENGINES: Dict[str, Callable[[str, str, int], None]] = {
+    "moviepy": convert_moviepy,
+    "ffmpeg": convert_ffmpeg,
+    "segmented": convert_segmented,
+}
+
+
+def convert_video(input_path: str, output_path: str, max_output_bytes: int = 0) -> None:
+    """Конвертирует видео в кружок движком из конфига (VIDEO_ENGINE)."""
+    ENGINES[VIDEO_ENGINE](input_path, output_path, max_output_bytes)
+
+
+def benchmark_engines(input_path: str, runs: int = 3) -> Dict[str, float]:
+    """Среднее время конвертации одного клипа каждым движком, в секундах."""
+    output_dir = Path(input_path).parent
+    results = {}
+    for name, engine in ENGINES.items():
+        output_path = str(output_dir / f"bench_{name}.mp4")
+        started = time.perf_counter()
+        for _ in range(runs):
+            engine(input_path, output_path)
+        results[name] = (time.perf_counter() - started) / runs
+        Path(output_path).unlink(missing_ok=True)
+    return results
+
+
+if __name__ == "__main__":
+    # python -m bot.video <clip.mp4> [runs]
+    clip_path = sys.argv[1]
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    for engine_name, seconds in benchmark_engines(clip_path, runs).items():
+        print(f"{engine_name:>8}: {seconds:.2f} с/клип")
@@ -0,0 +1,112 @@
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import ClientSession, web
+
+from .config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_HOST,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Принимает обновления через aiohttp-сервер вместо long polling.
+
+    Обновление обрабатывается прямо в запросе (`handle_in_background=False`):
+    если хендлер вернул метод API (например, `return message.answer(...)`),
+    он уходит в теле ответа на вебхук без отдельного запроса к Telegram.
+    Поэтому хендлеры здесь должны быть быстрыми: задачи обработки медиа
+    `_dispatch` запускает в фоне, и запрос завершается сразу после проверки файла.
+    Жизненный цикл диспетчера (startup/shutdown) привязан к приложению.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=WEBHOOK_SECRET,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Вебхук слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        if WEBHOOK_BASE_URL:
+            await bot.set_webhook(
+                url=WEBHOOK_BASE_URL + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            logger.info(f"Вебхук зарегистрирован: {WEBHOOK_BASE_URL}{WEBHOOK_PATH}")
+
+        # Работаем до отмены (Ctrl+C / остановка лаунчером)
+        await asyncio.Event().wait()
+    finally:
+        # Вебхук не снимаем: при rolling-обновлении его обслуживают другие инстансы
+        await runner.cleanup()
+
+
+# =============================================================================
+# Отправка фейковых обновлений для локальной проверки
+# =============================================================================
+
+_update_ids = itertools.count(int(time.time()))
+
+
+def fake_update(text: Optional[str] = None, callback_data: Optional[str] = None, user_id: int = 1) -> Dict[str, Any]:
+    """Минимальный Update: сообщение с текстом или нажатие инлайн-кнопки."""
+    user = {"id": user_id, "is_bot": False, "first_name": "Test"}
+    chat = {"id": user_id, "type": "private"}
+    message = {"message_id": 1, "date": int(time.time()), "chat": chat, "from": user, "text": text or ""}
+    update: Dict[str, Any] = {"update_id": next(_update_ids)}
+    if callback_data is not None:
+        update["callback_query"] = {
+            "id": str(update["update_id"]),
+            "from": user,
+            "chat_instance": str(user_id),
+            "message": {**message, "text": "menu"},
+            "data": callback_data,
+        }
+    else:
+        update["message"] = message
+    return update
+
+
+async def send_fake_update(update: Dict[str, Any], url: Optional[str] = None) -> str:
+    """POST-ит обновление на вебхук как это делает Telegram и возвращает тело ответа."""
+    url = url or f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    async with ClientSession() as session:
+        async with session.post(url, json=update, headers=headers) as response:
+            body = await response.text()
+            return f"{response.status} {body}"
+
+
+if __name__ == "__main__":
+    # python -m bot.webhook /start          — текстовое сообщение
+    # python -m bot.webhook --callback about — нажатие кнопки
+    args = sys.argv[1:]
+    if args[:1] == ["--callback"]:
+        payload = fake_update(callback_data=args[1])
+    else:
+        payload = fake_update(text=" ".join(args) or "/start")
+    print(json.dumps(payload, ensure_ascii=False))
+    print(asyncio.run(send_fake_update(payload)))
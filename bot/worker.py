@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+import socket
+import traceback
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+
+from bot.config import (
+    JOB_LEASE_SEC,
+    JOB_POLL_INTERVAL_SEC,
+    JOB_WORKER_CONCURRENCY,
+    TOKEN,
+    WORKER_METRICS_PORT,
+)
+from bot.database import db, init_db
+from bot.jobs import MediaJob, claim, complete, expire, extend_lease, fail, init_jobs_db, jobs_db
+from bot.logs import setup_logging
+from bot.metrics import start_metrics_server
+from bot.outbound import flood_control
+from bot.tasks import UPSCALE_SCHEDULER, report_failure, run_job
+
+logger = logging.getLogger(__name__)
+
+# Процесс-воркер очереди задач (PROCESSING_MODE=queue): берет задачи из
+# jobs.db, выполняет их теми же исполнителями, что и бот, и отвечает
+# пользователю напрямую через Bot API. Воркеров можно запускать сколько угодно
+
+
+async def _keep_lease(job_id: int) -> None:
+    """Продлевает аренду, пока задача выполняется: иначе ее заберет другой воркер."""
+    while True:
+        await asyncio.sleep(JOB_LEASE_SEC / 3)
+        await extend_lease(job_id)
+
+
+async def _execute(bot: Bot, job_id: int, job: MediaJob) -> None:
+    logger.info(f"Задача {job_id} ({job.kind}) от user {job.user_id}")
+    heartbeat = asyncio.create_task(_keep_lease(job_id))
+    try:
+        await run_job(bot, job)
+    except Exception:
+        logger.exception(f"Задача {job_id} завершилась ошибкой")
+        await fail(job_id, traceback.format_exc())
+        await report_failure(bot, job)
+    else:
+        await complete(job_id)
+    finally:
+        heartbeat.cancel()
+
+
+async def _loop(bot: Bot, name: str) -> None:
+    while True:
+        for job_id, job in await expire():
+            logger.warning(f"Задача {job_id} ({job.kind}) исчерпала попытки на упавших воркерах")
+            await report_failure(bot, job)
+        claimed = await claim(name)
+        if claimed is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL_SEC)
+            continue
+        await _execute(bot, *claimed)
+
+
+async def main() -> None:
+    setup_logging()
+    init_db()
+    init_jobs_db()
+    db.start()
+    UPSCALE_SCHEDULER.start()
+
+    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(flood_control)
+    metrics_runner = await start_metrics_server(WORKER_METRICS_PORT)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"🚀 Воркер {worker} запущен, параллельных задач: {JOB_WORKER_CONCURRENCY}")
+    try:
+        await asyncio.gather(*(
+            _loop(bot, f"{worker}/{slot}") for slot in range(JOB_WORKER_CONCURRENCY)
+        ))
+    finally:
+        # Незавершенные задачи остаются в running и по истечении аренды вернутся в очередь
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await UPSCALE_SCHEDULER.stop()
+        await db.close()
+        await jobs_db.close()
+        await bot.session.close()
+        logger.info("Воркер остановлен.")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Воркер остановлен вручную.")
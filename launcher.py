@@ -1,35 +1,221 @@
 import customtkinter as ctk
 import sys
+import os
 import threading
 import asyncio
-import logging
-from datetime import datetime
+import multiprocessing
+import subprocess
+import time
+import urllib.request
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-# Импортируем твоего бота
-from bot.main import main
-from bot.config import LOG_PATH
+from bot.config import METRICS_HOST, METRICS_PORT
+
+# Флаг, с которым лаунчер запускает сам себя дочерним процессом бота (в exe нет python -m)
+RUN_BOT_FLAG = "--run-bot"
+
+# Сколько строк лога держим в памяти и показываем в окне
+LOG_BUFFER_LINES = 5000
+LOG_VISIBLE_LINES = 1000
+# Как часто окно забирает новые строки и обновляет цифры (мс)
+REPAINT_MS = 250
+METRICS_POLL_SEC = 1.0
+# Пауза перед перезапуском упавшего бота: удваивается при частых падениях
+RESTART_MIN_SEC = 1
+RESTART_MAX_SEC = 60
+# Столько должен проработать бот, чтобы пауза сбросилась до минимальной
+RESTART_RESET_SEC = 60
 
 # Настройка внешнего вида (Темная тема, как в играх)
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("dark-blue")
 
-class TextRedirector(object):
-    """Класс, который перехватывает print и отправляет его в виджет окна"""
-    def __init__(self, widget, tag="stdout"):
-        self.widget = widget
-        self.tag = tag
-
-    def write(self, str):
-        self.widget.configure(state="normal")
-        # Добавляем время к каждой строке, если это не просто перенос строки
-        if str.strip():
-            timestamp = datetime.now().strftime("[%H:%M:%S] ")
-            self.widget.insert("end", timestamp + str + "\n", self.tag)
-        self.widget.see("end") # Автопрокрутка вниз
-        self.widget.configure(state="disabled")
-
-    def flush(self):
-        pass
+
+class LogBuffer:
+    """
+    Кольцевой буфер строк лога. Пишет поток чтения пайпа, читает окно по таймеру:
+    GUI не трогается из чужих потоков, а память не растет с числом строк.
+    """
+
+    def __init__(self, maxlen: int = LOG_BUFFER_LINES):
+        self._lines: deque = deque(maxlen=maxlen)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def append(self, line: str) -> None:
+        with self._lock:
+            self._lines.append(line)
+            self._total += 1
+
+    def since(self, seen: int) -> Tuple[List[str], int]:
+        """Строки, добавленные после `seen` (не больше размера буфера), и новый счетчик."""
+        with self._lock:
+            fresh = min(self._total - seen, len(self._lines))
+            lines = list(self._lines)[-fresh:] if fresh > 0 else []
+            return lines, self._total
+
+
+def _bot_command() -> List[str]:
+    if getattr(sys, "frozen", False):
+        return [sys.executable, RUN_BOT_FLAG]
+    return [sys.executable, "-m", "bot.main"]
+
+
+class BotSupervisor:
+    """Запускает бота дочерним процессом, пересылает его вывод в буфер и перезапускает при падении."""
+
+    def __init__(self, buffer: LogBuffer):
+        self.buffer = buffer
+        self.restarts = 0
+        self.started_at: Optional[float] = None
+        self._process: Optional[subprocess.Popen] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        """Процесс бота жив."""
+        return self._process is not None and self._process.poll() is None
+
+    @property
+    def active(self) -> bool:
+        """Супервизор работает: бот запущен или ждет перезапуска."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.active:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._supervise, name="bot-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """
+        Останавливает бота: terminate (на POSIX это SIGTERM, aiogram завершает
+        поллинг штатно; на Windows — сразу TerminateProcess), по таймауту kill.
+        """
+        self._stopping.set()
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _spawn(self) -> subprocess.Popen:
+        env = {**os.environ, "PYTHONUNBUFFERED": "1", "PYTHONIOENCODING": "utf-8"}
+        return subprocess.Popen(
+            _bot_command(),
+            cwd=Path(__file__).resolve().parent,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            # Без отдельного окна консоли у дочернего процесса на Windows
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+        )
+
+    def _supervise(self) -> None:
+        delay = RESTART_MIN_SEC
+        while not self._stopping.is_set():
+            self.buffer.append("[launcher] Запуск ядра бота...")
+            self.started_at = time.monotonic()
+            self._process = self._spawn()
+            for raw in self._process.stdout:
+                self.buffer.append(raw.decode("utf-8", errors="replace").rstrip())
+            code = self._process.wait()
+            uptime = time.monotonic() - self.started_at
+            self.started_at = None
+
+            if self._stopping.is_set():
+                self.buffer.append("[launcher] Бот остановлен.")
+                return
+            if code == 0:
+                # Штатный выход (например, ошибка конфигурации) — перезапуск не поможет
+                self.buffer.append("[launcher] Бот завершил работу.")
+                return
+
+            if uptime > RESTART_RESET_SEC:
+                delay = RESTART_MIN_SEC
+            self.restarts += 1
+            self.buffer.append(f"[launcher] Бот упал (код {code}), перезапуск через {delay} с")
+            self._stopping.wait(delay)
+            delay = min(delay * 2, RESTART_MAX_SEC)
+
+
+@dataclass
+class BotStats:
+    updates_per_sec: float
+    jobs_per_sec: float
+    queue_depth: float
+    in_flight: float
+    cpu_percent: float
+    rss_mb: float
+
+
+def _parse_metrics(text: str) -> Dict[str, float]:
+    """Сумма всех серий каждой метрики из текстового формата Prometheus (метки отбрасываются)."""
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        name = name.split("{", 1)[0]
+        values[name] = values.get(name, 0.0) + float(value)
+    return values
+
+
+class MetricsPoller:
+    """Фоновый опрос /metrics бота; окно читает только последний готовый снимок."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latest: Optional[BotStats] = None
+        self._previous: Optional[Tuple[float, Dict[str, float]]] = None
+        self._stopping = threading.Event()
+        threading.Thread(target=self._poll, name="metrics-poller", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _poll(self) -> None:
+        while not self._stopping.wait(METRICS_POLL_SEC):
+            try:
+                with urllib.request.urlopen(self.url, timeout=METRICS_POLL_SEC) as response:
+                    values = _parse_metrics(response.read().decode())
+            except (OSError, ValueError):
+                # Бот еще не поднялся или перезапускается
+                self.latest, self._previous = None, None
+                continue
+            now = time.monotonic()
+            if self._previous is not None:
+                self.latest = self._derive(now, values, *self._previous)
+            self._previous = (now, values)
+
+    @staticmethod
+    def _derive(now: float, values: Dict[str, float], then: float, before: Dict[str, float]) -> BotStats:
+        elapsed = now - then
+
+        def rate(name: str) -> float:
+            # Счетчик мог обнулиться при перезапуске бота
+            return max(0.0, values.get(name, 0.0) - before.get(name, 0.0)) / elapsed
+
+        return BotStats(
+            updates_per_sec=rate("bot_updates_total"),
+            jobs_per_sec=rate("bot_jobs_total"),
+            # Очередь планировщика (inline) или jobs.db (режим queue)
+            queue_depth=values.get("bot_upscale_queue_depth", 0.0) + values.get("bot_jobs_queued", 0.0),
+            in_flight=values.get("bot_jobs_in_flight", 0.0),
+            cpu_percent=rate("process_cpu_seconds_total") * 100,
+            rss_mb=values.get("process_resident_memory_bytes", 0.0) / (1024 * 1024),
+        )
+
 
 class BotLauncher(ctk.CTk):
     def __init__(self):
@@ -37,20 +223,43 @@ class BotLauncher(ctk.CTk):
 
         # 1. Настройка окна
         self.title("MaximusBot Launcher")
-        self.geometry("700x500")
+        self.geometry("820x560")
         self.resizable(False, False)
 
         # 2. Заголовок
         self.header = ctk.CTkLabel(self, text="🚀 MAXIMUS BOT CONTROL", font=("Roboto Medium", 20))
         self.header.pack(pady=10)
 
-        # 3. Консоль (Текстовое поле)
+        # 3. Панель с живыми цифрами бота
+        self.stats_frame = ctk.CTkFrame(self)
+        self.stats_frame.pack(padx=20, fill="x")
+        self.stats_labels: Dict[str, ctk.CTkLabel] = {}
+        for column, (key, title) in enumerate([
+            ("state", "Статус"),
+            ("uptime", "Аптайм"),
+            ("restarts", "Перезапуски"),
+            ("updates", "Обновл./с"),
+            ("jobs", "Задач/с"),
+            ("queue", "Очередь / в работе"),
+            ("cpu", "CPU"),
+            ("rss", "RSS"),
+        ]):
+            ctk.CTkLabel(self.stats_frame, text=title, font=("Roboto", 11), text_color="gray").grid(
+                row=0, column=column, padx=8, pady=(6, 0)
+            )
+            label = ctk.CTkLabel(self.stats_frame, text="—", font=("Consolas", 14))
+            label.grid(row=1, column=column, padx=8, pady=(0, 6))
+            self.stats_labels[key] = label
+        for column in range(len(self.stats_labels)):
+            self.stats_frame.grid_columnconfigure(column, weight=1)
+
+        # 4. Консоль (Текстовое поле)
         self.console_frame = ctk.CTkFrame(self)
         self.console_frame.pack(pady=10, padx=20, fill="both", expand=True)
 
         self.console = ctk.CTkTextbox(
-            self.console_frame, 
-            font=("Consolas", 12), 
+            self.console_frame,
+            font=("Consolas", 12),
             text_color="#00FF00", # Зеленый текст хакера
             fg_color="black"      # Черный фон
         )
@@ -58,44 +267,105 @@ class BotLauncher(ctk.CTk):
         self.console.insert("0.0", "System initialized...\nWaiting for start...\n")
         self.console.configure(state="disabled")
 
-        # 4. Кнопки управления
+        # 5. Кнопки управления
         self.btn_frame = ctk.CTkFrame(self, fg_color="transparent")
         self.btn_frame.pack(pady=20)
 
-        self.start_btn = ctk.CTkButton(self.btn_frame, text="ЗАПУСТИТЬ БОТА", command=self.start_bot_thread, width=200, height=40)
+        self.start_btn = ctk.CTkButton(self.btn_frame, text="ЗАПУСТИТЬ БОТА", command=self.toggle_bot, width=200, height=40)
         self.start_btn.pack(side="left", padx=10)
 
         self.stop_btn = ctk.CTkButton(self.btn_frame, text="ВЫХОД", command=self.on_close, width=100, height=40, fg_color="#550000", hover_color="#880000")
         self.stop_btn.pack(side="left", padx=10)
 
-        # Перенаправление потоков
-        sys.stdout = TextRedirector(self.console, "stdout")
-        sys.stderr = TextRedirector(self.console, "stderr")
-        
-        # Настройка логгера, чтобы он тоже писал сюда
-        logging.basicConfig(stream=sys.stdout, level=logging.INFO)
-
-    def start_bot_thread(self):
-        self.start_btn.configure(state="disabled", text="БОТ РАБОТАЕТ...")
-        print("Запуск ядра бота...")
-        
-        # Запускаем бота в отдельном потоке, чтобы окно не зависло
-        thread = threading.Thread(target=self.run_async_bot, daemon=True)
-        thread.start()
-
-    def run_async_bot(self):
-        # Создаем новый цикл событий для потока
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(main())
-        except Exception as e:
-            print(f"CRITICAL ERROR: {e}")
+        # Бот работает в отдельном процессе: окно не делит с ним GIL и event loop,
+        # а его вывод приходит через пайп в кольцевой буфер
+        self.log_buffer = LogBuffer()
+        self.supervisor = BotSupervisor(self.log_buffer)
+        self._seen_lines = 0
+        host = "127.0.0.1" if METRICS_HOST in ("0.0.0.0", "") else METRICS_HOST
+        self.metrics = MetricsPoller(f"http://{host}:{METRICS_PORT}/metrics") if METRICS_PORT else None
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(REPAINT_MS, self.repaint)
+
+    def toggle_bot(self):
+        if self.supervisor.active:
+            self.start_btn.configure(state="disabled", text="ОСТАНОВКА...")
+            # Остановка ждет завершения процесса — не в потоке окна
+            threading.Thread(target=self.supervisor.stop, daemon=True).start()
+        else:
+            self.supervisor.start()
+            self.start_btn.configure(text="ОСТАНОВИТЬ БОТА")
+
+    def repaint(self):
+        """Раз в REPAINT_MS: новые строки лога одной вставкой и обновление панели."""
+        lines, self._seen_lines = self.log_buffer.since(self._seen_lines)
+        if lines:
+            self.console.configure(state="normal")
+            self.console.insert("end", "\n".join(lines) + "\n")
+            # Окно показывает только хвост лога: длинный текстовый виджет тормозит
+            excess = int(self.console.index("end-1c").split(".")[0]) - LOG_VISIBLE_LINES
+            if excess > 0:
+                self.console.delete("1.0", f"{excess + 1}.0")
+            self.console.see("end")
+            self.console.configure(state="disabled")
+        self._update_stats()
+        self.after(REPAINT_MS, self.repaint)
+
+    def _update_stats(self):
+        running = self.supervisor.running
+        started_at = self.supervisor.started_at
+        labels = self.stats_labels
+        if running:
+            state = "🟢 работает"
+        elif self.supervisor.active:
+            state = "🟡 перезапуск"
+        else:
+            state = "⚪ остановлен"
+        labels["state"].configure(text=state)
+        labels["uptime"].configure(
+            text=time.strftime("%H:%M:%S", time.gmtime(time.monotonic() - started_at)) if started_at else "—"
+        )
+        labels["restarts"].configure(text=str(self.supervisor.restarts))
+
+        stats = self.metrics.latest if self.metrics and running else None
+        if stats is None:
+            for key in ("updates", "jobs", "queue", "cpu", "rss"):
+                labels[key].configure(text="—")
+        else:
+            labels["updates"].configure(text=f"{stats.updates_per_sec:.1f}")
+            labels["jobs"].configure(text=f"{stats.jobs_per_sec:.2f}")
+            labels["queue"].configure(text=f"{stats.queue_depth:.0f} / {stats.in_flight:.0f}")
+            labels["cpu"].configure(text=f"{stats.cpu_percent:.0f}%")
+            labels["rss"].configure(text=f"{stats.rss_mb:.0f} МБ")
+
+        # Кнопка возвращается в «запустить», когда супервизор завершился (остановка или выход бота)
+        if not self.supervisor.active and self.start_btn.cget("text") != "ЗАПУСТИТЬ БОТА":
+            self.start_btn.configure(state="normal", text="ЗАПУСТИТЬ БОТА")
 
     def on_close(self):
+        self.supervisor.stop()
+        if self.metrics:
+            self.metrics.stop()
         self.destroy()
         sys.exit()
 
+
+def run_bot() -> None:
+    """Точка входа дочернего процесса бота (в собранном exe)."""
+    from bot.main import main
+
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
 if __name__ == "__main__":
-    app = BotLauncher()
-    app.mainloop()
\ No newline at end of file
+    # Нужно для дочерних процессов апскейла в собранном exe (PyInstaller)
+    multiprocessing.freeze_support()
+    if RUN_BOT_FLAG in sys.argv:
+        run_bot()
+    else:
+        app = BotLauncher()
+        app.mainloop()